@@ -0,0 +1,650 @@
+"""
+Benchmarks for the regex pipeline.
+
+Usage:
+  python bench.py [parse|minimize|determinize|batch|simplify|construction|counters|captures|ops|shm|parallel|utf8|suite]...
+  python bench.py suite [--json PATH] [--compare BASELINE] [--threshold RATIO]
+
+The suite times every pipeline stage on scaling families of patterns and
+records state counts and peak memory. --json saves its results, and
+--compare reports the results that are worse than a saved baseline, exiting
+with status 1 if there are any.
+"""
+import argparse
+import cPickle
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import resource
+import sys
+import time
+
+import fsa
+import ops
+import parallel
+import parse
+import pipeline
+import shm
+import simplify
+import stats
+import stream
+import tdfa
+
+
+def best_time(func, *args, **kwargs):
+    repeat = kwargs.pop('repeat', 3)
+    best = None
+    for _ in xrange(repeat):
+        start = time.time()
+        func(*args)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def long_concat(n):
+    return ('abcdefgh' * (n // 8 + 1))[:n]
+
+
+def nested_groups(n):
+    depth = n // 3
+    return '(' * depth + 'a' + ')*' * depth
+
+
+def mixed(n):
+    return 'a(b|cd)*e?' * (n // 10)
+
+
+PARSE_FAMILIES = [
+    ('concat', long_concat),
+    ('nested', nested_groups),
+    ('mixed', mixed),
+]
+
+
+def bench_parse(sizes=(3125, 6250, 12500, 25000, 50000)):
+    print '{:<8} {:>8} {:>10} {:>12}'.format('family', 'length', 'seconds', 'us/char')
+    for name, family in PARSE_FAMILIES:
+        for n in sizes:
+            pattern = family(n)
+            elapsed = best_time(parse.from_string, pattern)
+            print '{:<8} {:>8} {:>10.4f} {:>12.3f}'.format(
+                name, len(pattern), elapsed, elapsed * 1e6 / len(pattern))
+
+
+def nth_from_last(n):
+    return '(a|b)*a' + '(a|b)' * n
+
+
+def word_alternation(n, seed=0):
+    rng = random.Random(seed)
+    words = [''.join(rng.choice('abcdefgh') for _ in xrange(rng.randint(4, 12)))
+             for _ in xrange(n)]
+    return '|'.join(words)
+
+
+MINIMIZE_FAMILIES = [
+    ('nth', nth_from_last, (8, 10, 12, 13)),
+    ('words', word_alternation, (500, 1000, 2000, 4000)),
+]
+
+
+def bench_minimize():
+    # regex_to_nfa recurses once per node of the left-deep alternation tree
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+    print '{:<8} {:>6} {:>10} {:>10} {:>10}'.format(
+        'family', 'n', 'states', 'minimized', 'seconds')
+    for name, family, sizes in MINIMIZE_FAMILIES:
+        for n in sizes:
+            dfa = fsa.nfa_to_dfa(fsa.regex_to_nfa(parse.from_string(family(n))))
+            start = time.time()
+            mdfa = fsa.minimize_dfa(dfa)
+            elapsed = time.time() - start
+            print '{:<8} {:>6} {:>10} {:>10} {:>10.4f}'.format(
+                name, n, len(dfa.states), len(mdfa.states), elapsed)
+
+
+def frozenset_subset_construction(nfa):
+    """
+    The subset construction as nfa_to_dfa did it before bitsets: every
+    transition recomputes and hashes a frozenset closure of NFAState objects.
+    Only the number of DFA states is returned.
+    """
+    nfa.finish()
+    start = frozenset(fsa.find_nfa_closure([nfa.start]))
+    seen = {start}
+    pending = [start]
+    while pending:
+        nfa_states = pending.pop()
+        moves = {}
+        for state in nfa_states:
+            for token, state1 in state.traverse():
+                if token != fsa.EMPTY_TOKEN:
+                    moves.setdefault(token, set()).add(state1)
+        for move in moves.itervalues():
+            nfa_states1 = frozenset(fsa.find_nfa_closure(move))
+            if nfa_states1 not in seen:
+                seen.add(nfa_states1)
+                pending.append(nfa_states1)
+    return len(seen)
+
+
+DETERMINIZE_FAMILIES = [
+    ('nth', nth_from_last, (8, 10, 12, 13)),
+    ('words', word_alternation, (1000, 2000, 4000)),
+]
+
+
+def bench_determinize():
+    sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+    print '{:<8} {:>6} {:>10} {:>10} {:>12} {:>12}'.format(
+        'family', 'n', 'nfa', 'dfa', 'nfa_to_dfa', 'frozenset')
+    for name, family, sizes in DETERMINIZE_FAMILIES:
+        for n in sizes:
+            node = parse.from_string(family(n))
+            nfa = fsa.regex_to_nfa(node)
+            nfa.finish()
+            start = time.time()
+            dfa = fsa.nfa_to_dfa(nfa)
+            elapsed = time.time() - start
+            start = time.time()
+            frozenset_subset_construction(fsa.regex_to_nfa(node))
+            reference_elapsed = time.time() - start
+            print '{:<8} {:>6} {:>10} {:>10} {:>12.4f} {:>12.4f}'.format(
+                name, n, len(nfa.states), len(dfa.states), elapsed, reference_elapsed)
+
+
+def random_ids(n, seed=0):
+    rng = random.Random(seed)
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    return [rng.choice(letters) + rng.choice(letters) +
+            ''.join(rng.choice('0123456789') for _ in xrange(rng.randint(4, 12)))
+            for _ in xrange(n)]
+
+
+def bench_batch(sizes=(10000, 100000, 1000000)):
+    try:
+        import batch
+    except ImportError:
+        print 'batch: NumPy is not installed'
+        return
+    compiled = pipeline.compile('[A-Z][A-Z][0-9]+')
+    matcher = batch.BatchMatcher(compiled)
+    print '{:>8} {:>10} {:>12} {:>12}'.format('strings', 'chars', 'Mchar/s', 'loop Mchar/s')
+    for n in sizes:
+        strings = random_ids(n)
+        chars = sum(len(s) for s in strings)
+        elapsed = best_time(matcher.fullmatch, strings)
+        loop_elapsed = best_time(lambda: [compiled.fullmatch(s) for s in strings], repeat=1)
+        print '{:>8} {:>10} {:>12.2f} {:>12.2f}'.format(
+            n, chars, chars / elapsed / 1e6, chars / loop_elapsed / 1e6)
+
+
+def shared_prefix_words(n, seed=0):
+    # Words over few letters, so that many share prefixes and some repeat
+    rng = random.Random(seed)
+    return '|'.join(''.join(rng.choice('abc') for _ in xrange(rng.randint(3, 8)))
+                    for _ in xrange(n))
+
+
+def stacked_unary(n):
+    return '(a+?|b*+|ab)*?c' * (n // 15)
+
+
+SIMPLIFY_FAMILIES = [
+    ('words', shared_prefix_words, (100, 1000, 4000)),
+    ('unary', stacked_unary, (150, 1500)),
+    ('nth', nth_from_last, (8, 12)),
+]
+
+
+def bench_simplify():
+    print '{:<8} {:>6} {:>8} {:>8} {:>12} {:>12}'.format(
+        'family', 'n', 'nfa', 'simple', 'nfa_to_dfa', 'simplified')
+    for name, family, sizes in SIMPLIFY_FAMILIES:
+        for n in sizes:
+            node = parse.from_string(family(n))
+            row = []
+            for tree in (node, simplify.simplify(node)):
+                nfa = fsa.regex_to_nfa(tree)
+                nfa.finish()
+                start = time.time()
+                fsa.nfa_to_dfa(nfa)
+                row.append((len(nfa.states), time.time() - start))
+            print '{:<8} {:>6} {:>8} {:>8} {:>12.4f} {:>12.4f}'.format(
+                name, n, row[0][0], row[1][0], row[0][1], row[1][1])
+
+
+# Patterns on which a backtracking matcher takes exponential time, with the
+# character their failing texts are made of
+CAPTURE_FAMILIES = [
+    ('(a|aa)*c', 'a', (16, 20, 24, 28)),
+    ('(x+x+)+y', 'x', (12, 15, 18, 21)),
+]
+
+
+def bench_captures():
+    print '{:<12} {:>8} {:>10} {:>10}'.format('pattern', 'n', 're', 'tdfa')
+    for pattern, char, sizes in CAPTURE_FAMILIES:
+        expected = re.compile(pattern)
+        compiled = tdfa.compile(pattern)
+        for n in sizes:
+            text = char * n
+            print '{:<12} {:>8} {:>10.6f} {:>10.6f}'.format(
+                pattern, n, best_time(expected.match, text), best_time(compiled.match, text))
+    # Throughput on a long match, where re is not exponential
+    pattern = '(ab|a)*(b*)c'
+    expected = re.compile(pattern)
+    compiled = tdfa.compile(pattern)
+    for n in (10000, 100000, 1000000):
+        text = ('ab' * n)[:n] + 'c'
+        try:
+            re_time = '{:>10.4f}'.format(best_time(expected.match, text))
+        except RuntimeError:
+            # Python 2 re gives up on too many nested repeats
+            re_time = '{:>10}'.format('error')
+        print '{:<12} {:>8} {} {:>10.4f}'.format(
+            pattern, n, re_time, best_time(compiled.match, text))
+
+
+def _nfa(pattern, simplified=False):
+    node = parse.from_string(pattern)
+    if simplified:
+        node = simplify.simplify(node)
+    nfa = fsa.regex_to_nfa(node)
+    nfa.finish()
+    return nfa
+
+
+# Pairs of patterns checked for equivalence; True to simplify the second
+EQUIVALENCE_CASES = [
+    ('nth same', nth_from_last(12), '(b|a)*a' + '[ab]' * 12, False),
+    ('nth differ', nth_from_last(12), nth_from_last(11), False),
+    ('words same', word_alternation(2000), word_alternation(2000), True),
+    ('words differ', word_alternation(2000), word_alternation(2000) + '|zz', False),
+]
+
+
+def bench_ops():
+    # ops.counterexample on the NFAs against determinizing and minimizing
+    # both patterns
+    print '{:<14} {:>14} {:>10} {:>10}'.format('case', 'counterexample', 'ops', 'minimize')
+    for name, pattern1, pattern2, simplified in EQUIVALENCE_CASES:
+        nfa1, nfa2 = _nfa(pattern1), _nfa(pattern2, simplified)
+        start = time.time()
+        word = ops.counterexample(nfa1, nfa2)
+        ops_time = time.time() - start
+        nfa1, nfa2 = _nfa(pattern1), _nfa(pattern2, simplified)
+        start = time.time()
+        fsa.minimize_dfa(fsa.nfa_to_dfa(nfa1))
+        fsa.minimize_dfa(fsa.nfa_to_dfa(nfa2))
+        print '{:<14} {:>14} {:>10.4f} {:>10.4f}'.format(
+            name, repr(word)[:14], ops_time, time.time() - start)
+
+
+def private_kb():
+    # The resident memory of this process that is not shared (Linux only)
+    with open('/proc/self/statm') as f:
+        resident, shared = map(int, f.read().split()[1:3])
+    return (resident - shared) * os.sysconf('SC_PAGE_SIZE') // 1024
+
+
+def shm_worker(mode, source, text):
+    """
+    Get the DFA from source, a shared memory segment name (attached with or
+    without checking the table) or a pickled CompiledDFA, and match text
+    with it, visiting every state. Return the seconds taken to get the DFA
+    and the private memory it added.
+    """
+    before = private_kb()
+    start = time.time()
+    if mode in ('attach', 'verify'):
+        compiled = shm.attach(source, verify=mode == 'verify')
+    else:
+        compiled = cPickle.loads(source)
+    seconds = time.time() - start
+    assert compiled.fullmatch(text)
+    return seconds, private_kb() - before
+
+
+def _shm_worker(args):
+    return shm_worker(*args)
+
+
+def bench_shm(sizes=(5000, 20000, 80000)):
+    # A long concatenation of distinct letters: one state per character and
+    # a column per letter, so the table is 27 * 4 bytes per character
+    print '{:<8} {:>10} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12}'.format(
+        'n', 'table_kb', 'attach_s', 'attach_kb', 'verify_s', 'verify_kb',
+        'unpickle_s', 'unpickle_kb')
+    for n in sizes:
+        text = ('abcdefghijklmnopqrstuvwxyz' * (n // 26 + 1))[:n]
+        compiled = pipeline.compile(text)
+        row = []
+        with shm.exported(compiled) as name:
+            for mode, source in (('attach', name), ('verify', name),
+                                 ('pickle', cPickle.dumps(compiled, 2))):
+                pool = multiprocessing.Pool(1)
+                try:
+                    row.extend(pool.apply(_shm_worker, [(mode, source, text)]))
+                finally:
+                    pool.close()
+                    pool.join()
+        print '{:<8} {:>10} {:>12.6f} {:>12} {:>12.6f} {:>12} {:>12.6f} {:>12}'.format(
+            n, len(compiled.table) * 4 // 1024, *row)
+
+
+def _scan_pickled(compiled, text, chunk_size):
+    # The chunks of text pickled to the workers, as parallel.scan does for a
+    # unicode text
+    tasks = [(offset, text[offset:offset + chunk_size], False)
+             for offset in xrange(0, len(text), chunk_size)]
+    return parallel.compose(compiled, parallel._scan(
+        compiled, tasks, None, parallel._init_worker, (None,)), False)
+
+
+def bench_parallel(sizes=(1 << 20, 1 << 22, 1 << 24), chunk_size=1 << 18):
+    # parallel.scan hands a byte text to its workers through one shared copy;
+    # pickling the chunks instead copies each of them twice more. The copy_
+    # columns time the hand-over alone.
+    compiled = parallel.search_dfa('ab+c')
+    print '{:<10} {:>10} {:>10} {:>10} {:>10} {:>12}'.format(
+        'n', 'shared_s', 'pickled_s', 'copy_sh_s', 'copy_pk_s', 'pickled_kb')
+
+    def share(text):
+        with parallel._shared_text(text):
+            pass
+
+    def pickle_chunks(text):
+        return [cPickle.loads(cPickle.dumps(text[offset:offset + chunk_size], 2))
+                for offset in xrange(0, len(text), chunk_size)]
+
+    for n in sizes:
+        text = ('abbbc' * (n // 5 + 1))[:n]
+        pickled_kb = sum(len(cPickle.dumps(text[offset:offset + chunk_size], 2))
+                         for offset in xrange(0, n, chunk_size)) // 1024
+        print '{:<10} {:>10.4f} {:>10.4f} {:>10.4f} {:>10.4f} {:>12}'.format(
+            n, best_time(parallel.scan, compiled, text, chunk_size, repeat=1),
+            best_time(_scan_pickled, compiled, text, chunk_size, repeat=1),
+            best_time(share, text), best_time(pickle_chunks, text), pickled_kb)
+
+
+def bench_utf8(sizes=(10000, 100000, 1000000)):
+    # Cyrillic words: two bytes per letter. The character DFA needs the text
+    # decoded first; the byte DFA matches the encoded text as it is.
+    pattern = u'[\u0400-\u04ff ]+'
+    chars = pipeline.compile(pattern)
+    utf8_bytes = pipeline.compile(pattern, utf8=True)
+    print 'columns: {} characters, {} bytes'.format(len(chars.tokens), len(utf8_bytes.tokens))
+    print '{:<8} {:>12} {:>10} {:>10} {:>10}'.format(
+        'n', 'decode', 'str', 'bytearray', 'memoryview')
+    for n in sizes:
+        data = (u'\u043f\u0440\u0438\u0432\u0435\u0442 ' * (n // 7 + 1))[:n].encode('utf-8')
+        print '{:<8} {:>12.4f} {:>10.4f} {:>10.4f} {:>10.4f}'.format(
+            n, best_time(lambda: chars.match(data.decode('utf-8'))),
+            best_time(utf8_bytes.match, data),
+            best_time(utf8_bytes.match, bytearray(data)),
+            best_time(utf8_bytes.match, memoryview(data)))
+
+
+def nested_stars(n):
+    return '(' * n + 'a' + ')*' * n
+
+
+def wide_alternation(n):
+    return word_alternation(n, seed=1)
+
+
+def repeated_shape(n):
+    return 'a(bcd*|efgh?(jk)+)*' * n
+
+
+def bounded_repeat(n):
+    return '[ab]{0,%d}' % n
+
+
+def optional_repeat(n):
+    return '(a?){0,%d}' % n
+
+
+def star_repeat(n):
+    return '(a*){0,%d}' % n
+
+
+SUITE_FAMILIES = [
+    ('nth', nth_from_last, (4, 8, 12)),
+    ('nested', nested_stars, (10, 100, 1000)),
+    ('concat', long_concat, (1000, 10000, 50000)),
+    ('alternation', wide_alternation, (100, 500, 2000)),
+    ('shape', repeated_shape, (1, 10, 100)),
+    ('repeat', bounded_repeat, (500, 1000, 5000)),
+    ('repeat_optional', optional_repeat, (500, 1000, 5000)),
+    ('repeat_star', star_repeat, (500, 1000, 5000)),
+]
+
+# The metrics of a suite result that are compared with a baseline
+SUITE_TIMES = ['parse', 'nfa', 'dfa', 'minimize', 'compile', 'match']
+SUITE_COUNTS = ['nfa_states', 'dfa_states', 'mdfa_states']
+
+MATCH_TEXT_LENGTH = 20000
+
+
+def match_text(pattern, seed=0):
+    chars = sorted(set(pattern) - set('()|*+?[]{},0123456789'))
+    rng = random.Random(seed)
+    return ''.join(rng.choice(chars) for _ in xrange(MATCH_TEXT_LENGTH))
+
+
+def run_case(family, n):
+    """
+    Time each stage on family(n); run in a fresh process, so that the peak
+    memory is that of this case only.
+    """
+    pattern = dict((name, f) for name, f, _ in SUITE_FAMILIES)[family](n)
+    result = {'family': family, 'n': n, 'length': len(pattern)}
+    start = time.time()
+    node = parse.from_string(pattern)
+    result['parse'] = time.time() - start
+    start = time.time()
+    nfa = fsa.regex_to_nfa(node)
+    nfa.finish()
+    result['nfa'] = time.time() - start
+    start = time.time()
+    dfa = fsa.nfa_to_dfa(nfa)
+    result['dfa'] = time.time() - start
+    start = time.time()
+    mdfa = fsa.minimize_dfa(dfa)
+    result['minimize'] = time.time() - start
+    start = time.time()
+    compiled = mdfa.compile()
+    result['compile'] = time.time() - start
+    text = match_text(pattern)
+    start = time.time()
+    matcher = stream.StreamMatcher(compiled)
+    matcher.feed(text)
+    matcher.finish()
+    result['match'] = time.time() - start
+    result['nfa_states'] = len(nfa.states)
+    result['dfa_states'] = len(dfa.states)
+    result['mdfa_states'] = len(mdfa.states)
+    result['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return result
+
+
+def _run_case(args):
+    return run_case(*args)
+
+
+def run_construction(family, n, construction):
+    """
+    Time building the DFA of family(n) with the given pipeline construction;
+    run in a fresh process, as run_case.
+    """
+    pattern = dict((name, f) for name, f, _ in SUITE_FAMILIES)[family](n)
+    node = parse.from_string(pattern)
+    with stats.collect() as collected:
+        start = time.time()
+        if construction == 'glushkov':
+            dfa = fsa.regex_to_dfa(node)
+        else:
+            nfa = fsa.regex_to_nfa(node)
+            nfa.finish()
+            dfa = fsa.nfa_to_dfa(nfa)
+        seconds = time.time() - start
+    counters = collected.counters
+    if construction == 'glushkov':
+        # A position and its followpos set against an NFA state and its edges
+        intermediate = counters['positions'] + counters['followpos_edges']
+    else:
+        intermediate = counters['nfa_states'] + counters['nfa_edges']
+    return (seconds, intermediate, len(dfa.states),
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+
+def _run_construction(args):
+    return run_construction(*args)
+
+
+def bench_construction():
+    print '{:<12} {:>6} {:>10} {:>10} {:>9} {:>9} {:>9} {:>9} {:>7}'.format(
+        'family', 'n', 'thompson', 'glushkov', 'nfa', 'positions',
+        'rss_kb', 'rss_kb', 'dfa')
+    for family, _, sizes in SUITE_FAMILIES:
+        for n in sizes:
+            row = []
+            for construction in pipeline.CONSTRUCTIONS:
+                pool = multiprocessing.Pool(1)
+                try:
+                    row.append(pool.apply(_run_construction, [(family, n, construction)]))
+                finally:
+                    pool.close()
+                    pool.join()
+            (time1, size1, states1, rss1), (time2, size2, states2, rss2) = row
+            print '{:<12} {:>6} {:>10.4f} {:>10.4f} {:>9} {:>9} {:>9} {:>9} {:>7}'.format(
+                family, n, time1, time2, size1, size2, rss1, rss2, states2)
+
+
+def bench_counters(sizes=(100, 1000, 10000)):
+    # Bounded repeats built as copies of the operand and with counters. The
+    # counted NFA keeps one copy, at the price of a slower simulation; the
+    # text is a single run of the operand, matched from the start.
+    print '{:<20} {:>6} {:>9} {:>9} {:>10} {:>10} {:>10} {:>10}'.format(
+        'pattern', 'n', 'nfa', 'counted', 'build', 'build_cnt', 'match', 'match_cnt')
+    for template, unit in (('[ab]{{0,{}}}c', 'ab'), ('(abc|def){{0,{}}}', 'abc')):
+        for n in sizes:
+            node = parse.from_string(template.format(n))
+            text = unit * (n // len(unit))
+            row = []
+            for counters in (False, True):
+                nfa = fsa.regex_to_nfa(node, counters=counters)
+                nfa.finish()
+                row.extend([len(nfa.states),
+                            best_time(lambda: fsa.NFAMatcher(fsa.regex_to_nfa(node, counters=counters))),
+                            best_time(fsa.NFAMatcher(nfa).match, text)])
+            print '{:<20} {:>6} {:>9} {:>9} {:>10.4f} {:>10.4f} {:>10.4f} {:>10.4f}'.format(
+                template.format('n'), n, row[0], row[3], row[1], row[4], row[2], row[5])
+
+
+def run_suite():
+    print '{:<12} {:>6} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8} {:>7} {:>7} {:>9}'.format(
+        'family', 'n', 'parse', 'nfa', 'dfa', 'minimize', 'compile', 'match',
+        'nfa', 'dfa', 'mdfa', 'rss_kb')
+    results = []
+    for family, _, sizes in SUITE_FAMILIES:
+        for n in sizes:
+            pool = multiprocessing.Pool(1)
+            try:
+                result = pool.apply(_run_case, [(family, n)])
+            finally:
+                pool.close()
+                pool.join()
+            print ('{:<12} {:>6} ' + '{:>8.4f} ' * 6 + '{:>7} {:>7} {:>7} {:>9}').format(
+                family, n, *([result[key] for key in SUITE_TIMES + SUITE_COUNTS] +
+                             [result['max_rss_kb']]))
+            results.append(result)
+    return {'python': platform.python_version(), 'results': results}
+
+
+def compare(baseline, current, threshold=1.25, min_seconds=0.005):
+    """
+    Return a line for each metric of current worse than in baseline: a time
+    or the peak memory more than threshold times higher (ignoring times both
+    below min_seconds), or a larger state count.
+    """
+    baseline_results = dict(((r['family'], r['n']), r) for r in baseline['results'])
+    regressions = []
+    for result in current['results']:
+        old = baseline_results.get((result['family'], result['n']))
+        if old is None:
+            continue
+        name = '{} n={}'.format(result['family'], result['n'])
+        for key in SUITE_TIMES:
+            if (result[key] > old[key] * threshold and
+                    max(result[key], old[key]) >= min_seconds):
+                regressions.append('{} {}: {:.4f}s -> {:.4f}s'.format(
+                    name, key, old[key], result[key]))
+        for key in SUITE_COUNTS:
+            if result[key] > old[key]:
+                regressions.append('{} {}: {} -> {}'.format(name, key, old[key], result[key]))
+        if result['max_rss_kb'] > old['max_rss_kb'] * threshold:
+            regressions.append('{} max_rss_kb: {} -> {}'.format(
+                name, old['max_rss_kb'], result['max_rss_kb']))
+    return regressions
+
+
+def bench_suite(json_path=None, baseline_path=None, threshold=1.25):
+    current = run_suite()
+    if json_path is not None:
+        with open(json_path, 'w') as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+    if baseline_path is not None:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, current, threshold)
+        for line in regressions:
+            print 'REGRESSION', line
+        if regressions:
+            exit(1)
+
+
+BENCHMARKS = {
+    'parse': bench_parse,
+    'minimize': bench_minimize,
+    'determinize': bench_determinize,
+    'batch': bench_batch,
+    'simplify': bench_simplify,
+    'construction': bench_construction,
+    'counters': bench_counters,
+    'captures': bench_captures,
+    'ops': bench_ops,
+    'shm': bench_shm,
+    'parallel': bench_parallel,
+    'utf8': bench_utf8,
+    'suite': bench_suite,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(usage=__doc__.strip())
+    parser.add_argument('names', nargs='*')
+    parser.add_argument('--json')
+    parser.add_argument('--compare')
+    parser.add_argument('--threshold', type=float, default=1.25)
+    args = parser.parse_args()
+    names = args.names or sorted(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            exit(__doc__.strip())
+    for name in names:
+        if name == 'suite':
+            bench_suite(args.json, args.compare, args.threshold)
+        else:
+            BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main()
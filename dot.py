@@ -1,142 +1,234 @@
 import fsa
 
 
-class DotNode(object):
-    def __init__(self, **attrs):
-        self.attrs = attrs
-        self.id = None
-
-
-class DotEdge(object):
-    def __init__(self, node1, node2, **attrs):
-        self.node1 = node1
-        self.node2 = node2
-        self.attrs = attrs
-
-
 class DotGraph(object):
-    def __init__(self, title=""):
+    """
+    A Graphviz graph whose body lines are generated by generate_body() as the
+    automaton is walked, so that writing a large one holds the edges of one
+    state at a time rather than the whole graph.
+    """
+    def __init__(self, title, generate_body):
         """
         :type title: str
-        :type self.nodes: dict[str, DotNode]
-        :type self.edges: list[DotEdge]
+        :type generate_body: () -> Iterator[str]
         """
         self.title = title
-        self.nodes = {}
-        self.edges = []
-        self._current_id = 0
-
-    def add_node(self, *args, **kwargs):
-        """:rtype: DotNode"""
-        node = DotNode(*args, **kwargs)
-        node.id = self._current_id
-        self._current_id += 1
-        self.nodes[node.id] = node
-        return node
-
-    def add_edge(self, *args, **kwargs):
-        """:rtype: DotEdge"""
-        edge = DotEdge(*args, **kwargs)
-        self.edges.append(edge)
-        return edge
+        self._generate_body = generate_body
+
+    def iter_lines(self):
+        yield 'digraph {'
+        yield '  rankdir=LR'
+        for line in self._generate_body():
+            yield line
+        yield '}'
 
     def format(self):
-        lines = [
-            'digraph {',
-            '  rankdir=LR',
-        ]
-        for node in self.nodes.itervalues():
-            lines.append('  S{}[{}]'.format(
-                node.id, self._format_attrs(node.attrs)))
-        for edge in self.edges:
-            lines.append('  S{}->S{}[{}]'.format(
-                edge.node1.id, edge.node2.id, self._format_attrs(edge.attrs)))
-        lines.append('}')
-        return '\n'.join(lines)
-
-    @staticmethod
-    def _format_attrs(attrs):
-        return ','.join('{}="{}"'.format(k, v) for k, v in attrs.iteritems())
+        return '\n'.join(self.iter_lines())
+
+    def write(self, f):
+        """
+        Write the graph to the file object f a line at a time.
+        """
+        for line in self.iter_lines():
+            f.write(line)
+            f.write('\n')
 
     def save(self, path):
-        open(path, 'w').write(self.format())
+        with open(path, 'w') as f:
+            self.write(f)
+
+
+def _format_attrs(attrs):
+    return ','.join('{}="{}"'.format(k, str(v).replace('"', '\\"'))
+                    for k, v in attrs.iteritems())
+
+
+def _node_line(name, **attrs):
+    return '  {}[{}]'.format(name, _format_attrs(attrs))
+
+
+def _edge_line(name1, name2, **attrs):
+    return '  {}->{}[{}]'.format(name1, name2, _format_attrs(attrs))
+
+
+# The node of the start arrow, and the one standing for the states past
+# max_states
+START_NODE = 'start'
+OMITTED_NODE = 'omitted'
 
 
-def nfa_to_dot(nfa):
+def _state_node(state):
+    return 'S{}'.format(state.id)
+
+
+def merge_tokens(tokens):
+    """
+    Return one token holding the characters of all tokens, which are
+    disjoint and have at most one negated among them.
+
+    :type tokens: Iterable[fsa.CharClass]
+    :rtype: fsa.CharClass
+    """
+    chars = set()
+    negated = None
+    for token in tokens:
+        if token.negated:
+            negated = token
+        else:
+            chars.update(token.chars)
+    if negated is None:
+        return fsa.CharClass(chars)
+    return fsa.CharClass(negated.chars - chars, negated=True)
+
+
+def _first_states(start, max_states):
+    # The first max_states states reached from start, breadth first
+    seen = {start}
+    order = [start]
+    for state in order:
+        if len(order) >= max_states:
+            break
+        for _, state1 in state.traverse():
+            if state1 not in seen and len(order) < max_states:
+                seen.add(state1)
+                order.append(state1)
+    return order
+
+
+def _shown_states(states, start, max_states):
     """
+    Return the states to draw and the set of them, or None for all states.
+    """
+    if max_states is None or len(states) <= max_states:
+        return states, None
+    states = _first_states(start, max_states)
+    return states, set(states)
+
+
+def _start_lines(start, total, shown_states):
+    yield _node_line(START_NODE, label="", shape="none")
+    yield _edge_line(START_NODE, _state_node(start))
+    if len(shown_states) < total:
+        yield _node_line(OMITTED_NODE, label="{} more states".format(total - len(shown_states)),
+                         shape="box", style="dashed")
+
+
+def nfa_to_dot(nfa, max_states=None):
+    """
+    Edges into states past the first max_states (breadth first from the
+    start) go to a single node standing for all of them.
+
     :type nfa: fsa.NFA
     :rtype: DotGraph
     """
     nfa.finish()
-    dot = DotGraph("NFA")
-    empty = dot.add_node(label="", shape="none")
-    nodes = {}
-    for state in nfa.states:
-        shape = "circle" if state != nfa.end else "doublecircle"
-        nodes[state] = dot.add_node(label=str(state.id), shape=shape)
-    dot.add_edge(empty, nodes[nfa.start])
-    for state in nfa.states:
-        for token, state1 in state.traverse():
-            dot.add_edge(nodes[state], nodes[state1], label=token)
-    return dot
-
-
-def dfa_to_dot(dfa, details=False, show_deads=True):
+
+    def generate_body():
+        states, shown = _shown_states(nfa.states, nfa.start, max_states)
+        for line in _start_lines(nfa.start, len(nfa.states), states):
+            yield line
+        for state in states:
+            shape = "circle" if state.pattern_id is None else "doublecircle"
+            yield _node_line(_state_node(state), label=str(state.id), shape=shape)
+            for token, state1 in state.traverse():
+                node1 = _state_node(state1) if shown is None or state1 in shown else OMITTED_NODE
+                yield _edge_line(_state_node(state), node1, label=token)
+
+    return DotGraph("NFA", generate_body)
+
+
+def dfa_to_dot(dfa, details=False, show_deads=True, max_states=None):
     """
+    The tokens of all edges between the same two states are merged into the
+    label of one edge. States past the first max_states are cut as in
+    nfa_to_dot.
+
     :type dfa: fsa.DFA
     :rtype: DotGraph
     """
-    dot = DotGraph("DFA")
-    empty = dot.add_node(label="", shape="none")
-    nodes = {}
-    for state in dfa.states:
-        if not show_deads and state.is_dead:
-            continue
-        shape = "circle" if not state.is_end else "doublecircle"
-        label = ','.join(str(x.id) for x in state.nfa_states) if details else str(state.id)
-        nodes[state] = dot.add_node(label=label, shape=shape)
-    dot.add_edge(empty, nodes[dfa.start])
-    for state in dfa.states:
-        for token, state1 in state.traverse():
-            if not show_deads and (state.is_dead or state1.is_dead):
+    def generate_body():
+        states, shown = _shown_states(dfa.states, dfa.start, max_states)
+        for line in _start_lines(dfa.start, len(dfa.states), states):
+            yield line
+        for state in states:
+            if not show_deads and state.is_dead:
                 continue
-            dot.add_edge(nodes[state], nodes[state1], label=token)
-    return dot
+            shape = "circle" if not state.is_end else "doublecircle"
+            label = ','.join(str(x.id) for x in state.nfa_states) if details else str(state.id)
+            yield _node_line(_state_node(state), label=label, shape=shape)
+            # The tokens into each target, in the order of the targets
+            targets = {}
+            for token, state1 in state.traverse():
+                if not show_deads and state1.is_dead:
+                    continue
+                node1 = _state_node(state1) if shown is None or state1 in shown else OMITTED_NODE
+                try:
+                    targets[node1].append(token)
+                except KeyError:
+                    targets[node1] = [token]
+            for node1, tokens in sorted(targets.iteritems()):
+                yield _edge_line(_state_node(state), node1, label=merge_tokens(tokens))
+
+    return DotGraph("DFA", generate_body)
 
 
 def main():
     import sys
-    import parse
+    import pipeline
+    import stats
 
     HELP_MESSAGE = """
 Usage:
-  python dot.py (nfa|dfa|mdfa) REGEX
+  python dot.py [--stats] [--max-states N] [--construction NAME] (nfa|dfa|mdfa) REGEX
 
-Here mdfa stands for minimized DFA.
+Here mdfa stands for minimized DFA. With --stats the time and automaton sizes
+of each stage are printed to stderr. With --max-states only the first N
+states from the start are drawn. --construction glushkov builds the DFA
+straight from the regex instead of through the NFA (thompson, the default).
 
 For example:
   python dot.py mdfa "a*(a|b)b*" | dot -Tpng -o /tmp/dot.png && open /tmp/dot.png
   """.strip()
+    args = sys.argv[1:]
+    show_stats = '--stats' in args
+    if show_stats:
+        args.remove('--stats')
+    max_states = None
+    if '--max-states' in args:
+        i = args.index('--max-states')
+        try:
+            max_states = int(args[i + 1])
+        except (IndexError, ValueError):
+            exit(HELP_MESSAGE)
+        del args[i:i + 2]
+    options = {}
+    if '--construction' in args:
+        i = args.index('--construction')
+        if i + 1 == len(args) or args[i + 1] not in pipeline.CONSTRUCTIONS:
+            exit(HELP_MESSAGE)
+        options['construction'] = args[i + 1]
+        del args[i:i + 2]
     try:
-        type_, regex = sys.argv[1:]
+        type_, regex = args
     except:
         exit(HELP_MESSAGE)
 
-    if type_ == 'nfa':
-        nfa = fsa.regex_to_nfa(parse.from_string(regex))
-        dot = nfa_to_dot(nfa)
-    elif type_ == 'dfa':
-        nfa = fsa.regex_to_nfa(parse.from_string(regex))
-        dfa = fsa.nfa_to_dfa(nfa)
-        dot = dfa_to_dot(dfa)
-    elif type_ == 'mdfa':
-        nfa = fsa.regex_to_nfa(parse.from_string(regex))
-        dfa = fsa.nfa_to_dfa(nfa)
-        mdfa = fsa.minimize_dfa(dfa)
-        dot = dfa_to_dot(mdfa)
+    def build():
+        if type_ == 'nfa':
+            return nfa_to_dot(pipeline.compile(regex, 'nfa'), max_states)
+        elif type_ in ('dfa', 'mdfa'):
+            return dfa_to_dot(pipeline.compile(regex, type_, **options), max_states=max_states)
+        else:
+            raise Exception("Unknown type: {}".format(type_))
+
+    if show_stats:
+        with stats.collect() as collected:
+            dot = build()
     else:
-        raise Exception("Unknown type: {}".format(type_))
-    print dot.format()
+        dot = build()
+    dot.write(sys.stdout)
+    if show_stats:
+        print >>sys.stderr, collected.format()
 
 
 if __name__ == '__main__':
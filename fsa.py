@@ -1,19 +1,162 @@
+import ctypes
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
 import nodes
+import stats
 
 EMPTY_TOKEN = ''
 
+# The most characters a regex may have once the copies of its repeats are
+# built out, by regex_to_dfa or regex_to_nfa without counters, so that nested
+# repeats such as (a{1000}b){1000} are refused
+MAX_EXPANSION = 100000
+
+# The operations on the counter of a Repeat in an NFA built with counters (see
+# _counted_repeat_to_nfa): set it to 0 on entering the repeat, allow one more
+# copy while it is below max, allow leaving once it reaches min (clearing it),
+# and count a finished copy
+COUNTER_ENTER, COUNTER_LOOP, COUNTER_EXIT, COUNTER_NEXT = range(4)
+
 
 class UnknownRegexNodeTypeError(Exception):
     pass
 
 
+class DFAFormatError(Exception):
+    pass
+
+
+class ExpansionError(ValueError):
+    pass
+
+
+def _escape(c):
+    # unicode_escape would first decode a str as ASCII, which fails on bytes
+    # over 0x7F, and string_escape also escapes single quotes
+    if isinstance(c, unicode):
+        return c.encode('unicode_escape')
+    return c.encode('string_escape').replace("\\'", "'")
+
+
+def _format_chars(chars):
+    """
+    Format sorted chars, collapsing runs of three or more into ranges.
+    """
+    parts = []
+    i = 0
+    while i < len(chars):
+        j = i
+        while j + 1 < len(chars) and ord(chars[j + 1]) == ord(chars[j]) + 1:
+            j += 1
+        if j - i >= 2:
+            parts.append('{}-{}'.format(_escape(chars[i]), _escape(chars[j])))
+            i = j + 1
+        else:
+            parts.append(_escape(chars[i]))
+            i += 1
+    return ''.join(parts)
+
+
+class CharClass(object):
+    """
+    A set of characters used as a token: chars, or every character but chars
+    if negated.
+    """
+    __slots__ = ('chars', 'negated')
+
+    def __init__(self, chars, negated=False):
+        self.chars = frozenset(chars)
+        self.negated = negated
+
+    def __contains__(self, c):
+        return (c in self.chars) != self.negated
+
+    def __hash__(self):
+        return hash((self.chars, self.negated))
+
+    def __eq__(self, rhs):
+        return (isinstance(rhs, CharClass) and self.chars == rhs.chars and
+                self.negated == rhs.negated)
+
+    def __ne__(self, rhs):
+        return not self == rhs
+
+    def __str__(self):
+        chars = sorted(self.chars)
+        if self.negated:
+            return '[^{}]'.format(_format_chars(chars))
+        if len(chars) == 1:
+            return _escape(chars[0])
+        return '[{}]'.format(_format_chars(chars))
+
+    def __repr__(self):
+        return 'CharClass({})'.format(self)
+
+
+def partition_alphabet(labels):
+    """
+    Split the characters used by labels into equivalence classes: the
+    characters of a class are in exactly the same labels, so an automaton over
+    the classes needs one transition per class instead of one per character.
+    If any label is negated, the characters no label mentions form one more,
+    negated, class.
+
+    Return the classes and, for each label, the ids of the classes it holds.
+
+    :type labels: list[CharClass]
+    :rtype: (list[CharClass], list[list[int]])
+    """
+    negated = set(i for i, label in enumerate(labels) if label.negated)
+    char_to_labels = {}
+    for i, label in enumerate(labels):
+        for c in label.chars:
+            try:
+                char_to_labels[c].append(i)
+            except KeyError:
+                char_to_labels[c] = [i]
+    groups = {}
+    for c, label_ids in char_to_labels.iteritems():
+        try:
+            groups[tuple(label_ids)].append(c)
+        except KeyError:
+            groups[tuple(label_ids)] = [c]
+    classes = []
+    label_classes = [[] for _ in labels]
+    for label_ids, chars in sorted(groups.iteritems(), key=lambda x: min(x[1])):
+        # A negated label holds the characters it does not list
+        label_ids = set(label_ids)
+        for i in (label_ids - negated) | (negated - label_ids):
+            label_classes[i].append(len(classes))
+        classes.append(CharClass(chars))
+    if negated:
+        for i in negated:
+            label_classes[i].append(len(classes))
+        classes.append(CharClass(char_to_labels, negated=True))
+    return classes, label_classes
+
+
 class NFAEdge(object):
-    def __init__(self, token=EMPTY_TOKEN, end=None):
+    __slots__ = ('token', 'end', 'tags', 'counter')
+
+    def __init__(self, token=EMPTY_TOKEN, end=None, tags=(), counter=None):
         self.token = token
         self.end = end
+        # The tags set to the current position when the edge is taken; only
+        # empty edges have them. Group i opens with tag 2(i - 1) and closes
+        # with tag 2(i - 1) + 1.
+        self.tags = tags
+        # (counter id, operation) for an empty edge of a counted repeat
+        self.counter = counter
 
 
 class NFAState(object):
+    __slots__ = ('id', 'regex_node', 'e1', 'e2', 'pattern_id')
+
     def __init__(self, regex_node, e1=None, e2=None):
         # A state in Thompson NFA has at most two forks, we use e1 and e2 to
         # represnet them.
@@ -21,6 +164,8 @@ class NFAState(object):
         self.regex_node = regex_node
         self.e1 = e1
         self.e2 = e2
+        # Set on end states to the id of the pattern they accept
+        self.pattern_id = None
 
     def __hash__(self):
         return hash(self.id)
@@ -42,66 +187,578 @@ class NFA(object):
         :type self.end_edges: list[NFAEdge]
         :type self.states: list[NFAState]
         :type self.end: NFAState
+        :type self.end_states: list[NFAState]
+        :type self.frozen: FrozenNFA
+        :type self.counters: list[(int, int | None)]
         """
         self.start = start
         self.end_edges = end_edges
+        # The end states of an NFA for several patterns; see regex_set_to_nfa
+        self.end_states = []
+        # The (min, max) of each counter of an NFA built with counters
+        self.counters = []
         # The following states will be setup after calling finish()
         self.states = None
         self.end = None
+        self.frozen = None
 
     def link_ends_to(self, state):
         for end in self.end_edges:
             end.end = state
 
+    def copy(self):
+        """
+        Return a finished copy of the NFA that shares no state, edge or array
+        with it.
+
+        :rtype: NFA
+        """
+        self.finish()
+        states = []
+        for state in self.states:
+            new_state = NFAState(state.regex_node)
+            new_state.id = state.id
+            new_state.pattern_id = state.pattern_id
+            states.append(new_state)
+        edge_copies = {}
+        for state, new_state in zip(self.states, states):
+            for edge in (state.e1, state.e2):
+                if edge:
+                    edge_copies[edge] = NFAEdge(
+                        edge.token, states[edge.end.id], edge.tags, edge.counter)
+            new_state.e1 = edge_copies.get(state.e1)
+            new_state.e2 = edge_copies.get(state.e2)
+        nfa = NFA(states[self.start.id], [edge_copies[edge] for edge in self.end_edges])
+        nfa.end_states = [states[state.id] for state in self.end_states]
+        nfa.end = states[self.end.id] if self.end is not None else None
+        nfa.counters = list(self.counters)
+        nfa.states = states
+        nfa.frozen = FrozenNFA(nfa)
+        return nfa
+
     def finish(self):
         if self.start.id is not None:
             return
-        self.end = NFAState(None)
-        self.link_ends_to(self.end)
+        collector = stats.current
+        if collector is not None:
+            start_time = time.time()
+        if not self.end_states:
+            self.end = NFAState(None)
+            self.end.pattern_id = 0
+            self.link_ends_to(self.end)
+            self.end_states = [self.end]
         self.states = self._label_states(self.start)
+        self.frozen = FrozenNFA(self)
+        if collector is not None:
+            collector.add_time('nfa_finish', time.time() - start_time)
+            collector.count('nfa_states', len(self.states))
+            collector.count('nfa_edges', len(self.frozen.targets))
+            collector.count('nfa_epsilon_edges', sum(self.frozen.epsilons))
+            collector.count('char_classes', len(self.frozen.classes))
 
     @staticmethod
     def _label_states(state):
-        current_id = 0
-        state.id = current_id
-        current_id += 1
+        # The returned states are ordered by id
+        state.id = 0
         pending_states = [state]
-        states = []
+        states = [state]
         while pending_states:
             state = pending_states.pop()
-            states.append(state)
             for _, state1 in state.traverse():
                 if state1.id is not None:
                     continue
-                state1.id = current_id
-                current_id += 1
+                state1.id = len(states)
+                states.append(state1)
                 pending_states.append(state1)
         return states
 
 
-def regex_to_nfa(regex_node):
+class FrozenNFA(object):
+    """
+    The array-backed form of a finished NFA, used by the determinizer and the
+    matchers instead of walking NFAState objects.
+
+    The edges of state i are numbered offsets[i] to offsets[i + 1] - 1. Edge k
+    goes to state targets[k]; it is an empty edge if epsilons[k] is set,
+    otherwise it is labelled with tokens[labels[k]].
+
+    The input characters are partitioned into `classes` (see
+    partition_alphabet). class_labels[c][l] is set if class c is inside
+    label l; the extra last entry is always 0.
+
+    accepts[i] is the pattern id of end state i and -1 for the other states.
+    `end` is the single end state, or -1 for an NFA of several patterns.
+    edge_tags[k] holds the tags of edge k if it has any.
+
+    In an NFA built with counters, edge_counters[k] holds the counter
+    operation of edge k if it has one, and `counters` the (min, max) of each
+    counter. It is run on configurations, (state id, counter values) pairs,
+    with counted_closure and counted_step instead of closure and step.
+    """
+    __slots__ = ('states', 'start', 'end', 'accepts', 'tokens', 'token_ids',
+                 'offsets', 'targets', 'labels', 'epsilons', 'edge_tags',
+                 'counters', 'edge_counters', 'classes', 'label_classes',
+                 'class_labels', 'char_classes', 'other_class')
+
+    def __init__(self, nfa):
+        """
+        :type nfa: NFA
+        """
+        self.states = tuple(nfa.states)
+        self.start = nfa.start.id
+        self.end = nfa.end.id if nfa.end is not None else -1
+        self.accepts = array('i', [-1] * len(self.states))
+        for state in nfa.end_states:
+            self.accepts[state.id] = state.pattern_id
+        self.tokens = []
+        self.token_ids = {}
+        self.offsets = array('i', [0])
+        self.targets = array('i')
+        self.labels = array('i')
+        self.epsilons = array('b')
+        self.edge_tags = {}
+        self.counters = tuple(nfa.counters)
+        self.edge_counters = {}
+        for state in nfa.states:
+            for edge in (state.e1, state.e2):
+                if not edge:
+                    continue
+                token = edge.token
+                if edge.tags:
+                    self.edge_tags[len(self.targets)] = edge.tags
+                if edge.counter is not None:
+                    self.edge_counters[len(self.targets)] = edge.counter
+                self.targets.append(edge.end.id)
+                if token == EMPTY_TOKEN:
+                    self.labels.append(-1)
+                    self.epsilons.append(1)
+                else:
+                    if token not in self.token_ids:
+                        self.token_ids[token] = len(self.tokens)
+                        self.tokens.append(token)
+                    self.labels.append(self.token_ids[token])
+                    self.epsilons.append(0)
+            self.offsets.append(len(self.targets))
+        self.classes, self.label_classes = partition_alphabet(self.tokens)
+        self.class_labels = [bytearray(len(self.tokens) + 1) for _ in self.classes]
+        for label, class_ids in enumerate(self.label_classes):
+            for class_id in class_ids:
+                self.class_labels[class_id][label] = 1
+        self.char_classes = {}
+        self.other_class = -1
+        for class_id, char_class in enumerate(self.classes):
+            if char_class.negated:
+                self.other_class = class_id
+            else:
+                for c in char_class.chars:
+                    self.char_classes[c] = class_id
+
+    def class_of(self, c):
+        """
+        Return the id of the class of character c, or -1 if no token has it.
+        """
+        return self.char_classes.get(c, self.other_class)
+
+    def closure(self, state_ids):
+        """
+        :type state_ids: Iterable[int]
+        :rtype: set[int]
+        """
+        offsets, targets, epsilons = self.offsets, self.targets, self.epsilons
+        closure = set(state_ids)
+        stack = list(closure)
+        while stack:
+            i = stack.pop()
+            for k in xrange(offsets[i], offsets[i + 1]):
+                if epsilons[k] and targets[k] not in closure:
+                    closure.add(targets[k])
+                    stack.append(targets[k])
+        return closure
+
+    def step(self, state_ids, class_id):
+        """
+        Return the closure of the states reached from state_ids on a
+        character of the class class_id.
+
+        :type state_ids: Iterable[int]
+        :rtype: set[int]
+        """
+        offsets, targets, labels, epsilons = (
+            self.offsets, self.targets, self.labels, self.epsilons)
+        mask = self.class_labels[class_id]
+        move = []
+        for i in state_ids:
+            for k in xrange(offsets[i], offsets[i + 1]):
+                if not epsilons[k] and mask[labels[k]]:
+                    move.append(targets[k])
+        return self.closure(move)
+
+    def start_configs(self):
+        """
+        The closure of the start configuration, with every counter at 0.
+
+        :rtype: set[(int, tuple[int])]
+        """
+        return self.counted_closure([(self.start, (0,) * len(self.counters))])
+
+    def counted_closure(self, configs):
+        """
+        The closure of configurations, following the empty edges whose counter
+        operation allows it and updating the counter values along them.
+
+        :type configs: Iterable[(int, tuple[int])]
+        :rtype: set[(int, tuple[int])]
+        """
+        offsets, targets, epsilons = self.offsets, self.targets, self.epsilons
+        edge_counters, counters = self.edge_counters, self.counters
+        closure = set(configs)
+        stack = list(closure)
+        while stack:
+            i, values = stack.pop()
+            for k in xrange(offsets[i], offsets[i + 1]):
+                if not epsilons[k]:
+                    continue
+                values1 = values
+                if k in edge_counters:
+                    values1 = _apply_counter(values, edge_counters[k], counters)
+                    if values1 is None:
+                        continue
+                config = targets[k], values1
+                if config not in closure:
+                    closure.add(config)
+                    stack.append(config)
+        return closure
+
+    def counted_step(self, configs, class_id):
+        """
+        Return the closure of the configurations reached from configs on a
+        character of the class class_id.
+
+        :type configs: Iterable[(int, tuple[int])]
+        :rtype: set[(int, tuple[int])]
+        """
+        offsets, targets, labels, epsilons = (
+            self.offsets, self.targets, self.labels, self.epsilons)
+        mask = self.class_labels[class_id]
+        move = []
+        for i, values in configs:
+            for k in xrange(offsets[i], offsets[i + 1]):
+                if not epsilons[k] and mask[labels[k]]:
+                    move.append((targets[k], values))
+        return self.counted_closure(move)
+
+    def to_nfa_states(self, state_ids):
+        """
+        :type state_ids: Iterable[int]
+        :rtype: frozenset[NFAState]
+        """
+        states = self.states
+        return frozenset(states[i] for i in state_ids)
+
+
+def _apply_counter(values, counter, counters):
+    # The counter values after taking an edge with the given (counter id,
+    # operation), or None if the operation does not allow it. A counter with
+    # no max stops counting at its min, after which only leaving matters.
+    c, operation = counter
+    low, high = counters[c]
+    value = values[c]
+    if operation == COUNTER_LOOP:
+        return values if high is None or value < high else None
+    elif operation == COUNTER_EXIT:
+        if value < low:
+            return None
+        value = 0
+    elif operation == COUNTER_ENTER:
+        value = 0
+    else:
+        value = min(value + 1, high if high is not None else low)
+    return values[:c] + (value,) + values[c + 1:]
+
+
+def regex_to_nfa(regex_node, counters=False):
+    """
+    Build the Thompson NFA of regex_node. A Repeat is built as one copy of its
+    operand per count, which nfa_to_dfa needs, and ExpansionError is raised
+    if that makes the regex longer than MAX_EXPANSION characters.
+
+    With counters, a Repeat is built once instead, with a counter of the
+    copies it has gone through (see _counted_repeat_to_nfa), so the NFA is
+    the size of the regex whatever the counts. Only LazyDFA and NFAMatcher
+    can run such an NFA.
+
+    :type regex_node: nodes.RegexNode
+    :rtype: NFA
+    """
+    # Post-order walk with an explicit stack so that deep trees, such as long
+    # concatenations, are not limited by the recursion limit.
+    collector = stats.current
+    if collector is not None:
+        start_time = time.time()
+    regex_node = normalize_repeats(regex_node)
+    if counters:
+        counter_bounds = []
+    else:
+        counter_bounds = None
+        _check_expansion(regex_node)
+    blocks = []
+    stack = [(regex_node, False)]
+    while stack:
+        node, children_done = stack.pop()
+        children = node.children() if counters else _copied_children(node)
+        if children and not children_done:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+        args = blocks[len(blocks) - len(children):]
+        del blocks[len(blocks) - len(children):]
+        blocks.append(_node_to_nfa(node, args, counter_bounds))
+    nfa = blocks[0]
+    if counters:
+        nfa.counters = counter_bounds
+    if collector is not None:
+        collector.add_time('regex_to_nfa', time.time() - start_time)
+    return nfa
+
+
+def _expanded_size(regex_node):
+    # The number of Char and CharSet nodes in the copies of regex_node
+    sizes = []
+    stack = [(regex_node, False)]
+    while stack:
+        node, children_done = stack.pop()
+        children = node.children()
+        if children and not children_done:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+        size = sum(sizes[len(sizes) - len(children):])
+        del sizes[len(sizes) - len(children):]
+        if isinstance(node, (nodes.Char, nodes.CharSet)):
+            size = 1
+        elif isinstance(node, nodes.Repeat):
+            size *= node.max if node.max is not None else max(node.min, 1)
+        sizes.append(size)
+    return sizes[0]
+
+
+def _check_expansion(regex_node):
+    size = _expanded_size(regex_node)
+    if size > MAX_EXPANSION:
+        raise ExpansionError('Regex expands to {} characters, over {}'.format(
+            size, MAX_EXPANSION))
+
+
+def _copied_children(regex_node):
+    """
+    The children of regex_node, with the operand of a Repeat once per copy it
+    is built into: max copies, or min (at least one) followed by a loop if
+    max is None. A copy is built again from the shared subtree, so the tree
+    stays the size of the regex.
+    """
+    children = regex_node.children()
+    if isinstance(regex_node, nodes.Repeat):
+        if regex_node.max is not None:
+            return children * regex_node.max
+        return children * max(regex_node.min, 1)
+    return children
+
+
+def _or(node1, node2):
+    # None stands for a node matching nothing but the empty string
+    if node1 is None:
+        return node2
+    if node2 is None:
+        return node1
+    return nodes.Or(node1, node2)
+
+
+def _concat_nonempty(result1, result2):
+    """
+    The non-empty words of a concatenation of two nullable nodes, from the
+    (nullable, node, nonempty, size) of each: ab without the empty word is
+    a'b|b' where x' is x without it. The smaller of a and b is the one
+    written twice, so nested concatenations stay within n log n nodes.
+    """
+    _, node1, nonempty1, size1 = result1
+    _, node2, nonempty2, size2 = result2
+    if size1 >= size2:
+        first = nodes.Concat(nonempty1, node2) if nonempty1 is not None else None
+        return _or(first, nonempty2)
+    second = nodes.Concat(node1, nonempty2) if nonempty2 is not None else None
+    return _or(second, nonempty1)
+
+
+def _repeated_char(node):
+    # The (type, label) of the character a Repeat copies, if it is one
+    if isinstance(node, nodes.Repeat):
+        if isinstance(node.arg, nodes.Char):
+            return nodes.Char, node.arg.token
+        elif isinstance(node.arg, nodes.CharSet):
+            return nodes.CharSet, node.arg.chars, node.arg.negated
+    return None
+
+
+def _normalized_repeat(node, result):
+    """
+    Rewrite a Repeat, given the result of its operand, so that the operand
+    cannot match the empty string: otherwise every optional copy would have
+    an empty path through it, and the closure of each copy would run through
+    all the later ones. If x is nullable, x{m,n} is x'{0,n} where x' is x
+    without the empty word; and (y+){m,n} is y{m,}.
+    """
+    nullable, arg, nonempty, size = result
+    if node.max == 0 or nonempty is None:
+        return True, nodes.Empty(), None, 1
+    low, high = node.min, node.max
+    if nullable:
+        low, arg = 0, nonempty
+    if isinstance(arg, nodes.OneOrMore):
+        arg, high = arg.arg, None
+    if (arg, low, high) == (node.arg, node.min, node.max):
+        repeat = node
+    else:
+        repeat = nodes.Repeat(arg, low, high)
+    if low > 0:
+        return False, repeat, repeat, size + 1
+    return True, repeat, nodes.Repeat(arg, 1, high), size + 1
+
+
+def normalize_repeats(regex_node):
+    """
+    Rewrite the Repeats of a tree so that expanding them keeps the closures
+    small (see _normalized_repeat), and merge x{a,b}x{c,d} of a single
+    character into x{a+c,b+d}, whose copies do not overlap. Subtrees without
+    a Repeat are kept as they are.
+
+    :type regex_node: nodes.RegexNode
+    :rtype: nodes.RegexNode
+    """
+    # (nullable, node, nonempty, size) of each finished node, where nonempty
+    # matches the non-empty words of node, or is None if there are none
+    results = []
+    stack = [(regex_node, False)]
+    while stack:
+        node, children_done = stack.pop()
+        children = node.children()
+        if children and not children_done:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+        args = results[len(results) - len(children):]
+        del results[len(results) - len(children):]
+        if isinstance(node, nodes.Repeat):
+            results.append(_normalized_repeat(node, args[0]))
+            continue
+        size = 1 + sum(result[3] for result in args)
+        if any(result[1] is not child for result, child in zip(args, children)):
+            if isinstance(node, nodes.Group):
+                node1 = nodes.Group(args[0][1], node.index)
+            else:
+                node1 = type(node)(*[result[1] for result in args])
+        else:
+            node1 = node
+        if isinstance(node, (nodes.Char, nodes.CharSet)):
+            results.append((False, node1, node1, size))
+        elif isinstance(node, nodes.Empty):
+            results.append((True, node1, None, size))
+        elif isinstance(node, nodes.Group):
+            nullable, _, nonempty, _ = args[0]
+            if nullable and nonempty is not None:
+                nonempty = nodes.Group(nonempty, node.index)
+            results.append((nullable, node1, nonempty if nullable else node1, size))
+        elif isinstance(node, nodes.Concat):
+            left, right = node1.arg1, node1.arg2
+            prefix, last = (left.arg1, left.arg2) if isinstance(left, nodes.Concat) else (None, left)
+            char = _repeated_char(last)
+            if char is not None and char == _repeated_char(right):
+                high = None if last.max is None or right.max is None else last.max + right.max
+                node1 = nodes.Repeat(last.arg, last.min + right.min, high)
+                if prefix is not None:
+                    node1 = nodes.Concat(prefix, node1)
+            if args[0][0] and args[1][0]:
+                results.append((True, node1, _concat_nonempty(*args), size))
+            else:
+                results.append((False, node1, node1, size))
+        elif isinstance(node, nodes.Or):
+            nullable = args[0][0] or args[1][0]
+            nonempty = _or(args[0][2], args[1][2]) if nullable else node1
+            results.append((nullable, node1, nonempty, size))
+        elif isinstance(node, nodes.ZeroOrOne):
+            results.append((True, node1, args[0][2], size))
+        elif isinstance(node, (nodes.ZeroOrMore, nodes.OneOrMore)):
+            nullable, _, nonempty, _ = args[0]
+            if isinstance(node, nodes.ZeroOrMore) or nullable:
+                nonempty = nodes.OneOrMore(nonempty) if nonempty is not None else None
+                results.append((True, node1, nonempty, size))
+            else:
+                results.append((False, node1, node1, size))
+        else:
+            raise UnknownRegexNodeTypeError(type(node))
+    return results[0][1]
+
+
+def regex_set_to_nfa(regex_nodes):
+    """
+    Build one NFA accepting any of regex_nodes. Each pattern keeps its own end
+    state, tagged with the index of the pattern as pattern_id.
+
+    :type regex_nodes: list[nodes.RegexNode]
+    :rtype: NFA
+    """
+    if not regex_nodes:
+        raise ValueError('A regex set needs at least one pattern')
+    starts = []
+    end_states = []
+    for pattern_id, regex_node in enumerate(regex_nodes):
+        block = regex_to_nfa(regex_node)
+        end = NFAState(None)
+        end.pattern_id = pattern_id
+        block.link_ends_to(end)
+        starts.append(block.start)
+        end_states.append(end)
+    # A chain of forks, one per pattern
+    start = starts[-1]
+    for start1 in reversed(starts[:-1]):
+        start = NFAState(None, NFAEdge(end=start1), NFAEdge(end=start))
+    nfa = NFA(start, [])
+    nfa.end_states = end_states
+    return nfa
+
+
+def _node_to_nfa(regex_node, blocks, counters=None):
     """
+    Build the NFA of regex_node from the NFAs of its children. If counters is
+    given, a Repeat has a single block and its counter is added to counters.
+
     :type regex_node: nodes.RegexNode
+    :type blocks: list[NFA]
+    :type counters: list[(int, int | None)] | None
     :rtype: NFA
     """
     if isinstance(regex_node, nodes.Empty):
         state = NFAState(regex_node, NFAEdge())
         return NFA(state, [state.e1])
     elif isinstance(regex_node, nodes.Char):
-        state = NFAState(regex_node, NFAEdge(regex_node.token))
+        state = NFAState(regex_node, NFAEdge(CharClass(regex_node.token)))
+        return NFA(state, [state.e1])
+    elif isinstance(regex_node, nodes.CharSet):
+        token = CharClass(regex_node.chars, regex_node.negated)
+        state = NFAState(regex_node, NFAEdge(token))
         return NFA(state, [state.e1])
     elif isinstance(regex_node, nodes.BinaryRegexNode):
-        block1 = regex_to_nfa(regex_node.arg1)
-        block2 = regex_to_nfa(regex_node.arg2)
+        block1, block2 = blocks
         if isinstance(regex_node, nodes.Concat):
             block1.link_ends_to(block2.start)
             return NFA(block1.start, block2.end_edges)
         elif isinstance(regex_node, nodes.Or):
             state = NFAState(
                 regex_node, NFAEdge(end=block1.start), NFAEdge(end=block2.start))
-            return NFA(state, block1.end_edges + block2.end_edges)
+            # The child blocks are discarded, so their edge lists can be reused
+            block1.end_edges.extend(block2.end_edges)
+            return NFA(state, block1.end_edges)
     elif isinstance(regex_node, nodes.UnaryRegexNode):
-        block = regex_to_nfa(regex_node.arg)
+        block, = blocks
         if isinstance(regex_node, nodes.OneOrMore):
             state = NFAState(regex_node, NFAEdge(end=block.start), NFAEdge())
             block.link_ends_to(state)
@@ -112,41 +769,79 @@ def regex_to_nfa(regex_node):
             return NFA(state, [state.e2])
         elif isinstance(regex_node, nodes.ZeroOrOne):
             state = NFAState(regex_node, NFAEdge(end=block.start), NFAEdge())
-            return NFA(state, block.end_edges + [state.e2])
+            block.end_edges.append(state.e2)
+            return NFA(state, block.end_edges)
+    elif isinstance(regex_node, nodes.Repeat):
+        if counters is not None and (regex_node.max or regex_node.min) > 1:
+            return _counted_repeat_to_nfa(regex_node, blocks[0], counters)
+        # Nothing to count: at most one copy, or x{0,}/x{1,} looping on it
+        return _repeat_to_nfa(regex_node, blocks)
+    elif isinstance(regex_node, nodes.Group):
+        block, = blocks
+        tag = 2 * (regex_node.index - 1)
+        state = NFAState(regex_node, NFAEdge(end=block.start, tags=(tag,)))
+        close = NFAState(regex_node, NFAEdge(tags=(tag + 1,)))
+        block.link_ends_to(close)
+        return NFA(state, [close.e1])
     raise UnknownRegexNodeTypeError(regex_node)
 
 
-class TempDFAState(object):
-    def __init__(self, nfa_states):
-        """
-        :type nfa_states: Iterable[NFAState]
-        :type self.trans: dict[str, NFAState]
-        """
-        self.nfa_states = frozenset(find_nfa_closure(nfa_states))
-        self.trans = {}
-        self.dfa_state = DFAState(self.nfa_states)
-
-    def __hash__(self):
-        return hash(self.nfa_states)
-
-    def __eq__(self, rhs):
-        return self.nfa_states == rhs.nfa_states
+def _repeat_to_nfa(regex_node, blocks):
+    """
+    Chain the copies of a Repeat operand in blocks. The first min copies are
+    in sequence. Then, if max is None, the last copy loops; otherwise each
+    remaining copy is entered through a fork whose other edge leaves the
+    repeat, and all of these edges are end edges of the result instead of
+    going through each other. Leaving early is then a single empty edge, so
+    given an operand that cannot match the empty string, as normalize_repeats
+    ensures, the closures stay as small as for one copy whatever the count.
 
-    def add_transition(self, token, state):
-        assert token != EMPTY_TOKEN
-        try:
-            self.trans[token].add(state)
-        except KeyError:
-            self.trans[token] = {state}
+    :type regex_node: nodes.Repeat
+    :type blocks: list[NFA]
+    :rtype: NFA
+    """
+    if not blocks:
+        state = NFAState(regex_node, NFAEdge())
+        return NFA(state, [state.e1])
+    end_edges = []
+    if regex_node.max is None:
+        block = blocks[-1]
+        state = NFAState(regex_node, NFAEdge(end=block.start), NFAEdge())
+        block.link_ends_to(state)
+        blocks[-1] = NFA(state if regex_node.min == 0 else block.start, [state.e2])
+    else:
+        for i in xrange(regex_node.min, len(blocks)):
+            block = blocks[i]
+            state = NFAState(regex_node, NFAEdge(end=block.start), NFAEdge())
+            end_edges.append(state.e2)
+            blocks[i] = NFA(state, block.end_edges)
+    for block1, block2 in zip(blocks, blocks[1:]):
+        block1.link_ends_to(block2.start)
+    end_edges.extend(blocks[-1].end_edges)
+    return NFA(blocks[0].start, end_edges)
 
-    def get_transitions(self, token, default=frozenset()):
-        return self.trans.get(token, default)
 
-    def traverse(self):
-        return self.trans.iteritems()
+def _counted_repeat_to_nfa(regex_node, block, counters):
+    """
+    Build a Repeat from a single copy of its operand, with a new counter of
+    the copies gone through. The repeat is entered by setting the counter to
+    0; then a fork either starts another copy, if the counter is below max,
+    or leaves, if it has reached min. The end of a copy counts it and goes
+    back to the fork. normalize_repeats ensures that the operand cannot match
+    the empty string, so each copy reads at least one character.
 
-    def __repr__(self):
-        return 'TempDFAState(({}))'.format(','.join(str(s.id) for s in self.nfa_states))
+    :type regex_node: nodes.Repeat
+    :type block: NFA
+    :rtype: NFA
+    """
+    c = len(counters)
+    counters.append((regex_node.min, regex_node.max))
+    fork = NFAState(regex_node, NFAEdge(end=block.start, counter=(c, COUNTER_LOOP)),
+                    NFAEdge(counter=(c, COUNTER_EXIT)))
+    next_copy = NFAState(regex_node, NFAEdge(end=fork, counter=(c, COUNTER_NEXT)))
+    block.link_ends_to(next_copy)
+    state = NFAState(regex_node, NFAEdge(end=fork, counter=(c, COUNTER_ENTER)))
+    return NFA(state, [fork.e2])
 
 
 class DFAState(object):
@@ -161,6 +856,8 @@ class DFAState(object):
         """
         self.trans = {}
         self.is_end = False
+        # The ids of the patterns accepted in this state
+        self.accepts = frozenset()
         self.is_dead = False
         self.id = None
 
@@ -187,18 +884,497 @@ class DFA(object):
     def __init__(self, states, tokens, start):
         """
         :type states: Iterable[DFAState]
-        :type tokens: Iterable[str]
+        :type tokens: Iterable[CharClass]
         :type start: DFAState
         """
         self.states = list(states)
         self.tokens = list(tokens)
         self.start = start
+        # The tokens are CharClasses partitioning the alphabet; at most one is
+        # negated and holds every character the others do not list.
+        self.alphabet = {}
+        self.other = None
+        for token in self.tokens:
+            if token.negated:
+                self.other = token
+            else:
+                for c in token.chars:
+                    self.alphabet[c] = token
+
+    def token_for(self, c):
+        """
+        Return the token holding character c, or None.
+        """
+        return self.alphabet.get(c, self.other)
 
     def setup_dead_states(self):
         for state in self.states:
             if not state.is_end and all(s is state for _, s in state.traverse()):
                 state.is_dead = True
 
+    def copy(self):
+        """
+        Return a copy of the DFA with its own states and transitions.
+
+        :rtype: DFA
+        """
+        state_to_index = dict((state, i) for i, state in enumerate(self.states))
+        new_states = []
+        for state in self.states:
+            new_state = DFAState(state.nfa_states)
+            new_state.is_end = state.is_end
+            new_state.accepts = state.accepts
+            new_state.is_dead = state.is_dead
+            new_state.id = state.id
+            new_states.append(new_state)
+        for state, new_state in zip(self.states, new_states):
+            for token, state1 in state.traverse():
+                new_state.set_transition(token, new_states[state_to_index[state1]])
+        return DFA(new_states, self.tokens, new_states[state_to_index[self.start]])
+
+    def compile(self):
+        """
+        :rtype: CompiledDFA
+        """
+        return CompiledDFA(self)
+
+    def save(self, path):
+        """
+        Write the compiled form of this DFA to path; see CompiledDFA.save.
+        """
+        self.compile().save(path)
+
+    @staticmethod
+    def load(path, verify=False):
+        """
+        Load a DFA saved with save(). Only the compiled form is stored, so
+        this returns a CompiledDFA; see CompiledDFA.load for verify.
+
+        :rtype: CompiledDFA
+        """
+        return CompiledDFA.load(path, verify)
+
+
+def _check_int32s(data, position, count, lo, hi, what):
+    """
+    Raise DFAFormatError unless the count little-endian int32s at position
+    in data are all in range(lo, hi). They are read a chunk at a time, so
+    that checking a mapped table does not copy all of it.
+    """
+    chunk_size = 16384
+    for start in xrange(position, position + 4 * count, 4 * chunk_size):
+        values = array('i')
+        values.fromstring(data[start:min(start + 4 * chunk_size, position + 4 * count)])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        if values and not (lo <= min(values) and max(values) < hi):
+            raise DFAFormatError('{} out of range'.format(what))
+
+
+def _bitmap_get(bitmap, i):
+    return bitmap[i >> 3] & (1 << (i & 7))
+
+
+def _bitmap_set(bitmap, i):
+    bitmap[i >> 3] |= 1 << (i & 7)
+
+
+def _candidates(prefilter, text, pos):
+    # The candidate starts of a search, or None for every position. A
+    # memoryview has no find() for the prefilter to use.
+    if prefilter is None or not hasattr(text, 'find'):
+        return None
+    return prefilter.candidates(text, pos)
+
+
+class Matcher(object):
+    """
+    Base class of the matching engines. Subclasses implement match(), and
+    either search() or the _start_state(), _next_state() and _is_accept()
+    that it steps through.
+    """
+    # A prefilter.Prefilter giving the positions where search() starts a
+    # run when none is live, or None to start one at every position
+    prefilter = None
+
+    def match(self, text, pos=0):
+        """
+        Return the end of the longest match starting at pos, or None.
+        """
+        raise NotImplementedError
+
+    def fullmatch(self, text):
+        """
+        Return whether the whole text is accepted.
+        """
+        return self.match(text) == len(text)
+
+    def search(self, text, pos=0):
+        """
+        Return (start, end) of the leftmost-longest match at or after pos, or
+        None.
+        """
+        # One pass with a run of the automaton started at every position, as
+        # in stream.StreamMatcher. Runs are kept ordered by start and runs
+        # reaching the same state are merged into the one that started first,
+        # so each character costs at most one step per state. Once a match is
+        # found, no later run is started and the runs after it are dropped.
+        candidates = _candidates(self.prefilter, text, pos)
+        runs = []
+        states = set()
+        best = None
+        i = pos
+        while True:
+            if best is None:
+                if candidates is not None and not runs:
+                    # With no live run, skip to the next candidate start
+                    i = next((start for start in candidates if start >= i), None)
+                    if i is None:
+                        break
+                start_state = self._start_state()
+                if start_state not in states:
+                    runs.append((i, start_state))
+                    states.add(start_state)
+            for start, state in runs:
+                if self._is_accept(state):
+                    if best is None or start < best[0]:
+                        runs = [run for run in runs if run[0] <= start]
+                    best = (start, i)
+                    break
+            if i == len(text) or not runs and best is not None:
+                break
+            c = text[i]
+            new_runs = []
+            states = set()
+            for start, state in runs:
+                state = self._next_state(state, c)
+                if state is not None and state not in states:
+                    states.add(state)
+                    new_runs.append((start, state))
+            runs = new_runs
+            i += 1
+        return best
+
+    def _start_state(self):
+        raise NotImplementedError
+
+    def _next_state(self, state, c):
+        """
+        Return the state reached from state on c, or None if it is dead.
+        """
+        raise NotImplementedError
+
+    def _is_accept(self, state):
+        raise NotImplementedError
+
+
+class CompiledDFA(Matcher):
+    """
+    A DFA lowered to a flat transition table, used for matching.
+
+    States are numbered by their position in DFA.states and the transition of
+    state s on the token in column c is table[s * len(tokens) + c]. Accepting
+    and dead states are kept as bitmaps.
+
+    The patterns accepted in state s are accept_sets[accept_index[s]], or none
+    if accept_index[s] is -1.
+    """
+    # The saved form: a header, the tokens, then (8-byte aligned) the table as
+    # little-endian int32s followed by the accept and dead bitmaps, then
+    # (4-byte aligned) accept_index and the accept sets, each as its size
+    # followed by its pattern ids.
+    MAGIC = 'REGEXDFA'
+    VERSION = 2
+    HEADER = struct.Struct('<8sIIIIiI')
+    TOKEN_HEADER = struct.Struct('<BI')
+    UNICODE_FLAG = 1
+
+    def __init__(self, dfa):
+        """
+        :type dfa: DFA
+        """
+        state_to_index = dict((state, i) for i, state in enumerate(dfa.states))
+        self._set_tokens(dfa.tokens)
+        token_columns = dict((token, i) for i, token in enumerate(self.tokens))
+        self.num_states = len(dfa.states)
+        self.start = state_to_index[dfa.start]
+        self.table = array('i', [0] * (self.num_states * len(self.tokens)))
+        self.accepts = bytearray((self.num_states + 7) >> 3)
+        self.deads = bytearray((self.num_states + 7) >> 3)
+        self.accept_index = array('i', [-1] * self.num_states)
+        self.accept_sets = []
+        accept_set_ids = {}
+        for i, state in enumerate(dfa.states):
+            row = i * len(self.tokens)
+            for token, state1 in state.traverse():
+                self.table[row + token_columns[token]] = state_to_index[state1]
+            if state.is_end:
+                _bitmap_set(self.accepts, i)
+            if state.accepts:
+                if state.accepts not in accept_set_ids:
+                    accept_set_ids[state.accepts] = len(self.accept_sets)
+                    self.accept_sets.append(tuple(sorted(state.accepts)))
+                self.accept_index[i] = accept_set_ids[state.accepts]
+            if state.is_dead:
+                _bitmap_set(self.deads, i)
+
+    def _set_tokens(self, tokens):
+        self.tokens = list(tokens)
+        # Characters outside every token go to other_column, or -1 if none.
+        # A byte is also mapped by its value, which is what a bytearray
+        # yields, so that one can be matched without copying it to a str.
+        self.columns = {}
+        self.other_column = -1
+        for i, token in enumerate(self.tokens):
+            if token.negated:
+                self.other_column = i
+            else:
+                for c in token.chars:
+                    self.columns[c] = i
+                    if isinstance(c, str):
+                        self.columns[ord(c)] = i
+
+    def save(self, path):
+        is_unicode = any(isinstance(c, unicode) for t in self.tokens for c in t.chars)
+        encoding = 'utf-8' if is_unicode else 'latin-1'
+        token_data = []
+        for token in self.tokens:
+            chars = u''.join(sorted(unicode(c, 'latin-1') if isinstance(c, str) else c
+                                    for c in token.chars)).encode(encoding)
+            token_data.append(self.TOKEN_HEADER.pack(token.negated, len(chars)))
+            token_data.append(chars)
+        token_data = ''.join(token_data)
+        table = array('i', self.table)
+        accept_index = array('i', self.accept_index)
+        accept_sets = array('i')
+        for accept_set in self.accept_sets:
+            accept_sets.append(len(accept_set))
+            accept_sets.extend(accept_set)
+        if sys.byteorder != 'little':
+            for data in (table, accept_index, accept_sets):
+                data.byteswap()
+        with open(path, 'wb') as f:
+            f.write(self.HEADER.pack(
+                self.MAGIC, self.VERSION, self.UNICODE_FLAG if is_unicode else 0,
+                self.num_states, len(self.tokens), self.start, len(token_data)))
+            f.write(token_data)
+            f.write('\0' * (-f.tell() % 8))
+            f.write(table.tostring())
+            f.write(str(bytearray(self.accepts)))
+            f.write(str(bytearray(self.deads)))
+            f.write('\0' * (-f.tell() % 4))
+            f.write(accept_index.tostring())
+            f.write(struct.pack('<I', len(self.accept_sets)))
+            f.write(accept_sets.tostring())
+
+    @classmethod
+    def load(cls, path, verify=False):
+        """
+        Load a CompiledDFA written by save(). The file is memory-mapped and
+        the table and bitmaps are used in place, so the pages are shared
+        between processes and loading does not read them; see from_buffer
+        for verify.
+        """
+        with open(path, 'rb') as f:
+            # mmap refuses an empty file
+            if os.fstat(f.fileno()).st_size < cls.HEADER.size:
+                raise DFAFormatError('Truncated header')
+            # A copy-on-write mapping, since ctypes needs a writable buffer;
+            # pages are only copied if written, which matching never does.
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        return cls.from_buffer(mapping, verify=verify)
+
+    @classmethod
+    def from_buffer(cls, data, offset=0, verify=False):
+        """
+        Use the saved form held in a writable buffer, such as an mmap, without
+        copying the table. Raises DFAFormatError if the header, tokens or
+        accept sets are malformed or the data is too short for the table.
+
+        Only that much is read, so the time taken does not grow with the
+        number of states. With verify, every transition and accept index is
+        also checked to be in range, which reads the whole table: a corrupt
+        table then fails here rather than with an IndexError or a wrong
+        result in the middle of a match.
+        """
+        try:
+            (magic, version, flags, num_states, num_tokens, start,
+             token_size) = cls.HEADER.unpack_from(data, offset)
+        except struct.error:
+            raise DFAFormatError('Truncated header')
+        if magic != cls.MAGIC:
+            raise DFAFormatError('Not a saved DFA')
+        if version != cls.VERSION:
+            raise DFAFormatError('Unsupported version: {}'.format(version))
+        if sys.byteorder != 'little':
+            raise DFAFormatError('Saved DFAs can only be mapped on little-endian machines')
+        encoding = 'utf-8' if flags & cls.UNICODE_FLAG else 'latin-1'
+        tokens = []
+        position = offset + cls.HEADER.size
+        try:
+            for _ in xrange(num_tokens):
+                negated, size = cls.TOKEN_HEADER.unpack_from(data, position)
+                position += cls.TOKEN_HEADER.size
+                if position + size > len(data):
+                    raise DFAFormatError('Truncated tokens')
+                chars = data[position:position + size]
+                if encoding == 'utf-8':
+                    chars = chars.decode(encoding)
+                tokens.append(CharClass(chars, bool(negated)))
+                position += size
+        except (struct.error, UnicodeDecodeError):
+            raise DFAFormatError('Truncated tokens')
+        if not 0 <= start < num_states:
+            raise DFAFormatError('Start state {} out of range'.format(start))
+        position += -(position - offset) % 8
+        bitmap_size = (num_states + 7) >> 3
+        end = position + 4 * num_states * num_tokens + 2 * bitmap_size
+        end += -(end - offset) % 4 + 4 * num_states + 4
+        if len(data) < end:
+            raise DFAFormatError('Truncated table')
+        if verify:
+            _check_int32s(data, position, num_states * num_tokens, 0, num_states, 'Transition')
+        accept_index_position = end - 4 - 4 * num_states
+        compiled = cls.__new__(cls)
+        compiled._set_tokens(tokens)
+        compiled.num_states = num_states
+        compiled.start = start
+        compiled.table = (ctypes.c_int32 * (num_states * num_tokens)).from_buffer(data, position)
+        position += 4 * num_states * num_tokens
+        compiled.accepts = (ctypes.c_ubyte * bitmap_size).from_buffer(data, position)
+        compiled.deads = (ctypes.c_ubyte * bitmap_size).from_buffer(data, position + bitmap_size)
+        position += 2 * bitmap_size
+        position += -(position - offset) % 4
+        compiled.accept_index = (ctypes.c_int32 * num_states).from_buffer(data, position)
+        position += 4 * num_states
+        num_sets, = struct.unpack_from('<I', data, position)
+        position += 4
+        compiled.accept_sets = []
+        try:
+            for _ in xrange(num_sets):
+                size, = struct.unpack_from('<I', data, position)
+                if position + 4 + 4 * size > len(data):
+                    raise DFAFormatError('Truncated accept sets')
+                compiled.accept_sets.append(
+                    struct.unpack_from('<{}i'.format(size), data, position + 4))
+                position += 4 + 4 * size
+        except struct.error:
+            raise DFAFormatError('Truncated accept sets')
+        if verify:
+            _check_int32s(data, accept_index_position, num_states, -1, num_sets, 'Accept set')
+        compiled._data = data
+        return compiled
+
+    def is_accept(self, state):
+        return bool(_bitmap_get(self.accepts, state))
+
+    def is_dead(self, state):
+        return bool(_bitmap_get(self.deads, state))
+
+    def accepted_patterns(self, state):
+        """
+        Return the sorted ids of the patterns accepted in state.
+
+        :rtype: tuple[int]
+        """
+        index = self.accept_index[state]
+        return self.accept_sets[index] if index >= 0 else ()
+
+    def run(self, text):
+        """
+        Return the state reached after the whole text, or -1 if the text
+        leaves the DFA or reaches a dead state.
+        """
+        table, columns, deads = self.table, self.columns, self.deads
+        other_column = self.other_column
+        width = len(self.tokens)
+        state = self.start
+        for c in text:
+            column = columns.get(c, other_column)
+            if column < 0:
+                return -1
+            state = table[state * width + column]
+            if deads[state >> 3] & (1 << (state & 7)):
+                return -1
+        return state
+
+    def fullmatch(self, text):
+        state = self.run(text)
+        return state >= 0 and bool(_bitmap_get(self.accepts, state))
+
+    def match(self, text, pos=0):
+        result = self.match_state(text, pos)
+        return result[0] if result is not None else None
+
+    def search(self, text, pos=0):
+        # Matcher.search with the table lookups inlined
+        table, columns = self.table, self.columns
+        accepts, deads = self.accepts, self.deads
+        other_column = self.other_column
+        width = len(self.tokens)
+        start_state = self.start
+        candidates = _candidates(self.prefilter, text, pos)
+        runs = []
+        states = set()
+        best = None
+        i = pos
+        while True:
+            if best is None:
+                if candidates is not None and not runs:
+                    i = next((start for start in candidates if start >= i), None)
+                    if i is None:
+                        break
+                if start_state not in states:
+                    runs.append((i, start_state))
+                    states.add(start_state)
+            for start, state in runs:
+                if accepts[state >> 3] & (1 << (state & 7)):
+                    if best is None or start < best[0]:
+                        runs = [run for run in runs if run[0] <= start]
+                    best = (start, i)
+                    break
+            if i == len(text) or not runs and best is not None:
+                break
+            column = columns.get(text[i], other_column)
+            new_runs = []
+            states = set()
+            if column >= 0:
+                for start, state in runs:
+                    state = table[state * width + column]
+                    if not deads[state >> 3] & (1 << (state & 7)) and state not in states:
+                        states.add(state)
+                        new_runs.append((start, state))
+            runs = new_runs
+            i += 1
+        return best
+
+    def match_state(self, text, pos=0):
+        """
+        Return (end, state) for the longest match starting at pos, where state
+        is the accepting state reached at end, or None.
+        """
+        table, columns = self.table, self.columns
+        accepts, deads = self.accepts, self.deads
+        other_column = self.other_column
+        width = len(self.tokens)
+        state = self.start
+        last_end = pos if _bitmap_get(accepts, state) else None
+        last_state = state
+        for i in xrange(pos, len(text)):
+            column = columns.get(text[i], other_column)
+            if column < 0:
+                break
+            state = table[state * width + column]
+            bit = 1 << (state & 7)
+            if deads[state >> 3] & bit:
+                break
+            if accepts[state >> 3] & bit:
+                last_end = i + 1
+                last_state = state
+        if last_end is None:
+            return None
+        return last_end, last_state
+
 
 def find_nfa_closure(nfa_states):
     """
@@ -215,45 +1391,470 @@ def find_nfa_closure(nfa_states):
     return closure
 
 
+class _LazyDFAState(DFAState):
+    # A state of LazyDFA, identified by its set of NFA state ids, or of
+    # configurations for an NFA with counters, which its NFA states alone
+    # do not tell apart
+    def __init__(self, nfa_states, state_ids):
+        DFAState.__init__(self, nfa_states)
+        self.state_ids = state_ids
+
+    def __hash__(self):
+        return hash(self.state_ids)
+
+    def __eq__(self, rhs):
+        return self.state_ids == rhs.state_ids
+
+
+class LazyDFA(Matcher):
+    """
+    A DFA that is determinized from the NFA only as far as the input reaches.
+    For an NFA with counters, its states are sets of configurations (see
+    FrozenNFA).
+
+    At most max_states DFA states are cached. When the cache is full it is
+    flushed and refilled from the current position; after more than
+    max_flushes flushes within one match, the rest of the input is matched by
+    stepping sets of NFA states directly, without caching. search() only
+    flushes the cache.
+    """
+    def __init__(self, nfa, max_states=10000, max_flushes=8):
+        """
+        :type nfa: NFA
+        :type self.cache: dict[frozenset[int], DFAState]
+        """
+        nfa.finish()
+        self.nfa = nfa.frozen
+        self.max_states = max_states
+        self.max_flushes = max_flushes
+        self.cache = {}
+        self.flushes = 0
+        if self.nfa.counters:
+            self._start_state_ids = frozenset(self.nfa.start_configs())
+        else:
+            self._start_state_ids = frozenset(self.nfa.closure([self.nfa.start]))
+        self.start = self._get_state(self._start_state_ids)
+
+    def _nfa_state_ids(self, state_ids):
+        if self.nfa.counters:
+            return set(i for i, _ in state_ids)
+        return state_ids
+
+    def _get_state(self, state_ids):
+        try:
+            return self.cache[state_ids]
+        except KeyError:
+            pass
+        nfa_state_ids = self._nfa_state_ids(state_ids)
+        state = _LazyDFAState(self.nfa.to_nfa_states(nfa_state_ids), state_ids)
+        state.id = len(self.cache)
+        state.is_end = self.nfa.end in nfa_state_ids
+        state.is_dead = not state_ids
+        self.cache[state_ids] = state
+        return state
+
+    def flush(self):
+        """
+        Drop every cached state. The start state is rebuilt so that no
+        transition keeps the dropped states alive.
+        """
+        self.cache = {}
+        self.flushes += 1
+        self.start = self._get_state(self._start_state_ids)
+
+    def _step(self, state_ids, c):
+        class_id = self.nfa.class_of(c)
+        if class_id < 0:
+            return frozenset()
+        if self.nfa.counters:
+            return frozenset(self.nfa.counted_step(state_ids, class_id))
+        return frozenset(self.nfa.step(state_ids, class_id))
+
+    def match(self, text, pos=0):
+        state = self.start
+        last_end = pos if state.is_end else None
+        flushes = 0
+        for i in xrange(pos, len(text)):
+            c = text[i]
+            next_state = state.trans.get(c)
+            if next_state is None:
+                state_ids = self._step(state.state_ids, c)
+                if state_ids not in self.cache and len(self.cache) >= self.max_states:
+                    flushes += 1
+                    if flushes > self.max_flushes:
+                        return self._match_nfa(text, i + 1, state_ids, last_end)
+                    self.flush()
+                next_state = self._get_state(state_ids)
+                state.set_transition(c, next_state)
+            state = next_state
+            if state.is_dead:
+                break
+            if state.is_end:
+                last_end = i + 1
+        return last_end
+
+    def _start_state(self):
+        # Read again at each position, since a flush replaces it
+        return self.start
+
+    def _next_state(self, state, c):
+        next_state = state.trans.get(c)
+        if next_state is None:
+            state_ids = self._step(state.state_ids, c)
+            if state_ids not in self.cache and len(self.cache) >= self.max_states:
+                self.flush()
+            next_state = self._get_state(state_ids)
+            state.set_transition(c, next_state)
+        return next_state if not next_state.is_dead else None
+
+    def _is_accept(self, state):
+        return state.is_end
+
+    def _match_nfa(self, text, pos, state_ids, last_end):
+        # state_ids is the set reached just before text[pos]
+        end = self.nfa.end
+        i = pos
+        while state_ids:
+            if end in self._nfa_state_ids(state_ids):
+                last_end = i
+            if i == len(text):
+                break
+            state_ids = self._step(state_ids, text[i])
+            i += 1
+        return last_end
+
+
+class SparseSet(object):
+    """
+    A set of integers in [0, capacity) with O(1) add, membership and clear,
+    keeping insertion order in `dense`.
+    """
+    __slots__ = ('dense', 'sparse', 'size')
+
+    def __init__(self, capacity):
+        self.dense = array('i', [0] * capacity)
+        self.sparse = array('i', [0] * capacity)
+        self.size = 0
+
+    def __contains__(self, i):
+        j = self.sparse[i]
+        return j < self.size and self.dense[j] == i
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return iter(self.dense[:self.size])
+
+    def add(self, i):
+        j = self.sparse[i]
+        if j < self.size and self.dense[j] == i:
+            return
+        self.dense[self.size] = i
+        self.sparse[i] = self.size
+        self.size += 1
+
+    def clear(self):
+        self.size = 0
+
+
+class NFAMatcher(Matcher):
+    """
+    Matches by simulating the NFA (Thompson's construction run as a Pike VM),
+    with no determinization.
+
+    Only the states with a token edge and the end state are tracked; the
+    epsilon closure of every state entered by a token edge is computed once
+    up front. Each input character then costs O(len(nfa.states)).
+
+    For an NFA with counters, the threads are configurations (see FrozenNFA)
+    and closures are computed as they are reached, since they depend on the
+    counter values. A character then costs O(len(nfa.states)) per distinct
+    set of counter values, at most the product of the counts, but the NFA
+    stays the size of the regex. search() keeps the threads of each start
+    apart while their counters differ, so searching for x{0,n} costs up to
+    O(n) per character instead of O(1).
+    """
+    def __init__(self, nfa):
+        """
+        :type nfa: NFA
+        """
+        nfa.finish()
+        frozen = nfa.frozen
+        size = len(frozen.states)
+        self.size = size
+        self.end = frozen.end
+        self.frozen = frozen
+        if frozen.counters:
+            self.start_closure = sorted(frozen.start_configs())
+            return
+        # labels[i] is the token id on the token edge of state i, or the
+        # extra id that no class holds
+        no_label = len(frozen.tokens)
+        self.labels = array('i', [no_label] * size)
+        self.class_labels = frozen.class_labels
+        self._no_class = bytearray(no_label + 1)
+        self.targets = array('i', [-1] * size)
+        entries = [frozen.start]
+        for i in xrange(size):
+            for k in xrange(frozen.offsets[i], frozen.offsets[i + 1]):
+                if not frozen.epsilons[k]:
+                    self.labels[i] = frozen.labels[k]
+                    self.targets[i] = frozen.targets[k]
+                    entries.append(frozen.targets[k])
+        self.closures = [None] * size
+        for i in entries:
+            if self.closures[i] is None:
+                self.closures[i] = tuple(sorted(
+                    j for j in frozen.closure([i])
+                    if j == self.end or self.labels[j] != no_label))
+        self.start_closure = self.closures[frozen.start]
+        self._lists = (SparseSet(size), SparseSet(size))
+        self._starts = (array('i', [0] * size), array('i', [0] * size))
+
+    def match(self, text, pos=0):
+        if self.frozen.counters:
+            return self._counted_match(text, pos)
+        labels, targets, closures, end = self.labels, self.targets, self.closures, self.end
+        class_of, class_labels, no_class = (
+            self.frozen.class_of, self.class_labels, self._no_class)
+        current, next_ = self._lists
+        current.clear()
+        for s in self.start_closure:
+            current.add(s)
+        last_end = None
+        i = pos
+        while current.size:
+            if end in current:
+                last_end = i
+            if i == len(text):
+                break
+            class_id = class_of(text[i])
+            mask = class_labels[class_id] if class_id >= 0 else no_class
+            next_.clear()
+            dense = current.dense
+            for k in xrange(current.size):
+                s = dense[k]
+                if mask[labels[s]]:
+                    for s1 in closures[targets[s]]:
+                        next_.add(s1)
+            current, next_ = next_, current
+            i += 1
+        return last_end
+
+    def search(self, text, pos=0):
+        # One pass with a thread started at every position. Threads are kept
+        # ordered by start, so the first thread to enter a state is the
+        # leftmost one; once a match is found no later thread is started.
+        if self.frozen.counters:
+            return self._counted_search(text, pos)
+        labels, targets, closures, end = self.labels, self.targets, self.closures, self.end
+        class_of, class_labels, no_class = (
+            self.frozen.class_of, self.class_labels, self._no_class)
+        current, next_ = self._lists
+        starts, next_starts = self._starts
+        current.clear()
+        best = None
+        candidates = None
+        if self.prefilter is not None:
+            candidates = self.prefilter.candidates(text, pos)
+        i = pos
+        while True:
+            if best is None:
+                if candidates is not None and not current.size:
+                    # With no live thread, skip to the next candidate start
+                    i = next((start for start in candidates if start >= i), None)
+                    if i is None:
+                        break
+                for s in self.start_closure:
+                    if s not in current:
+                        current.add(s)
+                        starts[s] = i
+            elif not current.size:
+                break
+            if end in current and (best is None or starts[end] <= best[0]):
+                best = (starts[end], i)
+            if i == len(text):
+                break
+            class_id = class_of(text[i])
+            mask = class_labels[class_id] if class_id >= 0 else no_class
+            next_.clear()
+            dense = current.dense
+            for k in xrange(current.size):
+                s = dense[k]
+                if mask[labels[s]] and (best is None or starts[s] <= best[0]):
+                    start = starts[s]
+                    for s1 in closures[targets[s]]:
+                        if s1 not in next_:
+                            next_.add(s1)
+                            next_starts[s1] = start
+            current, next_ = next_, current
+            starts, next_starts = next_starts, starts
+            i += 1
+        return best
+
+    def _counted_match(self, text, pos):
+        frozen, end = self.frozen, self.end
+        current = set(self.start_closure)
+        last_end = None
+        i = pos
+        while current:
+            if any(s == end for s, _ in current):
+                last_end = i
+            if i == len(text):
+                break
+            class_id = frozen.class_of(text[i])
+            if class_id < 0:
+                break
+            current = frozen.counted_step(current, class_id)
+            i += 1
+        return last_end
+
+    def _counted_search(self, text, pos):
+        # As search, with a list of (configuration, start) threads
+        frozen, end = self.frozen, self.end
+        candidates = _candidates(self.prefilter, text, pos)
+        threads = []
+        seen = set()
+        best = None
+        i = pos
+        while True:
+            if best is None:
+                if candidates is not None and not threads:
+                    i = next((start for start in candidates if start >= i), None)
+                    if i is None:
+                        break
+                for config in self.start_closure:
+                    if config not in seen:
+                        seen.add(config)
+                        threads.append((config, i))
+            elif not threads:
+                break
+            for config, start in threads:
+                if config[0] == end:
+                    if best is None or start <= best[0]:
+                        best = (start, i)
+                    break
+            if i == len(text):
+                break
+            class_id = frozen.class_of(text[i])
+            new_threads = []
+            seen = set()
+            if class_id >= 0:
+                for config, start in threads:
+                    if best is not None and start > best[0]:
+                        continue
+                    for config1 in frozen.counted_step([config], class_id):
+                        if config1 not in seen:
+                            seen.add(config1)
+                            new_threads.append((config1, start))
+            threads = new_threads
+            i += 1
+        return best
+
+
 def nfa_to_dfa(nfa):
     """
     :rtype : DFA
     :type nfa: NFA
     """
+    # Sets of NFA states are sorted tuples of state ids. Transitions are
+    # looked up by the move set before closure, and the closure of each NFA
+    # state is computed only once, so reaching a DFA state that already exists
+    # costs one dict lookup.
+    if nfa.counters:
+        raise ValueError('nfa_to_dfa needs an NFA built without counters')
     nfa.finish()
-    start_tmp_state = TempDFAState({nfa.start})
-    pending_dfa_states = [start_tmp_state]
-    current_id = 0
-    dfa_states = {start_tmp_state: start_tmp_state.dfa_state}
-    start_tmp_state.dfa_state.id = current_id
-    current_id += 1
-    while pending_dfa_states:
-        tmp_state = pending_dfa_states.pop()
-        for nfa_state in tmp_state.nfa_states:
-            for token, nfa_state1 in nfa_state.traverse():
-                if token == EMPTY_TOKEN:
-                    continue
-                tmp_state.add_transition(token, nfa_state1)
-        for token, nfa_states in tmp_state.traverse():
-            tmp_state1 = TempDFAState(nfa_states)
-            if tmp_state1 in dfa_states:
-                dfa_state1 = dfa_states[tmp_state1]
-            else:
-                dfa_state1 = dfa_states[tmp_state1] = tmp_state1.dfa_state
-                dfa_state1.id = current_id
-                current_id += 1
-                pending_dfa_states.append(tmp_state1)
-            tmp_state.dfa_state.set_transition(token, dfa_state1)
-    # Collect all tokens
-    tokens = set()
-    for state in dfa_states.itervalues():
-        for token, _ in state.traverse():
-            tokens.add(token)
+    collector = stats.current
+    if collector is not None:
+        start_time = time.time()
+    frozen = nfa.frozen
+    offsets, targets, labels, epsilons = (
+        frozen.offsets, frozen.targets, frozen.labels, frozen.epsilons)
+    closures = {}
+
+    def get_closure(i):
+        try:
+            return closures[i]
+        except KeyError:
+            closure = closures[i] = tuple(sorted(frozen.closure([i])))
+            return closure
+
+    # (class id, target) for every character class on the token edges of
+    # each NFA state
+    label_classes = frozen.label_classes
+    token_edges = [
+        [(class_id, targets[k]) for k in xrange(offsets[i], offsets[i + 1])
+         if not epsilons[k] for class_id in label_classes[labels[k]]]
+        for i in xrange(len(frozen.states))]
+    accepts = frozen.accepts
+    single_accepts = frozenset([0])
+    dfa_states = {}
+    move_to_state = {}
+    pending = []
+
+    def add_state(state_ids):
+        dfa_state = DFAState(frozen.to_nfa_states(state_ids))
+        dfa_state.id = len(dfa_states)
+        if frozen.end >= 0:
+            dfa_state.is_end = frozen.end in state_ids
+            if dfa_state.is_end:
+                dfa_state.accepts = single_accepts
+        else:
+            dfa_state.accepts = frozenset(
+                accepts[i] for i in state_ids if accepts[i] >= 0)
+            dfa_state.is_end = bool(dfa_state.accepts)
+        dfa_states[state_ids] = dfa_state
+        pending.append((dfa_state, [e for i in state_ids for e in token_edges[i]]))
+        return dfa_state
+
+    start_state = add_state(get_closure(frozen.start))
+    while pending:
+        dfa_state, edges = pending.pop()
+        moves = {}
+        for class_id, target in edges:
+            try:
+                moves[class_id].add(target)
+            except KeyError:
+                moves[class_id] = {target}
+        for class_id, move in moves.iteritems():
+            move = tuple(sorted(move))
+            dfa_state1 = move_to_state.get(move)
+            if dfa_state1 is None:
+                if len(move) == 1:
+                    state_ids1 = get_closure(move[0])
+                else:
+                    state_ids1 = tuple(sorted(set().union(*map(get_closure, move))))
+                dfa_state1 = dfa_states.get(state_ids1)
+                if dfa_state1 is None:
+                    dfa_state1 = add_state(state_ids1)
+                move_to_state[move] = dfa_state1
+            dfa_state.set_transition(frozen.classes[class_id], dfa_state1)
+    # Every class is a token, even one that no edge accepts
+    dfa = _complete_dfa(dfa_states, frozen.classes, start_state)
+    if collector is not None:
+        collector.add_time('nfa_to_dfa', time.time() - start_time)
+        collector.count('dfa_states', len(dfa.states))
+        collector.count('dfa_transitions', sum(len(state.trans) for state in dfa.states))
+        collector.count('dfa_dead_states', sum(state.is_dead for state in dfa.states))
+        collector.count('closures', len(closures))
+        collector.count('closure_states', sum(len(c) for c in closures.itervalues()))
+        collector.maximum('max_closure', max(len(c) for c in closures.itervalues()))
+        collector.count('move_sets', len(move_to_state))
+    return dfa
+
+
+def _complete_dfa(dfa_states, tokens, start_state):
+    """
+    Send every missing transition of dfa_states to a dead state and build the
+    DFA.
+
+    :type dfa_states: dict[tuple, DFAState]
+    :rtype: DFA
+    """
     # Create dead state
-    tmp_dead_state = TempDFAState([])
-    dead_state = tmp_dead_state.dfa_state
-    dead_state.id = current_id
-    current_id += 1
+    dead_state = DFAState([])
+    dead_state.id = len(dfa_states)
     # Try to link states to dead state
     has_dead_state = False
     for state in dfa_states.itervalues():
@@ -265,71 +1866,271 @@ def nfa_to_dfa(nfa):
     if has_dead_state:
         for token in tokens:
             dead_state.set_transition(token, dead_state)
-        dfa_states[tmp_dead_state] = dead_state
+        dfa_states[()] = dead_state
     # Create the DFA
-    dfa = DFA(dfa_states.itervalues(), tokens, start_tmp_state.dfa_state)
-    for state in dfa.states:
-        if nfa.end in state.nfa_states:
-            state.is_end = True
+    dfa = DFA(dfa_states.itervalues(), tokens, start_state)
     dfa.setup_dead_states()
     return dfa
 
 
+def _union_into_larger(set1, set2):
+    if len(set1) < len(set2):
+        set1, set2 = set2, set1
+    set1 |= set2
+    return set1
+
+
+def _follow_concat(result1, result2, followpos):
+    # The (nullable, firstpos, lastpos) of a concatenation, adding the
+    # followpos pairs it makes
+    nullable1, first1, last1 = result1
+    nullable2, first2, last2 = result2
+    for p in last1:
+        followpos[p] |= first2
+    first = _union_into_larger(first1, first2) if nullable1 else first1
+    last = _union_into_larger(last2, last1) if nullable2 else last2
+    return nullable1 and nullable2, first, last
+
+
+def regex_to_dfa(regex_node):
+    """
+    Build the DFA of regex_node directly, with no empty edges, from the
+    positions of its tokens (Glushkov's construction).
+
+    Every Char or CharSet leaf is a position, and followpos[p] holds the
+    positions that can come right after p in a match. A DFA state is a set
+    of positions, the ones the next character can match, and an extra end
+    position stands for the end of the regex. The positions are NFAStates
+    with no edges, so DFAState.nfa_states works as for nfa_to_dfa.
+
+    :type regex_node: nodes.RegexNode
+    :rtype: DFA
+    """
+    collector = stats.current
+    if collector is not None:
+        start_time = time.time()
+    regex_node = normalize_repeats(regex_node)
+    _check_expansion(regex_node)
+    positions = []
+    position_labels = []
+    labels = []
+    label_ids = {}
+    followpos = []
+    # (nullable, firstpos, lastpos) of each finished node. A node's sets are
+    # only used by its parent, so they are updated in place.
+    results = []
+    stack = [(regex_node, False)]
+    while stack:
+        node, children_done = stack.pop()
+        children = _copied_children(node)
+        if children and not children_done:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+        if isinstance(node, (nodes.Char, nodes.CharSet)):
+            if isinstance(node, nodes.Char):
+                token = CharClass(node.token)
+            else:
+                token = CharClass(node.chars, node.negated)
+            if token not in label_ids:
+                label_ids[token] = len(labels)
+                labels.append(token)
+            p = len(positions)
+            position = NFAState(node)
+            position.id = p
+            positions.append(position)
+            position_labels.append(label_ids[token])
+            followpos.append(set())
+            results.append((False, {p}, {p}))
+        elif isinstance(node, nodes.Empty):
+            results.append((True, set(), set()))
+        elif isinstance(node, nodes.Group):
+            # Positions have no tags; the group only matters to tdfa
+            pass
+        elif isinstance(node, nodes.Concat):
+            result2 = results.pop()
+            results.append(_follow_concat(results.pop(), result2, followpos))
+        elif isinstance(node, nodes.Or):
+            nullable2, first2, last2 = results.pop()
+            nullable1, first1, last1 = results.pop()
+            results.append((nullable1 or nullable2, _union_into_larger(first1, first2),
+                            _union_into_larger(last1, last2)))
+        elif isinstance(node, nodes.UnaryRegexNode):
+            nullable, first, last = results.pop()
+            if not isinstance(node, nodes.ZeroOrOne):
+                for p in last:
+                    followpos[p] |= first
+            results.append((nullable or not isinstance(node, nodes.OneOrMore), first, last))
+        elif isinstance(node, nodes.Repeat):
+            # As in regex_to_nfa: min copies in sequence, then either a loop on
+            # the last one or nested optional copies, x(x(x)?)?
+            copies = results[len(results) - len(children):]
+            del results[len(results) - len(children):]
+            result = True, set(), set()
+            for i in xrange(len(copies) - 1, -1, -1):
+                if i == len(copies) - 1:
+                    result = copies[i]
+                    if node.max is None:
+                        for p in result[2]:
+                            followpos[p] |= result[1]
+                else:
+                    result = _follow_concat(copies[i], result, followpos)
+                if i >= node.min:
+                    result = (True,) + result[1:]
+            results.append(result)
+        else:
+            raise UnknownRegexNodeTypeError(type(node))
+    nullable, first, last = results[0]
+    end = len(positions)
+    end_position = NFAState(None)
+    end_position.id = end
+    end_position.pattern_id = 0
+    positions.append(end_position)
+    for p in last:
+        followpos[p].add(end)
+    if nullable:
+        first.add(end)
+
+    classes, label_classes = partition_alphabet(labels)
+    position_classes = [label_classes[label] for label in position_labels]
+    accepts = frozenset([0])
+    dfa_states = {}
+    pending = []
+
+    def add_state(position_ids):
+        dfa_state = DFAState(positions[p] for p in position_ids)
+        dfa_state.id = len(dfa_states)
+        dfa_state.is_end = end in position_ids
+        if dfa_state.is_end:
+            dfa_state.accepts = accepts
+        dfa_states[position_ids] = dfa_state
+        pending.append((dfa_state, position_ids))
+        return dfa_state
+
+    start_state = add_state(tuple(sorted(first)))
+    while pending:
+        dfa_state, position_ids = pending.pop()
+        moves = {}
+        for p in position_ids:
+            if p == end:
+                continue
+            for class_id in position_classes[p]:
+                try:
+                    moves[class_id] |= followpos[p]
+                except KeyError:
+                    moves[class_id] = set(followpos[p])
+        for class_id, move in moves.iteritems():
+            move = tuple(sorted(move))
+            dfa_state1 = dfa_states.get(move)
+            if dfa_state1 is None:
+                dfa_state1 = add_state(move)
+            dfa_state.set_transition(classes[class_id], dfa_state1)
+    dfa = _complete_dfa(dfa_states, classes, start_state)
+    if collector is not None:
+        collector.add_time('regex_to_dfa', time.time() - start_time)
+        collector.count('positions', len(positions))
+        collector.count('followpos_edges', sum(len(f) for f in followpos))
+        collector.count('dfa_states', len(dfa.states))
+        collector.count('dfa_dead_states', sum(state.is_dead for state in dfa.states))
+    return dfa
+
+
 def minimize_dfa(dfa):
     """
+    Minimize with Hopcroft's partition refinement: blocks are only split by
+    the predecessors of a splitter block, found through inverse transitions.
+
     :type dfa: DFA
     :rtype: DFA
     """
-    state_to_group = {}
-    groups = [[s for s in dfa.states if not s.is_end],
-              [s for s in dfa.states if s.is_end]]
-    while True:
-        for group in groups:
-            for state in group:
-                state_to_group[state] = group
-        new_groups = []
-        for group in groups:
-            group_id_to_group = {}
-            for token in dfa.tokens:
-                state_to_new_group = {}
-                group_id_to_group = {}
-                for state in group:
-                    state1 = state.get_transition(token)
-                    state_to_new_group[state] = new_group = state_to_group[state1]
-                    new_group_id = id(new_group)
-                    if new_group_id in group_id_to_group:
-                        group_id_to_group[new_group_id].append(state)
-                    else:
-                        group_id_to_group[new_group_id] = [state]
-                if len(group_id_to_group) > 1:
-                    break
-            new_groups.extend(group_id_to_group.itervalues())
-        if len(new_groups) == len(groups):
-            break
-        groups = new_groups
+    collector = stats.current
+    if collector is not None:
+        start_time = time.time()
+    states = dfa.states
+    state_to_index = dict((state, i) for i, state in enumerate(states))
+    # inverses[k][j] lists the states going to state j on the k-th token
+    inverses = [{} for _ in dfa.tokens]
+    for i, state in enumerate(states):
+        for k, token in enumerate(dfa.tokens):
+            j = state_to_index[state.get_transition(token)]
+            try:
+                inverses[k][j].append(i)
+            except KeyError:
+                inverses[k][j] = [i]
 
-    group_id_to_new_state = {}
-    for group in groups:
+    # States start in one block per set of accepted patterns, so states
+    # accepting different patterns are never merged
+    blocks = []
+    block_of = [None] * len(states)
+    accept_blocks = {}
+    for i, state in enumerate(states):
+        b = accept_blocks.get(state.accepts)
+        if b is None:
+            b = accept_blocks[state.accepts] = len(blocks)
+            blocks.append(set())
+        blocks[b].add(i)
+        block_of[i] = b
+    pending = set(xrange(len(blocks)))
+    if len(blocks) > 1:
+        pending.remove(max(pending, key=lambda b: len(blocks[b])))
+
+    rounds = splits = 0
+    while pending:
+        if collector is not None:
+            rounds += 1
+        splitter = list(blocks[pending.pop()])
+        for inverse in inverses:
+            block_to_sources = {}
+            for j in splitter:
+                for i in inverse.get(j, ()):
+                    try:
+                        block_to_sources[block_of[i]].append(i)
+                    except KeyError:
+                        block_to_sources[block_of[i]] = [i]
+            for b, sources in block_to_sources.iteritems():
+                block = blocks[b]
+                if len(sources) == len(block):
+                    continue
+                if collector is not None:
+                    splits += 1
+                new_block = set(sources)
+                block -= new_block
+                new_b = len(blocks)
+                blocks.append(new_block)
+                for i in sources:
+                    block_of[i] = new_b
+                if b in pending or len(new_block) <= len(block):
+                    pending.add(new_b)
+                else:
+                    pending.add(b)
+
+    # Each block is represented by its member with the smallest id
+    representatives = [min((states[i] for i in block), key=lambda x: x.id)
+                       for block in blocks]
+    new_states = []
+    for block, dfa_state in zip(blocks, representatives):
         nfa_states = set()
-        for dfa_state in group:
-            nfa_states.update(dfa_state.nfa_states)
+        for i in block:
+            nfa_states.update(states[i].nfa_states)
         new_state = DFAState(nfa_states)
-        dfa_state = group[0]
         new_state.is_end = dfa_state.is_end
+        new_state.accepts = dfa_state.accepts
         new_state.is_dead = dfa_state.is_dead
         new_state.id = dfa_state.id
-        group_id_to_new_state[id(group)] = new_state
-    new_states = []
-    for group in groups:
-        new_state = group_id_to_new_state[id(group)]
         new_states.append(new_state)
+    for new_state, dfa_state in zip(new_states, representatives):
         for token in dfa.tokens:
-            next_state = group_id_to_new_state[
-                id(state_to_group[group[0].get_transition(token)])]
+            next_state = new_states[block_of[state_to_index[dfa_state.get_transition(token)]]]
             new_state.set_transition(token, next_state)
-    new_start = group_id_to_new_state[id(state_to_group[dfa.start])]
+    new_start = new_states[block_of[state_to_index[dfa.start]]]
     # Relabel
     new_states.sort(key=lambda x: x.id)
     for i, new_state in enumerate(new_states):
         new_state.id = i
+    if collector is not None:
+        collector.add_time('minimize_dfa', time.time() - start_time)
+        collector.count('refinement_rounds', rounds)
+        collector.count('block_splits', splits)
+        collector.count('mdfa_states', len(new_states))
+        collector.count('mdfa_dead_states', sum(state.is_dead for state in new_states))
     return DFA(new_states, dfa.tokens, new_start)
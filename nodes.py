@@ -1,5 +1,8 @@
 class RegexNode(object):
     __fields__ = []
+    def children(self):
+        return ()
+
     def __repr__(self):
         return '{}({})'.format(
                 self.__class__.__name__,
@@ -16,6 +19,9 @@ class UnaryRegexNode(RegexNode):
     def __init__(self, arg):
         self.arg = arg
 
+    def children(self):
+        return self.arg,
+
 class OneOrMore(UnaryRegexNode):
     char = '+'
 
@@ -25,12 +31,37 @@ class ZeroOrMore(UnaryRegexNode):
 class ZeroOrOne(UnaryRegexNode):
     char = '?'
 
+class Repeat(RegexNode):
+    # arg repeated from min to max times, or any number of times from min if
+    # max is None
+    __fields__ = ['arg', 'min', 'max']
+    def __init__(self, arg, min, max):
+        self.arg = arg
+        self.min = min
+        self.max = max
+
+    def children(self):
+        return self.arg,
+
+class Group(RegexNode):
+    # Capture group number index (from 1) around arg; see parse.from_string
+    __fields__ = ['arg', 'index']
+    def __init__(self, arg, index):
+        self.arg = arg
+        self.index = index
+
+    def children(self):
+        return self.arg,
+
 class BinaryRegexNode(RegexNode):
     __fields__ = ['arg1', 'arg2']
     def __init__(self, arg1, arg2):
         self.arg1 = arg1
         self.arg2 = arg2
 
+    def children(self):
+        return self.arg1, self.arg2
+
 class Concat(BinaryRegexNode):
     char = ''
 
@@ -40,4 +71,11 @@ class Or(BinaryRegexNode):
 class Empty(RegexNode):
     pass
 
+class CharSet(RegexNode):
+    # Any one of chars (a sorted string), or any character but those if negated
+    __fields__ = ['chars', 'negated']
+    def __init__(self, chars, negated=False):
+        self.chars = ''.join(sorted(set(chars)))
+        self.negated = negated
+
 UNARY_NODE_TYPES = [OneOrMore, ZeroOrMore, ZeroOrOne]
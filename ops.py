@@ -0,0 +1,311 @@
+"""
+Language operations on automata through product constructions: equivalence
+and inclusion checks that stop at the first counterexample, and
+intersection, difference and complement DFAs.
+
+The operands are fsa.DFAs or finished fsa.NFAs. An NFA is determinized only
+as far as the product reaches, so two patterns can be compared without
+building either DFA in full:
+
+    a = pipeline.compile('(a|b)*abb', 'nfa')
+    b = pipeline.compile('(a*b)*a*abb', 'nfa')
+    counterexample(a, b)  # None: same language
+
+The characters of both operands are split into the classes of
+fsa.partition_alphabet, and the product steps both on one representative
+character of each class.
+"""
+import collections
+import sys
+
+import fsa
+import stats
+
+# The state of an operand once it can no longer accept: a DFA with no
+# transition for a character, or an empty set of NFA states
+SINK = -1
+
+
+class _DFAOperand(object):
+    def __init__(self, dfa):
+        """
+        :type dfa: fsa.DFA
+        """
+        self.dfa = dfa
+        self.tokens = dfa.tokens
+        index = dict((id(state), i) for i, state in enumerate(dfa.states))
+        self.start = index[id(dfa.start)]
+        self.ends = [state.is_end for state in dfa.states]
+        self.transitions = [dict((token, index[id(state1)]) for token, state1 in state.traverse())
+                            for state in dfa.states]
+
+    def step(self, state, c):
+        # c is None for a character no token lists
+        if state == SINK:
+            return SINK
+        token = self.dfa.token_for(c) if c is not None else self.dfa.other
+        return self.transitions[state].get(token, SINK)
+
+    def is_end(self, state):
+        return state != SINK and self.ends[state]
+
+    def is_dead(self, state):
+        return state == SINK or self.dfa.states[state].is_dead
+
+
+class _NFAOperand(object):
+    def __init__(self, nfa):
+        """
+        :type nfa: fsa.NFA
+        """
+        nfa.finish()
+        self.nfa = nfa.frozen
+        self.tokens = self.nfa.classes
+        self.start = frozenset(self.nfa.closure([self.nfa.start]))
+        self.cache = {}
+
+    def step(self, state, c):
+        class_id = self.nfa.class_of(c) if c is not None else self.nfa.other_class
+        if class_id < 0 or not state:
+            return frozenset()
+        try:
+            return self.cache[state, class_id]
+        except KeyError:
+            state1 = self.cache[state, class_id] = frozenset(self.nfa.step(state, class_id))
+            return state1
+
+    def is_end(self, state):
+        accepts = self.nfa.accepts
+        return any(accepts[i] >= 0 for i in state)
+
+    def is_dead(self, state):
+        return not state
+
+
+def _operand(automaton):
+    if isinstance(automaton, fsa.DFA):
+        return _DFAOperand(automaton)
+    elif isinstance(automaton, fsa.NFA):
+        return _NFAOperand(automaton)
+    raise TypeError('Expected a DFA or an NFA: {!r}'.format(automaton))
+
+
+def _alphabet(operands):
+    """
+    Return the classes splitting the characters of all operands, the last
+    one being the negated class of the characters none of them lists, and a
+    representative character of each, None for the negated class.
+
+    :rtype: (list[fsa.CharClass], list[str | None])
+    """
+    labels = [token for operand in operands for token in operand.tokens]
+    classes, _ = fsa.partition_alphabet(labels + [fsa.CharClass('', negated=True)])
+    return classes, [min(char_class.chars) if not char_class.negated else None
+                     for char_class in classes]
+
+
+def _unlisted_char(classes):
+    # A character in the negated class, to spell out a counterexample
+    listed = set(c for char_class in classes if not char_class.negated
+                 for c in char_class.chars)
+    for i in xrange(sys.maxunicode + 1):
+        c = chr(i) if i < 128 else unichr(i)
+        if c not in listed:
+            return c
+
+
+def _word(came_from, key, classes, chars):
+    """
+    Spell the characters leading to key, following came_from back to the
+    start.
+    """
+    word = []
+    while came_from[key] is not None:
+        key, class_id = came_from[key]
+        c = chars[class_id]
+        word.append(c if c is not None else _unlisted_char(classes))
+    return ''.join(reversed(word))
+
+
+def counterexample(a, b):
+    """
+    Return a string accepted by exactly one of a and b, or None if they
+    accept the same language.
+
+    The pairs of states reached by the same string are explored breadth
+    first, and a union-find of the states already known to be equivalent
+    (Hopcroft and Karp) skips every pair whose states were merged before.
+    The search stops at the first pair that disagrees.
+
+    :type a: fsa.DFA | fsa.NFA
+    :type b: fsa.DFA | fsa.NFA
+    :rtype: str | None
+    """
+    operand1, operand2 = _operand(a), _operand(b)
+    classes, chars = _alphabet([operand1, operand2])
+    # The states of a are keyed (1, state) and those of b (2, state). A key
+    # missing from parent is the root of its set.
+    parent = {}
+
+    def find(x):
+        root = x
+        while root in parent:
+            root = parent[root]
+        while x != root:
+            parent[x], x = root, parent[x]
+        return root
+
+    start = (operand1.start, operand2.start)
+    parent[1, operand1.start] = 2, operand2.start
+    came_from = {start: None}
+    queue = collections.deque([start])
+    word = None
+    while queue:
+        pair = queue.popleft()
+        state1, state2 = pair
+        if operand1.is_end(state1) != operand2.is_end(state2):
+            word = _word(came_from, pair, classes, chars)
+            break
+        for class_id, c in enumerate(chars):
+            pair1 = operand1.step(state1, c), operand2.step(state2, c)
+            root1, root2 = find((1, pair1[0])), find((2, pair1[1]))
+            if root1 != root2:
+                parent[root1] = root2
+                came_from[pair1] = pair, class_id
+                queue.append(pair1)
+    collector = stats.current
+    if collector is not None:
+        collector.count('product_pairs', len(came_from))
+    return word
+
+
+def is_equivalent(a, b):
+    """
+    :type a: fsa.DFA | fsa.NFA
+    :type b: fsa.DFA | fsa.NFA
+    :rtype: bool
+    """
+    return counterexample(a, b) is None
+
+
+def inclusion_counterexample(a, b):
+    """
+    Return a shortest string accepted by a and not by b, or None if the
+    language of a is included in that of b.
+
+    :type a: fsa.DFA | fsa.NFA
+    :type b: fsa.DFA | fsa.NFA
+    :rtype: str | None
+    """
+    operand1, operand2 = _operand(a), _operand(b)
+    classes, chars = _alphabet([operand1, operand2])
+    start = (operand1.start, operand2.start)
+    came_from = {start: None}
+    queue = collections.deque([start])
+    word = None
+    while queue:
+        pair = queue.popleft()
+        state1, state2 = pair
+        if operand1.is_end(state1) and not operand2.is_end(state2):
+            word = _word(came_from, pair, classes, chars)
+            break
+        if operand1.is_dead(state1):
+            # a accepts nothing more from here
+            continue
+        for class_id, c in enumerate(chars):
+            pair1 = operand1.step(state1, c), operand2.step(state2, c)
+            if pair1 not in came_from:
+                came_from[pair1] = pair, class_id
+                queue.append(pair1)
+    collector = stats.current
+    if collector is not None:
+        collector.count('product_pairs', len(came_from))
+    return word
+
+
+def is_subset(a, b):
+    """
+    Return whether every string accepted by a is accepted by b.
+
+    :type a: fsa.DFA | fsa.NFA
+    :type b: fsa.DFA | fsa.NFA
+    :rtype: bool
+    """
+    return inclusion_counterexample(a, b) is None
+
+
+def _product(automata, accept):
+    """
+    Build the DFA of the reachable tuples of states of automata, accepting
+    where accept(is_end of each state) holds. Every class has a transition,
+    so the DFA is complete over all characters.
+
+    :rtype: fsa.DFA
+    """
+    operands = [_operand(automaton) for automaton in automata]
+    classes, chars = _alphabet(operands)
+    start = tuple(operand.start for operand in operands)
+    dfa_states = {}
+    pending = []
+
+    def add_state(key):
+        # A fresh NFAState stands for the tuple, so that no two states of the
+        # product compare equal
+        marker = fsa.NFAState(None)
+        marker.id = len(dfa_states)
+        dfa_state = fsa.DFAState([marker])
+        dfa_state.id = marker.id
+        dfa_state.is_end = accept(*[operand.is_end(state)
+                                    for operand, state in zip(operands, key)])
+        if dfa_state.is_end:
+            dfa_state.accepts = frozenset([0])
+        dfa_states[key] = dfa_state
+        pending.append((dfa_state, key))
+        return dfa_state
+
+    start_state = add_state(start)
+    while pending:
+        dfa_state, key = pending.pop()
+        for char_class, c in zip(classes, chars):
+            key1 = tuple(operand.step(state, c) for operand, state in zip(operands, key))
+            dfa_state1 = dfa_states.get(key1)
+            if dfa_state1 is None:
+                dfa_state1 = add_state(key1)
+            dfa_state.set_transition(char_class, dfa_state1)
+    dfa = fsa.DFA(sorted(dfa_states.itervalues(), key=lambda state: state.id),
+                  classes, start_state)
+    dfa.setup_dead_states()
+    collector = stats.current
+    if collector is not None:
+        collector.count('product_states', len(dfa.states))
+    return dfa
+
+
+def intersection(a, b):
+    """
+    :type a: fsa.DFA | fsa.NFA
+    :type b: fsa.DFA | fsa.NFA
+    :rtype: fsa.DFA
+    """
+    return _product([a, b], lambda end1, end2: end1 and end2)
+
+
+def difference(a, b):
+    """
+    The DFA of the strings accepted by a and not by b.
+
+    :type a: fsa.DFA | fsa.NFA
+    :type b: fsa.DFA | fsa.NFA
+    :rtype: fsa.DFA
+    """
+    return _product([a, b], lambda end1, end2: end1 and not end2)
+
+
+def complement(a):
+    """
+    The DFA of every string, over all characters, that a does not accept.
+
+    :type a: fsa.DFA | fsa.NFA
+    :rtype: fsa.DFA
+    """
+    return _product([a], lambda end: not end)
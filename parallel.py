@@ -0,0 +1,260 @@
+"""
+Scanning large inputs with a DFA on several processes.
+
+The input is cut into chunks, and each chunk is run from every DFA state it
+could be entered in, giving a map from entry state to (exit state, accepts).
+The maps are independent of each other, so they are computed in parallel,
+and composing them in order gives the result of one serial scan.
+"""
+import collections
+import contextlib
+import multiprocessing
+import mmap
+import os
+import tempfile
+
+import fsa
+import nodes
+import pipeline
+import shm
+
+# The result of a scan: the state after the whole input (-1 if the input
+# left the DFA or reached a dead state, as in CompiledDFA.run), and the
+# number and, if asked for, the list of the positions i at which text[:i]
+# is accepted
+ScanResult = collections.namedtuple('ScanResult', ['state', 'count', 'positions'])
+
+
+def search_dfa(pattern):
+    """
+    Return the compiled DFA of `.*(pattern)`, where `.` is any character, so
+    that the accepted positions of a scan are the ends of the matches of
+    pattern anywhere in the text.
+
+    :rtype: fsa.CompiledDFA
+    """
+    any_char = nodes.CharSet('', negated=True)
+    node = nodes.Concat(nodes.ZeroOrMore(any_char), pipeline.compile(pattern, 'ast'))
+    nfa = fsa.regex_to_nfa(node)
+    return fsa.minimize_dfa(fsa.nfa_to_dfa(nfa)).compile()
+
+
+def run_chunk(compiled, text, offset, start_states, with_positions=False):
+    """
+    Run text, found at offset in the input, from each of start_states.
+    Return a dict mapping each start state to (exit state, number of
+    accepted positions, list of them or None).
+
+    All runs are stepped together, and runs reaching the same state at the
+    same position are merged, since they continue the same way; for a
+    minimized DFA most runs merge within a few characters.
+
+    :type compiled: fsa.CompiledDFA
+    :type start_states: list[int]
+    """
+    table, columns, other_column = compiled.table, compiled.columns, compiled.other_column
+    accepts, deads = compiled.accepts, compiled.deads
+    width = len(compiled.tokens)
+    k = len(start_states)
+    states = list(start_states)
+    counts = [0] * k
+    positions = [[] for _ in xrange(k)] if with_positions else None
+    # merged[g] is (g1, counts[g1]) if run g joined run g1
+    merged = [None] * k
+    merge_order = []
+    live = [g for g in xrange(k) if states[g] >= 0 and not compiled.is_dead(states[g])]
+    j = 0
+    while j < len(text) and len(live) > 1:
+        column = columns.get(text[j], other_column)
+        owners = {}
+        new_live = []
+        for g in live:
+            state = table[states[g] * width + column] if column >= 0 else -1
+            states[g] = state
+            if state < 0 or deads[state >> 3] & (1 << (state & 7)):
+                continue
+            owner = owners.get(state)
+            if owner is not None:
+                merged[g] = (owner, counts[owner])
+                merge_order.append(g)
+            else:
+                owners[state] = g
+                new_live.append(g)
+        j += 1
+        for g in new_live:
+            state = states[g]
+            if accepts[state >> 3] & (1 << (state & 7)):
+                counts[g] += 1
+                if with_positions:
+                    positions[g].append(offset + j)
+        live = new_live
+    if len(live) == 1:
+        # A single run left, which needs no merging
+        g, = live
+        state, count = states[g], counts[g]
+        found = positions[g] if with_positions else None
+        while j < len(text):
+            column = columns.get(text[j], other_column)
+            if column < 0:
+                state = -1
+                break
+            state = table[state * width + column]
+            j += 1
+            bit = 1 << (state & 7)
+            if deads[state >> 3] & bit:
+                break
+            if accepts[state >> 3] & bit:
+                count += 1
+                if with_positions:
+                    found.append(offset + j)
+        states[g], counts[g] = state, count
+    # A run that joined another takes its remaining accepts. Runs join runs
+    # that are still live, so resolving them in reverse order of merging
+    # finds every target resolved.
+    results = [None] * k
+    for g in xrange(k):
+        if merged[g] is None:
+            results[g] = (states[g], counts[g], positions[g] if with_positions else None)
+    for g in reversed(merge_order):
+        owner, at = merged[g]
+        state, count, found = results[owner]
+        if with_positions:
+            found = positions[g] + found[at:]
+        results[g] = (state, counts[g] + count - at, found)
+    return dict(zip(start_states, results))
+
+
+def compose(compiled, chunk_maps, with_positions=False):
+    """
+    Follow the maps of consecutive chunks from the start state.
+
+    :type compiled: fsa.CompiledDFA
+    :type chunk_maps: list[dict]
+    :rtype: ScanResult
+    """
+    state = compiled.start
+    count = 1 if compiled.is_accept(state) else 0
+    positions = [0] * count if with_positions else None
+    for chunk_map in chunk_maps:
+        if state < 0 or compiled.is_dead(state):
+            break
+        state, chunk_count, found = chunk_map[state]
+        count += chunk_count
+        if with_positions:
+            positions.extend(found)
+    if state >= 0 and compiled.is_dead(state):
+        state = -1
+    return ScanResult(state, count, positions)
+
+
+def _entry_states(compiled, offset):
+    # The first chunk is only entered in the start state, and runs from a
+    # dead state stay there with no accepts
+    if offset == 0:
+        return [compiled.start]
+    return [s for s in xrange(compiled.num_states) if not compiled.is_dead(s)]
+
+
+# The DFA and the input of a pool worker, set by _init_worker
+_worker = {}
+
+
+def _init_worker(dfa_name, path):
+    _worker['compiled'] = shm.attach(dfa_name)
+    if path is not None:
+        with open(path, 'rb') as f:
+            _worker['mapping'] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _run_task(task):
+    offset, chunk, with_positions = task
+    compiled = _worker['compiled']
+    if chunk is None:
+        chunk = buffer(_worker['mapping'], offset, _worker['chunk_size'])
+    return run_chunk(compiled, chunk, offset, _entry_states(compiled, offset),
+                     with_positions)
+
+
+def _init_file_worker(dfa_name, path, chunk_size):
+    _init_worker(dfa_name, path)
+    _worker['chunk_size'] = chunk_size
+
+
+def _scan(compiled, tasks, processes, initializer, initargs):
+    # Workers attach to the DFA in shared memory, so its table is not copied
+    with shm.exported(compiled) as dfa_name:
+        pool = multiprocessing.Pool(processes, initializer, (dfa_name,) + initargs)
+        try:
+            return pool.map(_run_task, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+
+def _compiled(dfa):
+    return dfa.compile() if isinstance(dfa, fsa.DFA) else dfa
+
+
+@contextlib.contextmanager
+def _shared_text(text):
+    # A copy of text in the shared memory directory (see shm), removed after
+    # the block, for the workers to map like a file given to scan_file
+    fd, path = tempfile.mkstemp(dir=shm.SHM_DIR, prefix='regextext-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(text)
+        yield path
+    finally:
+        os.unlink(path)
+
+
+def scan(dfa, text, chunk_size=1 << 20, processes=None, with_positions=False):
+    """
+    Scan text with dfa in chunks of chunk_size on processes worker processes
+    (by default one per core). With processes=1 the chunks are run in this
+    process.
+
+    A byte text (str or buffer) is copied once into shared memory, where the
+    workers read their chunks in place as in scan_file, instead of each
+    chunk being pickled to its worker. A unicode text has no such byte form,
+    so its chunks are still pickled: once to send them and once more to
+    unpickle them in the worker (bench.py parallel times both).
+
+    :type dfa: fsa.DFA | fsa.CompiledDFA
+    :rtype: ScanResult
+    """
+    compiled = _compiled(dfa)
+    offsets = xrange(0, len(text), chunk_size)
+    if processes == 1:
+        chunk_maps = [run_chunk(compiled, text[offset:offset + chunk_size], offset,
+                                _entry_states(compiled, offset), with_positions)
+                      for offset in offsets]
+    elif not len(text):
+        chunk_maps = []
+    elif isinstance(text, unicode):
+        tasks = [(offset, text[offset:offset + chunk_size], with_positions)
+                 for offset in offsets]
+        chunk_maps = _scan(compiled, tasks, processes, _init_worker, (None,))
+    else:
+        tasks = [(offset, None, with_positions) for offset in offsets]
+        with _shared_text(text) as path:
+            chunk_maps = _scan(compiled, tasks, processes, _init_file_worker,
+                               (path, chunk_size))
+    return compose(compiled, chunk_maps, with_positions)
+
+
+def scan_file(dfa, path, chunk_size=1 << 24, processes=None, with_positions=False):
+    """
+    Scan the file at path like scan(). Each worker maps the file and reads
+    its chunks in place.
+
+    :type dfa: fsa.DFA | fsa.CompiledDFA
+    :rtype: ScanResult
+    """
+    compiled = _compiled(dfa)
+    size = os.path.getsize(path)
+    if not size:
+        return compose(compiled, [], with_positions)
+    tasks = [(offset, None, with_positions) for offset in xrange(0, size, chunk_size)]
+    chunk_maps = _scan(compiled, tasks, processes, _init_file_worker, (path, chunk_size))
+    return compose(compiled, chunk_maps, with_positions)
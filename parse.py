@@ -1,54 +1,195 @@
+import re
+import time
+
 import nodes
+import stats
+
+
+class RegexSyntaxError(Exception):
+    pass
+
+
+class ParseFrame(object):
+    """
+    The part of a (parenthesized) regex that has been read so far.
+
+    `alternative` holds the `|` operands already completed, `prefix` the
+    concatenation before the last atom and `last` the last atom itself, which
+    is kept apart so that a following unary operator can be applied to it.
+    `group` is the capture group number of the parentheses, if any.
+    """
+    def __init__(self, index, group=None):
+        self.index = index
+        self.group = group
+        self.alternative = None
+        self.prefix = None
+        self.last = None
+
+    def push_atom(self, node):
+        if self.last is not None:
+            if self.prefix is None:
+                self.prefix = self.last
+            else:
+                self.prefix = nodes.Concat(self.prefix, self.last)
+        self.last = node
+
+    def apply_unary(self, type_):
+        self.last = type_(self.last if self.last is not None else nodes.Empty())
+
+    def apply_repeat(self, min, max):
+        self.last = nodes.Repeat(self.last if self.last is not None else nodes.Empty(),
+                                 min, max)
+
+    def finish_sequence(self):
+        if self.last is None:
+            sequence = nodes.Empty()
+        elif self.prefix is None:
+            sequence = self.last
+        else:
+            sequence = nodes.Concat(self.prefix, self.last)
+        self.prefix = self.last = None
+        return sequence
+
+    def push_or(self):
+        sequence = self.finish_sequence()
+        if self.alternative is None:
+            self.alternative = sequence
+        else:
+            self.alternative = nodes.Or(self.alternative, sequence)
+
+    def finish(self):
+        sequence = self.finish_sequence()
+        if self.alternative is None:
+            return sequence
+        return nodes.Or(self.alternative, sequence)
 
-class ParseState(object):
-    NO_OPR = 0
-    UNARY = 1
-    BINARY = 2
 
-    def __init__(self):
-        self.level = 0
-        self.state = self.NO_OPR
-        self.opr_type = None
-        self.opr_index = None
+UNARY_CHARS = dict((type_.char, type_) for type_ in nodes.UNARY_NODE_TYPES)
 
+# `.` matches any character but a newline
+ANY_CHAR = nodes.CharSet('\n', negated=True)
 
-def from_string(regex):
+# The largest count allowed in {m,n}; the constructions that build a repeat
+# as that many copies of its operand also limit the total, see
+# fsa.MAX_EXPANSION
+MAX_REPEAT = 10000
+
+# {m}, {m,}, {,n} or {m,n}; any other `{` is an ordinary character
+REPEAT_RE = re.compile(r'\{(\d*)(,?)(\d*)\}')
+
+
+def _read_class_char(regex, i):
+    # Inside brackets a backslash escapes the next character
+    if regex[i] == '\\' and i + 1 < len(regex):
+        return regex[i + 1], i + 2
+    return regex[i], i + 1
+
+
+def _parse_char_set(regex, i):
+    """
+    Parse the character class starting after the `[` at regex[i - 1].
+    Return the node and the index after the closing `]`.
+    """
+    start = i - 1
+    negated = i < len(regex) and regex[i] == '^'
+    if negated:
+        i += 1
+    chars = set()
+    first = True
+    while True:
+        if i >= len(regex):
+            raise RegexSyntaxError('Unterminated "[" at {}'.format(start))
+        if regex[i] == ']' and not first:
+            return nodes.CharSet(chars, negated), i + 1
+        first = False
+        lo, i = _read_class_char(regex, i)
+        if i + 1 < len(regex) and regex[i] == '-' and regex[i + 1] != ']':
+            hi, i = _read_class_char(regex, i + 1)
+            if ord(lo) > ord(hi):
+                raise RegexSyntaxError('Bad range {}-{} at {}'.format(lo, hi, start))
+            chars.update(unichr(c) if isinstance(lo, unicode) else chr(c)
+                         for c in xrange(ord(lo), ord(hi) + 1))
+        else:
+            chars.add(lo)
+
+
+def _parse_repeat(regex, i):
+    """
+    Parse the {m,n} starting at the `{` at regex[i - 1]. Return m, n (None if
+    unbounded) and the index after the closing `}`, or None if it is not a
+    repeat.
+    """
+    match = REPEAT_RE.match(regex, i - 1)
+    if match is None or not (match.group(1) or match.group(2) and match.group(3)):
+        return None
+    low = int(match.group(1) or 0)
+    if not match.group(2):
+        high = low
+    elif match.group(3):
+        high = int(match.group(3))
+    else:
+        high = None
+    if high is not None and low > high:
+        raise RegexSyntaxError('Bad repeat {} at {}'.format(match.group(0), i - 1))
+    if (low if high is None else high) > MAX_REPEAT:
+        raise RegexSyntaxError('Repeat {} at {} is over {}'.format(
+            match.group(0), i - 1, MAX_REPEAT))
+    return low, high, match.end()
+
+
+def from_string(regex, captures=False):
     # regex: str -> node: RegexNode
-    if not regex:
-        return nodes.Empty()
-    state = ParseState()
-    for i, c in enumerate(regex):
-        if state.level == 0:
-            if any(type_.char == c for type_ in nodes.UNARY_NODE_TYPES):
-                if state.state != ParseState.BINARY:
-                    state.state = ParseState.UNARY
-                    state.opr_type = next(t for t in nodes.UNARY_NODE_TYPES if t.char == c)
-                    state.opr_index = i
-            elif c == nodes.Or.char:
-                state.opr_type = nodes.Or
-                state.opr_index = i
-                state.state = ParseState.BINARY
-            elif state.state != ParseState.BINARY or state.opr_type != nodes.Or:
-                if i > 0:
-                    state.state = ParseState.BINARY
-                    state.opr_type = nodes.Concat
-                    state.opr_index = i
-        if c == '(':
-            state.level += 1
+    # A single left-to-right pass; parentheses push a frame on an explicit
+    # stack, so neither the time nor the nesting depth is bounded by recursion.
+    # With captures, each pair of parentheses is a nodes.Group, numbered from
+    # 1 in the order of the `(`; otherwise they only group.
+    collector = stats.current
+    if collector is not None:
+        start_time = time.time()
+    frame = ParseFrame(0)
+    stack = []
+    groups = 0
+    i = 0
+    while i < len(regex):
+        c = regex[i]
+        i += 1
+        if c == '[':
+            node, i = _parse_char_set(regex, i)
+            frame.push_atom(node)
+        elif c == '.':
+            frame.push_atom(ANY_CHAR)
+        elif c in UNARY_CHARS:
+            frame.apply_unary(UNARY_CHARS[c])
+        elif c == '{':
+            repeat = _parse_repeat(regex, i)
+            if repeat is None:
+                frame.push_atom(nodes.Char(c))
+            else:
+                low, high, i = repeat
+                frame.apply_repeat(low, high)
+        elif c == nodes.Or.char:
+            frame.push_or()
+        elif c == '(':
+            stack.append(frame)
+            if captures:
+                groups += 1
+                frame = ParseFrame(i - 1, groups)
+            else:
+                frame = ParseFrame(i - 1)
         elif c == ')':
-            state.level -= 1
-
-    if state.state == ParseState.NO_OPR:
-        if regex[0] == '(' and regex[-1] == ')':
-            return from_string(regex[1:-1])
-        assert len(regex) == 1, 'Unexpected regex: {}'.format(regex)
-        return nodes.Char(regex)
-    elif state.state == ParseState.UNARY:
-        assert state.opr_index == len(regex) - 1, 'Invalid sub-regex: {}'.format(regex)
-        return state.opr_type(from_string(regex[:state.opr_index]))
-    elif state.state == ParseState.BINARY:
-        return state.opr_type(
-                from_string(regex[:state.opr_index]),
-                from_string(regex[state.opr_index + len(state.opr_type.char):]))
-    else:
-        raise Exception('Unknown state: {}'.format(state.state))
+            if not stack:
+                raise RegexSyntaxError('Unbalanced ")" at {}'.format(i - 1))
+            node = frame.finish()
+            if frame.group is not None:
+                node = nodes.Group(node, frame.group)
+            frame = stack.pop()
+            frame.push_atom(node)
+        else:
+            frame.push_atom(nodes.Char(c))
+    if stack:
+        raise RegexSyntaxError('Unbalanced "(" at {}'.format(frame.index))
+    node = frame.finish()
+    if collector is not None:
+        collector.add_time('parse', time.time() - start_time)
+        collector.count('regex_length', len(regex))
+    return node
@@ -0,0 +1,177 @@
+"""
+The parse -> NFA -> DFA -> minimized DFA pipeline, with the result of every
+stage kept in a bounded LRU cache.
+"""
+import collections
+
+import fsa
+import parse
+import prefilter
+import simplify
+import utf8
+
+# Each stage is built from the result of the one before it
+STAGES = ('ast', 'nfa', 'dfa', 'mdfa', 'compiled')
+
+# The stages whose results have methods that change them, so that compile()
+# returns a copy of the cached result rather than the result itself
+COPIED_STAGES = ('nfa', 'dfa', 'mdfa')
+
+# Options accepted by compile() and their defaults:
+#   simplify      rewrite the tree with simplify.simplify after parsing
+#   construction  how the dfa stage is built: 'thompson' goes through the NFA
+#                 with fsa.nfa_to_dfa, 'glushkov' builds it straight from the
+#                 tree with fsa.regex_to_dfa
+#   captures      parse parentheses into capture groups, for tdfa; simplify
+#                 may reorder alternatives, which changes what they capture,
+#                 so the two cannot be combined
+#   utf8          match UTF-8 encoded bytes instead of characters: a str
+#                 pattern is decoded as UTF-8 and the tree rewritten with
+#                 utf8.to_bytes, so the DFA has at most 256 columns
+OPTIONS = {'simplify': False, 'construction': 'thompson', 'captures': False,
+           'utf8': False}
+
+CONSTRUCTIONS = ('thompson', 'glushkov')
+
+CacheInfo = collections.namedtuple(
+    'CacheInfo', ['hits', 'misses', 'evictions', 'size', 'maxsize'])
+
+
+class LRUCache(object):
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None, count=True):
+        """
+        Return the value of key, or default, counting a hit or a miss unless
+        count is false.
+        """
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            if count:
+                self.misses += 1
+            return default
+        self._data[key] = value
+        if count:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        self._evict()
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        self._evict()
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._data.clear()
+        self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.evictions,
+                         len(self._data), self.maxsize)
+
+
+_cache = LRUCache()
+
+
+def cache_info():
+    """
+    The hits and misses count the calls to compile(), whether or not the
+    stage asked for was cached, and not the stages built to get it.
+
+    :rtype: CacheInfo
+    """
+    return _cache.info()
+
+
+def clear_cache():
+    _cache.clear()
+
+
+def set_cache_size(maxsize):
+    _cache.resize(maxsize)
+
+
+def compile(pattern, stage='compiled', **options):
+    """
+    Return the result of the given pipeline stage for pattern:
+
+      ast       nodes.RegexNode from parse.from_string
+      nfa       finished fsa.NFA
+      dfa       fsa.DFA
+      mdfa      minimized fsa.DFA
+      compiled  fsa.CompiledDFA of the minimized DFA, with its prefilter
+
+    Results are cached by pattern, stage and options, and a missing stage is
+    built from the cached result of the stage before it. The tree and the
+    CompiledDFA are shared between callers and must not be modified; nothing
+    in this package changes either once built. The nfa, dfa and mdfa stages
+    are returned as copies of the cached automata (see NFA.copy and
+    DFA.copy), which the caller may change without affecting the cache.
+    """
+    if stage not in STAGES:
+        raise ValueError('Unknown stage: {}'.format(stage))
+    for name in options:
+        if name not in OPTIONS:
+            raise TypeError('Unknown option: {}'.format(name))
+    if options.get('construction', OPTIONS['construction']) not in CONSTRUCTIONS:
+        raise ValueError('Unknown construction: {}'.format(options['construction']))
+    if options.get('captures') and options.get('simplify'):
+        raise ValueError('simplify cannot be used with captures')
+    result = _cached(pattern, stage, options, count=True)
+    if stage in COPIED_STAGES:
+        return result.copy()
+    return result
+
+
+def _cached(pattern, stage, options, count=False):
+    key = (pattern, stage, tuple(sorted(options.iteritems())))
+    result = _cache.get(key, count=count)
+    if result is None:
+        result = _build(pattern, stage, options)
+        _cache.put(key, result)
+    return result
+
+
+def _build(pattern, stage, options):
+    if stage == 'ast':
+        is_utf8 = options.get('utf8', OPTIONS['utf8'])
+        if is_utf8 and isinstance(pattern, str):
+            pattern = pattern.decode('utf-8')
+        node = parse.from_string(pattern, options.get('captures', OPTIONS['captures']))
+        if options.get('simplify', OPTIONS['simplify']):
+            node = simplify.simplify(node)
+        if is_utf8:
+            node = utf8.to_bytes(node)
+        return node
+    if stage == 'dfa' and options.get('construction', OPTIONS['construction']) == 'glushkov':
+        return fsa.regex_to_dfa(_cached(pattern, 'ast', options))
+    previous = _cached(pattern, STAGES[STAGES.index(stage) - 1], options)
+    if stage == 'nfa':
+        nfa = fsa.regex_to_nfa(previous)
+        nfa.finish()
+        return nfa
+    elif stage == 'dfa':
+        return fsa.nfa_to_dfa(previous)
+    elif stage == 'mdfa':
+        return fsa.minimize_dfa(previous)
+    elif stage == 'compiled':
+        compiled = previous.compile()
+        compiled.prefilter = prefilter.from_node(_cached(pattern, 'ast', options))
+        return compiled
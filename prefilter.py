@@ -0,0 +1,201 @@
+"""
+Literal strings that every match of a regex must contain, used to skip the
+positions where search cannot find a match.
+"""
+import heapq
+
+import nodes
+
+# Literal sets growing past this size are given up
+MAX_LITERALS = 16
+# Larger character sets are not expanded into literals
+MAX_CHAR_SET = 8
+
+# The set of the empty string, which tells nothing about a match
+NO_LITERALS = frozenset([''])
+
+
+def _score(literals):
+    # Longer literals are rarer; fewer of them are cheaper to find
+    if not literals:
+        return 0, 0
+    return min(len(literal) for literal in literals), -len(literals)
+
+
+def _cross(literals1, literals2):
+    if len(literals1) * len(literals2) > MAX_LITERALS:
+        return None
+    return frozenset(a + b for a in literals1 for b in literals2)
+
+
+def _union(literals1, literals2):
+    literals = literals1 | literals2
+    return literals if len(literals) <= MAX_LITERALS else None
+
+
+class Literals(object):
+    """
+    What is known of the strings matched by a regex node. If `exact` is not
+    None it holds all of them. Otherwise every match starts with one of
+    `prefixes`, ends with one of `suffixes` and contains one of `factors`.
+    """
+    __slots__ = ('exact', 'prefixes', 'suffixes', 'factors')
+
+    def __init__(self, exact=None, prefixes=NO_LITERALS, suffixes=NO_LITERALS,
+                 factors=NO_LITERALS):
+        self.exact = exact
+        if exact is not None:
+            prefixes = suffixes = factors = exact
+        self.prefixes = prefixes
+        self.suffixes = suffixes
+        # Prefixes and suffixes are factors too
+        self.factors = max((factors, prefixes, suffixes), key=_score)
+
+    def __repr__(self):
+        return 'Literals({}, {}, {}, {})'.format(
+            self.exact, self.prefixes, self.suffixes, self.factors)
+
+
+def _node_literals(regex_node, args):
+    """
+    :type regex_node: nodes.RegexNode
+    :type args: list[Literals]
+    :rtype: Literals
+    """
+    if isinstance(regex_node, nodes.Char):
+        return Literals(frozenset([regex_node.token]))
+    elif isinstance(regex_node, nodes.CharSet):
+        if regex_node.negated or len(regex_node.chars) > MAX_CHAR_SET:
+            return Literals()
+        return Literals(frozenset(regex_node.chars))
+    elif isinstance(regex_node, nodes.Empty):
+        return Literals(NO_LITERALS)
+    elif isinstance(regex_node, nodes.Concat):
+        a, b = args
+        if a.exact is not None and b.exact is not None:
+            exact = _cross(a.exact, b.exact)
+            if exact is not None:
+                return Literals(exact)
+        prefixes = a.prefixes
+        if a.exact is not None:
+            prefixes = _cross(a.exact, b.prefixes) or a.prefixes
+        suffixes = b.suffixes
+        if b.exact is not None:
+            suffixes = _cross(a.suffixes, b.exact) or b.suffixes
+        factors = max((a.factors, b.factors,
+                       _cross(a.suffixes, b.prefixes) or NO_LITERALS), key=_score)
+        return Literals(None, prefixes, suffixes, factors)
+    elif isinstance(regex_node, nodes.Or):
+        a, b = args
+        if a.exact is not None and b.exact is not None:
+            exact = _union(a.exact, b.exact)
+            if exact is not None:
+                return Literals(exact)
+        return Literals(None, _union(a.prefixes, b.prefixes) or NO_LITERALS,
+                        _union(a.suffixes, b.suffixes) or NO_LITERALS,
+                        _union(a.factors, b.factors) or NO_LITERALS)
+    elif isinstance(regex_node, nodes.ZeroOrOne):
+        a, = args
+        if a.exact is not None:
+            return Literals(a.exact | NO_LITERALS)
+        return Literals()
+    elif isinstance(regex_node, nodes.ZeroOrMore):
+        return Literals()
+    elif isinstance(regex_node, nodes.OneOrMore):
+        a, = args
+        return Literals(None, a.prefixes, a.suffixes, a.factors)
+    elif isinstance(regex_node, nodes.Group):
+        return args[0]
+    elif isinstance(regex_node, nodes.Repeat):
+        a, = args
+        if regex_node.max == 0:
+            return Literals(NO_LITERALS)
+        elif regex_node.min == 0:
+            return Literals()
+        return Literals(None, a.prefixes, a.suffixes, a.factors)
+    raise TypeError('Unknown regex node: {}'.format(regex_node))
+
+
+def node_literals(regex_node):
+    """
+    :type regex_node: nodes.RegexNode
+    :rtype: Literals
+    """
+    # Post-order walk, as in fsa.regex_to_nfa
+    results = []
+    stack = [(regex_node, False)]
+    while stack:
+        node, children_done = stack.pop()
+        children = node.children()
+        if children and not children_done:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+        args = results[len(results) - len(children):]
+        del results[len(results) - len(children):]
+        results.append(_node_literals(node, args))
+    return results[0]
+
+
+class Prefilter(object):
+    """
+    Candidate start positions of the matches of a regex in a text.
+
+    If `prefixes` is set, every match starts with one of them, so only their
+    occurrences are candidates. If `factors` is set, every match contains one
+    of them, so no match starts after their last occurrence.
+    """
+    def __init__(self, prefixes=None, factors=None):
+        self.prefixes = sorted(prefixes) if prefixes else None
+        self.factors = sorted(factors) if factors else None
+
+    def candidates(self, text, pos=0):
+        """
+        Yield the candidate starts at or after pos in increasing order.
+        """
+        end = len(text)
+        if self.factors is not None:
+            end = max(text.rfind(factor, pos) for factor in self.factors)
+        if end < pos:
+            return
+        if self.prefixes is None:
+            for start in xrange(pos, end + 1):
+                yield start
+            return
+        # The next occurrence of each prefix, found with str.find
+        heap = []
+        for prefix in self.prefixes:
+            i = text.find(prefix, pos, end + len(prefix))
+            if i >= 0:
+                heap.append((i, prefix))
+        heapq.heapify(heap)
+        last = -1
+        while heap:
+            i, prefix = heap[0]
+            if i != last:
+                yield i
+                last = i
+            i = text.find(prefix, i + 1, end + len(prefix))
+            if i >= 0:
+                heapq.heapreplace(heap, (i, prefix))
+            else:
+                heapq.heappop(heap)
+
+    def __repr__(self):
+        return 'Prefilter({}, {})'.format(self.prefixes, self.factors)
+
+
+def from_node(regex_node):
+    """
+    Return a Prefilter for regex_node, or None if every match may be empty
+    or no literal is required.
+
+    :type regex_node: nodes.RegexNode
+    :rtype: Prefilter
+    """
+    literals = node_literals(regex_node)
+    prefixes = literals.prefixes if _score(literals.prefixes)[0] else None
+    factors = literals.factors if _score(literals.factors)[0] else None
+    if prefixes is None and factors is None:
+        return None
+    return Prefilter(prefixes, factors)
@@ -0,0 +1,59 @@
+"""
+Matching many patterns at once with a single DFA.
+"""
+import fsa
+import pipeline
+
+
+class RegexSet(object):
+    """
+    A set of patterns determinized together, so that one pass over the text
+    finds every pattern that matches. Pattern ids are the positions in
+    patterns, and a lower id has a higher priority.
+    """
+    def __init__(self, patterns):
+        """
+        :type patterns: Iterable[str]
+        """
+        self.patterns = list(patterns)
+        nfa = fsa.regex_set_to_nfa(
+            [pipeline.compile(pattern, 'ast') for pattern in self.patterns])
+        self.dfa = fsa.minimize_dfa(fsa.nfa_to_dfa(nfa))
+        self.compiled = self.dfa.compile()
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def matches(self, text):
+        """
+        Return the sorted ids of the patterns matching the whole text.
+
+        :rtype: tuple[int]
+        """
+        state = self.compiled.run(text)
+        return self.compiled.accepted_patterns(state) if state >= 0 else ()
+
+    def match(self, text, pos=0):
+        """
+        Return (pattern_id, end) for the longest match starting at pos, taking
+        the highest-priority pattern when several match it, or None.
+        """
+        result = self.compiled.match_state(text, pos)
+        if result is None:
+            return None
+        end, state = result
+        return self.compiled.accepted_patterns(state)[0], end
+
+    def tokenize(self, text, pos=0):
+        """
+        Split text from pos into maximal-munch matches and yield
+        (pattern_id, start, end) for each. Raises ValueError where no pattern
+        matches a non-empty prefix.
+        """
+        while pos < len(text):
+            result = self.match(text, pos)
+            if result is None or result[1] == pos:
+                raise ValueError('No pattern matches at {}'.format(pos))
+            pattern_id, end = result
+            yield pattern_id, pos, end
+            pos = end
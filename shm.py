@@ -0,0 +1,96 @@
+"""
+Compiled DFAs in named shared memory segments, for pools of worker
+processes.
+
+Python 2 has no multiprocessing.shared_memory, so a segment is a file in
+/dev/shm, the tmpfs that shm_open uses on Linux, holding the saved form of
+CompiledDFA.save. attach() maps it and matches against the table and bitmaps
+in place (see CompiledDFA.from_buffer): a worker holds no copy of the states,
+only the token map. Attaching is one mmap and a read of the header, tokens
+and accept sets, whatever the number of states. attach(name, verify=True)
+also reads the whole table once to check it, which bench.py shm times.
+
+    name = shm.export(compiled)
+    # in each worker
+    compiled = shm.attach(name)
+    # once the workers are done
+    shm.unlink(name)
+"""
+import binascii
+import contextlib
+import errno
+import os
+import tempfile
+
+import fsa
+
+# Where the segments live; a plain temporary directory where there is no
+# /dev/shm, in which case the pages are still shared through the page cache
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def _path(name):
+    if not name or '/' in name:
+        raise ValueError('Bad segment name: {!r}'.format(name))
+    return os.path.join(SHM_DIR, name)
+
+
+def export(dfa, name=None):
+    """
+    Copy dfa into a new segment and return its name, a random one by
+    default. The segment stays until unlink(name), even after this process
+    exits. Raises OSError if the name is taken.
+
+    :type dfa: fsa.DFA | fsa.CompiledDFA
+    :rtype: str
+    """
+    if isinstance(dfa, fsa.DFA):
+        dfa = dfa.compile()
+    if name is None:
+        name = 'regexdfa-{}-{}'.format(os.getpid(), binascii.hexlify(os.urandom(8)))
+    path = _path(name)
+    # Written under a temporary name, then linked to the final one, so that a
+    # segment is never seen half written and an existing one is not replaced
+    fd, temp_path = tempfile.mkstemp(dir=SHM_DIR, prefix='.' + name)
+    try:
+        os.close(fd)
+        dfa.save(temp_path)
+        os.link(temp_path, path)
+    finally:
+        os.unlink(temp_path)
+    return name
+
+
+def attach(name, verify=False):
+    """
+    Map the segment name. The returned DFA is only valid while the segment
+    is mapped, which lasts as long as the DFA, even after unlink(name).
+    With verify, the table is checked as in CompiledDFA.from_buffer.
+
+    :rtype: fsa.CompiledDFA
+    """
+    return fsa.CompiledDFA.load(_path(name), verify)
+
+
+def unlink(name):
+    """
+    Remove the segment name. Attached DFAs keep working; new attach() calls
+    fail.
+    """
+    os.unlink(_path(name))
+
+
+@contextlib.contextmanager
+def exported(dfa):
+    """
+    Export dfa for the duration of the block, yielding the segment name.
+    """
+    name = export(dfa)
+    try:
+        yield name
+    finally:
+        try:
+            unlink(name)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
@@ -0,0 +1,241 @@
+"""
+Rewriting a regex tree into a smaller equivalent one before it is turned
+into an NFA.
+
+Equal subtrees are hash-consed into one shared node, so that duplicates can
+be found by identity. Then:
+
+  - stacked unary operators collapse: a** and a++ to a* and a+, a?? to a?,
+    and any mix of two different ones to a*
+  - repeats that are a unary operator or no repeat at all become one:
+    a{0,} to a*, a{1,} to a+, a{0,1} to a?, a{1} to a and a{0} to nothing
+  - alternatives are flattened and duplicates dropped
+  - alternatives of single characters are merged into one CharSet
+  - an empty alternative turns the rest into an optional
+  - alternatives are factored by their common prefixes, then suffixes:
+    ab|ac to a(b|c) and ac|bc to (a|b)c
+"""
+import time
+
+import nodes
+import stats
+
+
+class Simplifier(object):
+    def __init__(self):
+        # The shared node of each key; see _key
+        self.table = {}
+
+    def _key(self, node):
+        # Children are already shared, so they are told apart by identity
+        if isinstance(node, nodes.Char):
+            return nodes.Char, node.token
+        elif isinstance(node, nodes.CharSet):
+            return nodes.CharSet, node.chars, node.negated
+        elif isinstance(node, nodes.Repeat):
+            return nodes.Repeat, id(node.arg), node.min, node.max
+        elif isinstance(node, nodes.Group):
+            return nodes.Group, id(node.arg), node.index
+        return (type(node),) + tuple(id(child) for child in node.children())
+
+    def cons(self, node):
+        """
+        Return the shared node equal to node, whose children are shared.
+        """
+        return self.table.setdefault(self._key(node), node)
+
+    def simplify(self, regex_node):
+        """
+        :type regex_node: nodes.RegexNode
+        :rtype: nodes.RegexNode
+        """
+        # Post-order walk, as in fsa.regex_to_nfa. A chain of Concats or Ors
+        # is taken as one node with all of its operands, so that it is
+        # rewritten once instead of once per level.
+        results = []
+        stack = [(regex_node, False)]
+        while stack:
+            node, children_done = stack.pop()
+            children = self._operands(node)
+            if children and not children_done:
+                stack.append((node, True))
+                stack.extend((child, False) for child in reversed(children))
+                continue
+            args = results[len(results) - len(children):]
+            del results[len(results) - len(children):]
+            results.append(self._rewrite(node, args))
+        return results[0]
+
+    @staticmethod
+    def _operands(node):
+        if not isinstance(node, (nodes.Concat, nodes.Or)):
+            return node.children()
+        type_ = type(node)
+        operands = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if type(node) is type_:
+                stack.append(node.arg2)
+                stack.append(node.arg1)
+            else:
+                operands.append(node)
+        return operands
+
+    def _rewrite(self, node, args):
+        if isinstance(node, nodes.UnaryRegexNode):
+            return self._unary(type(node), args[0])
+        elif isinstance(node, nodes.Concat):
+            return self._concat([item for arg in args for item in self._sequence(arg)])
+        elif isinstance(node, nodes.Or):
+            return self._or([self._sequence(arg) for arg in args])
+        elif isinstance(node, nodes.Repeat):
+            return self._repeat(args[0], node.min, node.max)
+        elif isinstance(node, nodes.Group):
+            return self.cons(nodes.Group(args[0], node.index))
+        return self.cons(node)
+
+    def _unary(self, type_, arg):
+        if isinstance(arg, nodes.Empty):
+            return arg
+        if isinstance(arg, nodes.UnaryRegexNode):
+            if type(arg) is type_:
+                return arg
+            return self.cons(nodes.ZeroOrMore(arg.arg))
+        return self.cons(type_(arg))
+
+    # The unary operator equal to each (min, max) of a repeat
+    REPEAT_UNARY = {(0, None): nodes.ZeroOrMore, (1, None): nodes.OneOrMore,
+                    (0, 1): nodes.ZeroOrOne}
+
+    def _repeat(self, arg, min, max):
+        if max == 0 or isinstance(arg, nodes.Empty):
+            return self.cons(nodes.Empty())
+        if min == max == 1:
+            return arg
+        if (min, max) in self.REPEAT_UNARY:
+            return self._unary(self.REPEAT_UNARY[min, max], arg)
+        return self.cons(nodes.Repeat(arg, min, max))
+
+    def _sequence(self, node):
+        # The items of a concatenation, with no Empty among them
+        items = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, nodes.Concat):
+                stack.append(node.arg2)
+                stack.append(node.arg1)
+            elif not isinstance(node, nodes.Empty):
+                items.append(node)
+        return items
+
+    def _concat(self, items):
+        if not items:
+            return self.cons(nodes.Empty())
+        node = items[0]
+        for item in items[1:]:
+            node = self.cons(nodes.Concat(node, item))
+        return node
+
+    def _or(self, sequences):
+        """
+        Return the node matching any of sequences, each a list of shared
+        nodes.
+        """
+        unique = []
+        seen = set()
+        has_empty = False
+        chars = []
+        for items in sequences:
+            key = tuple(map(id, items))
+            if key in seen:
+                continue
+            seen.add(key)
+            if not items:
+                has_empty = True
+            elif len(items) == 1 and self._is_single_char(items[0]):
+                if not chars:
+                    unique.append(chars)
+                chars.append(items[0])
+            else:
+                unique.append(items)
+        if chars:
+            chars[:] = [self._merge_chars(chars)]
+        sequences = self._factor(unique, 0)
+        sequences = self._factor(sequences, -1)
+        if not sequences:
+            return self.cons(nodes.Empty())
+        node = self._concat(sequences[0])
+        for items in sequences[1:]:
+            node = self.cons(nodes.Or(node, self._concat(items)))
+        if has_empty:
+            node = self._unary(nodes.ZeroOrOne, node)
+        return node
+
+    @staticmethod
+    def _is_single_char(node):
+        return (isinstance(node, nodes.Char) or
+                isinstance(node, nodes.CharSet) and not node.negated)
+
+    def _merge_chars(self, items):
+        if len(items) == 1:
+            return items[0]
+        chars = set()
+        for item in items:
+            chars.update(item.token if isinstance(item, nodes.Char) else item.chars)
+        return self.cons(nodes.CharSet(chars))
+
+    def _factor(self, sequences, end):
+        """
+        Merge the sequences sharing their first (end=0) or last (end=-1)
+        item, keeping the order of the first of each group.
+        """
+        groups = []
+        group_of = {}
+        for items in sequences:
+            if not items:
+                groups.append([items])
+                continue
+            key = id(items[end])
+            if key in group_of:
+                group_of[key].append(items)
+            else:
+                group_of[key] = [items]
+                groups.append(group_of[key])
+        factored = []
+        for group in groups:
+            if len(group) == 1:
+                factored.append(group[0])
+                continue
+            # The length of the longest common prefix or suffix of the group
+            n = 1
+            shortest = min(len(items) for items in group)
+            while n < shortest:
+                i = n if end == 0 else -n - 1
+                if any(items[i] is not group[0][i] for items in group):
+                    break
+                n += 1
+            if end == 0:
+                rest = self._or([items[n:] for items in group])
+                factored.append(group[0][:n] + self._sequence(rest))
+            else:
+                rest = self._or([items[:-n] for items in group])
+                factored.append(self._sequence(rest) + group[0][-n:])
+        return factored
+
+
+def simplify(regex_node):
+    """
+    :type regex_node: nodes.RegexNode
+    :rtype: nodes.RegexNode
+    """
+    collector = stats.current
+    if collector is None:
+        return Simplifier().simplify(regex_node)
+    start_time = time.time()
+    simplifier = Simplifier()
+    node = simplifier.simplify(regex_node)
+    collector.add_time('simplify', time.time() - start_time)
+    collector.count('shared_nodes', len(simplifier.table))
+    return node
@@ -0,0 +1,59 @@
+"""
+Optional statistics of the pipeline stages: the time spent in each stage and
+counters such as automaton sizes.
+
+Collection is off unless inside collect(). The stages read `current` once
+and only record anything if it is set, so they cost nothing otherwise:
+
+    with stats.collect() as collected:
+        pipeline.compile('a(b|c)*')
+    print collected.format()
+"""
+import collections
+import contextlib
+
+# The Stats being recorded into, or None
+current = None
+
+
+class Stats(object):
+    def __init__(self):
+        """
+        :type self.timings: dict[str, float]
+        :type self.counters: dict[str, int]
+        """
+        self.timings = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+
+    def add_time(self, stage, seconds):
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def maximum(self, name, value):
+        self.counters[name] = max(self.counters.get(name, value), value)
+
+    def as_dict(self):
+        return {'timings': dict(self.timings), 'counters': dict(self.counters)}
+
+    def format(self):
+        lines = ['{:<20} {:>12.6f}s'.format(stage, seconds)
+                 for stage, seconds in self.timings.iteritems()]
+        lines.extend('{:<20} {:>12}'.format(name, value)
+                     for name, value in self.counters.iteritems())
+        return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def collect(stats=None):
+    """
+    Record into stats, or a new Stats, within the block.
+    """
+    global current
+    previous = current
+    current = stats if stats is not None else Stats()
+    try:
+        yield current
+    finally:
+        current = previous
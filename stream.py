@@ -0,0 +1,186 @@
+"""
+Searching text that arrives in chunks, such as sockets or files too large
+to load, with a compiled DFA.
+"""
+import mmap
+
+import fsa
+
+
+class StreamMatcher(object):
+    """
+    Finds the non-overlapping leftmost-longest matches of a DFA in a stream.
+
+    Text is given with feed() and the end of the stream is marked with
+    finish(); both return the (start, end) spans, as offsets in the whole
+    stream, of the matches completed so far. An empty match at p is followed
+    by a search from p + 1.
+
+    Every position starts a run of the DFA, and runs reaching the same state
+    are merged into the one that started first, so at most one run per DFA
+    state is kept. Only the text after the end of a pending match is held,
+    since the search goes on from there once the match is known to be the
+    longest.
+
+    A pending match is kept, and the text after it held, until it is known
+    to be the longest: a.*b keeps its match at the last b pending for as
+    long as no newline comes. To bound the held text, max_pending gives up
+    on a pending match that could still be extended, and reports it as it
+    is, once more than max_pending characters follow its end. The matches
+    can then differ from those of the whole text.
+    """
+    def __init__(self, dfa, max_pending=None):
+        """
+        :type dfa: fsa.DFA | fsa.CompiledDFA
+        :type max_pending: int | None
+        """
+        if isinstance(dfa, fsa.DFA):
+            dfa = dfa.compile()
+        self.dfa = dfa
+        self.max_pending = max_pending
+        self.reset()
+
+    def reset(self):
+        # The text held from offset _tail_start
+        self._tail = ''
+        self._tail_start = 0
+        # The next position to scan
+        self._pos = 0
+        # [(start, state)] of the live runs, ordered by start
+        self._runs = []
+        # The longest match found so far for the leftmost start, as a pending
+        # (start, end)
+        self._best = None
+        self.offset = 0
+
+    def feed(self, chunk):
+        """
+        Scan chunk, which may be a str or a buffer, and return the spans of
+        the matches it completes.
+
+        :rtype: list[(int, int)]
+        """
+        segments = [(self._tail_start, self._tail), (self.offset, chunk)]
+        self.offset += len(chunk)
+        spans = self._scan(segments, final=False)
+        self._keep_tail(segments)
+        while (self.max_pending is not None and self._best is not None and
+               len(self._tail) > self.max_pending):
+            spans.extend(self._flush_pending())
+        return spans
+
+    def finish(self):
+        """
+        Mark the end of the stream and return the spans of the remaining
+        matches. The matcher can then be used for a new stream.
+
+        :rtype: list[(int, int)]
+        """
+        spans = self._scan([(self._tail_start, self._tail)], final=True)
+        self.reset()
+        return spans
+
+    def _flush_pending(self):
+        # Report the pending match without waiting for it to be extended, and
+        # search again from its end through the held text
+        start, end = self._best
+        spans = [self._best]
+        self._best = None
+        self._runs = []
+        self._pos = end if end > start else end + 1
+        segments = [(self._tail_start, self._tail)]
+        spans.extend(self._scan(segments, final=False))
+        self._keep_tail(segments)
+        return spans
+
+    def _keep_tail(self, segments):
+        keep = self._best[1] if self._best is not None else self._pos
+        self._tail = ''.join(text[max(keep - start, 0):] for start, text in segments
+                             if start + len(text) > keep)
+        self._tail_start = keep
+
+    def _scan(self, segments, final):
+        dfa = self.dfa
+        table, columns, other_column = dfa.table, dfa.columns, dfa.other_column
+        accepts, deads = dfa.accepts, dfa.deads
+        width = len(dfa.tokens)
+        start_state = dfa.start
+        runs, best, i = self._runs, self._best, self._pos
+        states = set(state for _, state in runs)
+        end = self.offset
+        segment = -1
+        segment_start = segment_end = i
+        text = ''
+        spans = []
+        while True:
+            if best is None and start_state not in states:
+                runs.append((i, start_state))
+                states.add(start_state)
+            for start, state in runs:
+                if accepts[state >> 3] & (1 << (state & 7)):
+                    if best is None or start < best[0]:
+                        # Later runs can no longer give the leftmost match
+                        runs = [run for run in runs if run[0] <= start]
+                        states = set(state for _, state in runs)
+                    best = (start, i)
+                    break
+            if i == end:
+                if not final or best is None:
+                    break
+                runs = []
+                states = set()
+            if not runs and best is not None:
+                spans.append(best)
+                i = best[1] if best[1] > best[0] else best[1] + 1
+                best = None
+                if i > end:
+                    break
+                segment = -1
+                segment_start = segment_end = i
+                continue
+            if i == end:
+                break
+            while not segment_start <= i < segment_end:
+                segment += 1
+                segment_start, text = segments[segment]
+                segment_end = segment_start + len(text)
+            column = columns.get(text[i - segment_start], other_column)
+            if column < 0:
+                runs = []
+                states = set()
+            else:
+                new_runs = []
+                states = set()
+                for start, state in runs:
+                    state = table[state * width + column]
+                    if not deads[state >> 3] & (1 << (state & 7)) and state not in states:
+                        states.add(state)
+                        new_runs.append((start, state))
+                runs = new_runs
+            i += 1
+        self._runs, self._best, self._pos = runs, best, i
+        return spans
+
+
+def scan_file(dfa, path, window_size=1 << 24, max_pending=None):
+    """
+    Yield the spans of the matches of dfa in the file at path. The file is
+    memory-mapped and fed to a StreamMatcher in windows of window_size bytes,
+    without copying them; see StreamMatcher for max_pending.
+    """
+    matcher = StreamMatcher(dfa, max_pending)
+    with open(path, 'rb') as f:
+        try:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped
+            mapping = ''
+    try:
+        for offset in xrange(0, len(mapping), window_size):
+            for span in matcher.feed(buffer(mapping, offset, window_size)):
+                yield span
+        for span in matcher.finish():
+            yield span
+    finally:
+        if mapping:
+            mapping.close()
@@ -0,0 +1,214 @@
+"""
+Capture groups in one pass over the text, with a tagged DFA (TDFA).
+
+In an NFA parsed with captures (see parse.from_string), the empty edges into
+and out of group i set the tags 2(i - 1) and 2(i - 1) + 1 to the current
+position. A TDFA state is the ordered list of the NFA states a backtracking
+matcher could be in, highest priority first, each with the register holding
+the value of each of its tags. Along a transition every register of the
+target state is either copied from a register of the source state or set to
+the current position, so the group spans are known at the end of a single
+pass with no backtracking.
+
+The registers of a state are renumbered in the order they are first used, so
+that states differing only in the names of their registers are one state.
+"""
+import time
+
+import pipeline
+import stats
+
+# The source of a register that is set to the current position
+POSITION = -1
+
+
+class TaggedDFA(object):
+    """
+    A TDFA giving the spans of re.match: the highest-priority match starting
+    at pos, as a backtracking matcher would find it. With fullmatch, only
+    matches that end at the end of the text are taken.
+
+    A loop never goes round again without reading a character, and a
+    repeat never uses a copy that matches nothing (see
+    fsa.normalize_repeats). So where the body of a star or a repeat can
+    match the empty string, re may report one more, empty, iteration in the
+    groups inside it: re.match('(a*)*', 'a') gives group 1 at (1, 1) and
+    this gives (0, 1).
+    """
+    def __init__(self, nfa, fullmatch=False):
+        """
+        :type nfa: fsa.NFA
+        :type self.transitions: list[list[(int, tuple[int]) | None]]
+        :type self.finals: list[tuple[int | None] | None]
+        """
+        collector = stats.current
+        if collector is not None:
+            start_time = time.time()
+        nfa.finish()
+        self.nfa = nfa.frozen
+        self.fullmatch = fullmatch
+        self.num_tags = max([tag + 1 for tags in self.nfa.edge_tags.itervalues()
+                             for tag in tags] or [0])
+        self.groups = self.num_tags // 2
+        frozen = self.nfa
+        # The NFA states kept in TDFA states: those with a character edge and
+        # the end state
+        self._kernel = [any(not frozen.epsilons[k]
+                            for k in xrange(frozen.offsets[i], frozen.offsets[i + 1]))
+                        for i in xrange(len(frozen.states))]
+        self._kernel[frozen.end] = True
+        # For each state, the target state id and the register sources for
+        # each character class, then an extra None for characters in none
+        self.transitions = []
+        # For each state, the registers of the tags of its highest-priority
+        # end item, if it has one
+        self.finals = []
+        self._state_ids = {}
+        self._pending = []
+        unset = (None,) * self.num_tags
+        items, sources = self._canonical(self._closure([(frozen.start, unset)]))
+        self.start = self._get_state(items)
+        self.start_registers = len(sources)
+        while self._pending:
+            state_id, items = self._pending.pop()
+            self.transitions[state_id] = [self._step(items, class_id)
+                                          for class_id in xrange(len(frozen.classes))]
+            self.transitions[state_id].append(None)
+        del self._pending
+        if collector is not None:
+            collector.add_time('tdfa', time.time() - start_time)
+            collector.count('tdfa_states', len(self.transitions))
+            collector.maximum('tdfa_registers', max(
+                [len(move[1]) for row in self.transitions for move in row if move] or [0]))
+
+    def _closure(self, seeds):
+        """
+        Follow the empty edges from seeds, a list of (NFA state, tag values)
+        in priority order, depth first and the first edge of a state first.
+        A state reached again is dropped, since a higher-priority path has
+        already reached it. Without fullmatch nothing after the end state is
+        kept either, since its match would win over theirs.
+        """
+        frozen = self.nfa
+        offsets, targets, epsilons, edge_tags = (
+            frozen.offsets, frozen.targets, frozen.epsilons, frozen.edge_tags)
+        items = []
+        seen = set()
+        for seed in seeds:
+            stack = [seed]
+            while stack:
+                i, values = stack.pop()
+                if i in seen:
+                    continue
+                seen.add(i)
+                if self._kernel[i]:
+                    items.append((i, values))
+                    if i == frozen.end and not self.fullmatch:
+                        return items
+                for k in xrange(offsets[i + 1] - 1, offsets[i] - 1, -1):
+                    if not epsilons[k]:
+                        continue
+                    values1 = values
+                    if k in edge_tags:
+                        values1 = list(values)
+                        for tag in edge_tags[k]:
+                            values1[tag] = POSITION
+                        values1 = tuple(values1)
+                    stack.append((targets[k], values1))
+        return items
+
+    @staticmethod
+    def _canonical(items):
+        """
+        Renumber the registers of items in order of first use. Return the new
+        items and, for each new register, the register it is copied from or
+        POSITION.
+        """
+        registers = {}
+        sources = []
+        canonical = []
+        for i, values in items:
+            values1 = []
+            for value in values:
+                if value is not None:
+                    if value not in registers:
+                        registers[value] = len(sources)
+                        sources.append(value)
+                    value = registers[value]
+                values1.append(value)
+            canonical.append((i, tuple(values1)))
+        return tuple(canonical), tuple(sources)
+
+    def _get_state(self, items):
+        state_id = self._state_ids.get(items)
+        if state_id is None:
+            state_id = self._state_ids[items] = len(self.transitions)
+            self.transitions.append(None)
+            self.finals.append(next(
+                (values for i, values in items if i == self.nfa.end), None))
+            self._pending.append((state_id, items))
+        return state_id
+
+    def _step(self, items, class_id):
+        frozen = self.nfa
+        offsets, targets, labels, epsilons = (
+            frozen.offsets, frozen.targets, frozen.labels, frozen.epsilons)
+        mask = frozen.class_labels[class_id]
+        seeds = []
+        for i, values in items:
+            for k in xrange(offsets[i], offsets[i + 1]):
+                if not epsilons[k] and mask[labels[k]]:
+                    seeds.append((targets[k], values))
+        if not seeds:
+            return None
+        items1, sources = self._canonical(self._closure(seeds))
+        if not items1:
+            return None
+        return self._get_state(items1), sources
+
+    def _spans(self, pos, end, registers, final):
+        spans = [(pos, end)]
+        for tag in xrange(0, self.num_tags, 2):
+            start, stop = final[tag], final[tag + 1]
+            if start is None or stop is None:
+                spans.append(None)
+            else:
+                spans.append((registers[start], registers[stop]))
+        return tuple(spans)
+
+    def match(self, text, pos=0):
+        """
+        Return the spans of the match starting at pos: the (start, end) of
+        the whole match, then of each group, None for a group that took no
+        part in it. Return None if there is no match.
+
+        :rtype: tuple[(int, int) | None] | None
+        """
+        transitions, finals = self.transitions, self.finals
+        class_of = self.nfa.class_of
+        state = self.start
+        registers = [pos] * self.start_registers
+        result = None
+        if finals[state] is not None and not self.fullmatch:
+            result = self._spans(pos, pos, registers, finals[state])
+        for i in xrange(pos, len(text)):
+            move = transitions[state][class_of(text[i])]
+            if move is None:
+                break
+            state, sources = move
+            end = i + 1
+            registers = [end if source < 0 else registers[source] for source in sources]
+            if finals[state] is not None and not self.fullmatch:
+                result = self._spans(pos, end, registers, finals[state])
+        else:
+            if finals[state] is not None and self.fullmatch:
+                result = self._spans(pos, len(text), registers, finals[state])
+        return result
+
+
+def compile(pattern, fullmatch=False):
+    """
+    :type pattern: str
+    :rtype: TaggedDFA
+    """
+    return TaggedDFA(pipeline.compile(pattern, 'nfa', captures=True), fullmatch)
@@ -0,0 +1,37 @@
+import random
+import unittest
+
+import pipeline
+
+try:
+    import batch
+except ImportError:
+    batch = None
+
+
+@unittest.skipIf(batch is None, 'NumPy is not installed')
+class TestBatch(unittest.TestCase):
+    regexs = ["[A-Z][A-Z][0-9]+", "ab*|c", "(a|b)*abb", "[^a]*", ""]
+
+    def test_fullmatch(self):
+        rand = random.Random(4)
+        strings = [''.join(rand.choice('abAB01c') for _ in xrange(rand.randint(0, 30)))
+                   for _ in xrange(500)]
+        strings += ['', 'a', 'abb', 'AB0123456789', 'AB']
+        for regex in self.regexs:
+            compiled = pipeline.compile(regex)
+            matcher = batch.BatchMatcher(compiled)
+            expected = [compiled.fullmatch(s) for s in strings]
+            self.assertEqual(list(matcher.fullmatch(strings)), expected)
+            self.assertEqual(list(matcher.fullmatch([])), [])
+
+    def test_unicode(self):
+        compiled = pipeline.compile(u"[\u00e0-\u00ff]+x")
+        matcher = batch.BatchMatcher(compiled)
+        strings = [u"\u00e0x", u"\u00e0\u00e1x", u"x", u"\u4e2dx", u"ax", u""]
+        self.assertEqual(list(matcher.fullmatch(strings)),
+                         [compiled.fullmatch(s) for s in strings])
+
+
+if __name__ == '__main__':
+    unittest.main()
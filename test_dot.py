@@ -0,0 +1,84 @@
+import StringIO
+import re
+import sys
+import unittest
+
+import dot
+import fsa
+import pipeline
+import stats
+
+
+class TestDot(unittest.TestCase):
+    def _lines(self, graph, edges):
+        return [line for line in list(graph.iter_lines())[2:-1] if ('->' in line) == edges]
+
+    def test_merged_edges(self):
+        graph = dot.dfa_to_dot(pipeline.compile('[a-z0-9]+x|y', 'mdfa'))
+        labels = sorted(re.search(r'label="(.*)"', line).group(1) if 'label' in line else ''
+                        for line in self._lines(graph, edges=True))
+        self.assertEqual(labels, ['', '[0-9a-wyz]', '[0-9a-wyz]', '[0-9a-xz]',
+                                  'x', 'x', 'y'])
+        self.assertEqual(str(dot.merge_tokens([fsa.CharClass('ab', negated=True),
+                                               fsa.CharClass('a')])), '[^b]')
+
+    def test_write(self):
+        graph = dot.nfa_to_dot(pipeline.compile('a"b', 'nfa'))
+        f = StringIO.StringIO()
+        graph.write(f)
+        self.assertEqual(f.getvalue(), graph.format() + '\n')
+        self.assertIn('label="\\""', f.getvalue())
+
+    def test_non_ascii(self):
+        # Bytes over 0x7F, from a str pattern or from the UTF-8 rewriting, are
+        # escaped like unicode characters
+        self.assertEqual(repr(fsa.CharClass('\xc3')), 'CharClass(\\xc3)')
+        self.assertEqual(str(fsa.CharClass(u'\xe9')), '\\xe9')
+        for dfa in (pipeline.compile('caf\xc3\xa9', 'mdfa'),
+                    pipeline.compile(u'caf\xe9', 'mdfa', utf8=True)):
+            labels = [re.search(r'label="(.*)"', line).group(1)
+                      for line in self._lines(dot.dfa_to_dot(dfa), edges=True) if 'label' in line]
+            self.assertIn('\\xc3', labels)
+            self.assertIn('\\xa9', labels)
+
+    def test_max_states(self):
+        dfa = pipeline.compile('(a|b)*a(a|b)(a|b)(a|b)', 'mdfa')
+        graph = dot.dfa_to_dot(dfa, max_states=5)
+        # The start arrow node, 5 states and one for the rest
+        self.assertEqual(len(self._lines(graph, edges=False)), 7)
+        self.assertIn('label="11 more states"', graph.format())
+        graph = dot.nfa_to_dot(pipeline.compile('(a|b)*abb', 'nfa'), max_states=3)
+        self.assertEqual(len(self._lines(graph, edges=False)), 5)
+
+    def test_streamed(self):
+        # The lines come one state at a time, before the rest are walked
+        dfa = pipeline.compile('[ab]{0,3000}', 'mdfa')
+        lines = dot.dfa_to_dot(dfa).iter_lines()
+        self.assertEqual([next(lines)[:5] for _ in xrange(6)][4:], ['  S0[', '  S0-'])
+
+    def test_main_stats(self):
+        # Statistics are only collected with --stats
+        collecting = []
+        compile_ = pipeline.compile
+
+        def compile(*args, **kwargs):
+            collecting.append(stats.current is not None)
+            return compile_(*args, **kwargs)
+
+        saved = sys.argv, sys.stdout, sys.stderr, pipeline.compile
+        pipeline.compile = compile
+        try:
+            for args in (['mdfa', 'ab*'], ['--stats', 'mdfa', 'ab*']):
+                pipeline.clear_cache()
+                sys.argv = ['dot.py'] + args
+                sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+                dot.main()
+                self.assertIn('digraph', sys.stdout.getvalue())
+                self.assertEqual('minimize_dfa' in sys.stderr.getvalue(), '--stats' in args)
+        finally:
+            sys.argv, sys.stdout, sys.stderr, pipeline.compile = saved
+        self.assertEqual(collecting, [False, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
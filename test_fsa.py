@@ -1,5 +1,14 @@
 import fsa
+import itertools
 import parse
+import os
+import random
+import re
+import shutil
+import stats
+import struct
+import sys
+import tempfile
 import unittest
 
 class TestFSA(unittest.TestCase):
@@ -24,9 +33,146 @@ class TestFSA(unittest.TestCase):
             nfa = fsa.regex_to_nfa(parse.from_string(regex))
             dfa = fsa.nfa_to_dfa(nfa)
 
+    def test_frozen_nfa(self):
+        nfa = fsa.regex_to_nfa(parse.from_string("ab|a*"))
+        nfa.finish()
+        frozen = nfa.frozen
+        self.assertEqual([s.id for s in frozen.states], range(len(nfa.states)))
+        self.assertEqual(sorted(str(token) for token in frozen.tokens), ['a', 'b'])
+        self.assertEqual(len(frozen.offsets), len(nfa.states) + 1)
+        for state in nfa.states:
+            closure = fsa.find_nfa_closure([state])
+            self.assertEqual(frozen.closure([state.id]), set(s.id for s in closure))
+        self.assertIn(frozen.end, frozen.closure([frozen.start]))
+
+    def test_deep_regex_to_nfa(self):
+        nfa = fsa.regex_to_nfa(parse.from_string("ab" * sys.getrecursionlimit()))
+        nfa.finish()
+        self.assertEqual(len(nfa.states), 2 * sys.getrecursionlimit() + 1)
+
+    def test_partition_alphabet(self):
+        labels = [fsa.CharClass('abc'), fsa.CharClass('bcd'), fsa.CharClass('a', negated=True)]
+        classes, label_classes = fsa.partition_alphabet(labels)
+        self.assertEqual([str(c) for c in classes], ['a', '[bc]', 'd', '[^a-d]'])
+        self.assertEqual(label_classes, [[0, 1], [1, 2], [1, 2, 3]])
+
+    def test_char_classes(self):
+        texts = ["", "a", "z", "az", "a1", "0", "-", "a-", "abc9", "A", "\n", "a.b", "]"]
+        for regex, python_regex in [("[a-z0-9]+", None),
+                                    ("[^a-c]*", None),
+                                    ("a.b|.", "a.b|."),
+                                    ("[]a-]", "[]a-]"),
+                                    ("[a-z]*[^a-z]|[0-9]", None)]:
+            expected = re.compile('(?:{})$'.format(python_regex or regex))
+            dfa = self._get_dfa(regex)
+            lazy = fsa.LazyDFA(fsa.regex_to_nfa(parse.from_string(regex)))
+            matcher = fsa.NFAMatcher(fsa.regex_to_nfa(parse.from_string(regex)))
+            for compiled in (dfa.compile(), fsa.minimize_dfa(dfa).compile(), lazy, matcher):
+                for text in texts:
+                    self.assertEqual(compiled.fullmatch(text), bool(expected.match(text)),
+                                     (regex, text, compiled))
+
+    def test_char_class_columns(self):
+        dfa = self._get_dfa("[a-z0-9]+")
+        self.assertEqual(len(dfa.tokens), 1)
+        self.assertEqual(len(fsa.minimize_dfa(dfa).states), 2)
+        self.assertIs(dfa.token_for('q'), dfa.tokens[0])
+        self.assertIs(dfa.token_for('Q'), None)
+        dfa = self._get_dfa("a|.")
+        self.assertEqual(len(dfa.tokens), 3)
+        self.assertIs(dfa.token_for('Q'), dfa.other)
+
     def _get_dfa(self, regex):
         return fsa.nfa_to_dfa(fsa.regex_to_nfa(parse.from_string(regex)))
 
+    def test_regex_to_dfa(self):
+        rng = random.Random(0)
+
+        def generate(depth):
+            if depth == 0 or rng.random() < 0.3:
+                return rng.choice(['a', 'b', '[ab]', '[^a]', '.', '()'])
+            k = rng.random()
+            if k < 0.3:
+                return generate(depth - 1) + generate(depth - 1)
+            elif k < 0.6:
+                return '(' + generate(depth - 1) + '|' + generate(depth - 1) + ')'
+            return '(' + generate(depth - 1) + ')' + rng.choice('*+?')
+
+        texts = [''.join(t) for n in xrange(5) for t in itertools.product('abc', repeat=n)]
+        regexs = self.regexs + ["(a|b)*aaa(a|b)*", "[a-z]*[^a-z]|[0-9]"]
+        for regex in regexs + [generate(4) for _ in xrange(100)]:
+            dfa = fsa.regex_to_dfa(parse.from_string(regex))
+            expected = self._get_dfa(regex)
+            self.assertFalse(any(list(position.traverse()) for state in dfa.states
+                                 for position in state.nfa_states))
+            compiled = dfa.compile()
+            for text in texts:
+                self.assertEqual(compiled.fullmatch(text), expected.compile().fullmatch(text),
+                                 (regex, text))
+            self.assertEqual(len(fsa.minimize_dfa(dfa).states),
+                             len(fsa.minimize_dfa(expected).states), regex)
+
+    def test_repeat(self):
+        texts = [''.join(t) for n in xrange(8) for t in itertools.product('abc', repeat=n)]
+        for regex in ['a{3}', 'a{2,4}', '(ab){0,}', '(a|b){2,}', '(a?){2,3}',
+                      '(a*b){1,2}c{0}', '(a{0,2}b){2}', '(){0,3}', '(a|bc){0,3}',
+                      '(a?b?){1,3}', '(a*){2,3}b', '((a|)c?|b+){2,}', 'a{1,2}a{0,2}b',
+                      'ca{2,}a{1}', '(a?(b|c*)){0,2}a']:
+            expected = re.compile('(?:{})$'.format(regex))
+            node = parse.from_string(regex)
+            for compiled in (self._get_dfa(regex).compile(),
+                             fsa.regex_to_dfa(node).compile(),
+                             fsa.NFAMatcher(fsa.regex_to_nfa(node))):
+                for text in texts:
+                    self.assertEqual(compiled.fullmatch(text), bool(expected.match(text)),
+                                     (regex, text))
+
+    def test_large_repeat(self):
+        with stats.collect() as collected:
+            dfa = fsa.minimize_dfa(self._get_dfa('[ab]{0,2000}'))
+        self.assertEqual(len(dfa.states), 2002)
+        # Leaving the repeat early does not go through the remaining copies
+        self.assertLessEqual(collected.counters['max_closure'], 3)
+        self.assertLessEqual(collected.counters['nfa_states'], 2 * 2000 + 1)
+        # Nor through the empty paths of a nullable operand
+        for regex, num_states in [('(a?){0,2000}', 2002), ('(a*){0,2000}', 1),
+                                  ('a{0,2000}a{0,2000}', 4002)]:
+            with stats.collect() as collected:
+                dfa = fsa.minimize_dfa(self._get_dfa(regex))
+            self.assertEqual(len(dfa.states), num_states)
+            self.assertLessEqual(collected.counters['max_closure'], 3)
+
+    def test_counters(self):
+        texts = [''.join(t) for n in xrange(6) for t in itertools.product('abcdf', repeat=n)][::11]
+        texts += ['abcdef', 'defabcabc', 'aabaabc', 'abcbcbcc', 'xaaab']
+        for regex in ['[ab]{0,3}c', '(abc|def){0,2}', 'a{2,}b', '(a{2}b){2}', '(a|bc){1,3}c?',
+                      '(a?b?){2,3}', '((a|b){1,2}c){0,2}', 'a{0}b{1,1}']:
+            expected = re.compile('(?:{})'.format(regex))
+            node = parse.from_string(regex)
+            compiled = fsa.regex_to_dfa(node).compile()
+            for matcher in (fsa.NFAMatcher(fsa.regex_to_nfa(node, counters=True)),
+                            fsa.LazyDFA(fsa.regex_to_nfa(node, counters=True), max_states=4)):
+                for text in texts:
+                    self.assertEqual(matcher.fullmatch(text),
+                                     bool(re.match('(?:{})\\Z'.format(regex), text)), (regex, text))
+                    self.assertEqual(matcher.match(text), compiled.match(text), (regex, text))
+                    self.assertEqual(matcher.search(text), compiled.search(text), (regex, text))
+                    self.assertEqual(matcher.search(text) is not None,
+                                     expected.search(text) is not None, (regex, text))
+        # The counted automaton keeps one copy of the operand
+        nfa = fsa.regex_to_nfa(parse.from_string('[ab]{0,2000}c'), counters=True)
+        nfa.finish()
+        self.assertLess(len(nfa.states), 10)
+        self.assertEqual(fsa.NFAMatcher(nfa).search('x' + 'ab' * 100 + 'c'), (1, 202))
+        self.assertRaises(ValueError, fsa.nfa_to_dfa, nfa)
+        # Only the expanding constructions are limited
+        node = parse.from_string('(a{1000}b){0,1000}')
+        self.assertRaises(fsa.ExpansionError, fsa.regex_to_nfa, node)
+        self.assertRaises(fsa.ExpansionError, fsa.regex_to_dfa, node)
+        matcher = fsa.NFAMatcher(fsa.regex_to_nfa(node, counters=True))
+        self.assertTrue(matcher.fullmatch(('a' * 1000 + 'b') * 3))
+        self.assertFalse(matcher.fullmatch('a' * 999 + 'b'))
+
     def test_dfa(self):
         self.assertGreaterEqual(len(self._get_dfa("abcde").states), 6)
         self.assertGreaterEqual(len(self._get_dfa("ab|de").states), 5)
@@ -34,6 +180,139 @@ class TestFSA(unittest.TestCase):
     def test_minimize_dfa(self):
         dfa = self._get_dfa("(a|b)*aaa(a|b)*")
         mdfa = fsa.minimize_dfa(dfa)
+        self.assertEqual(len(mdfa.states), 4)
+        self.assertEqual(len(fsa.minimize_dfa(self._get_dfa("abcd")).states), 6)
+        self.assertEqual(len(fsa.minimize_dfa(self._get_dfa("a*|b*|ab")).states), 6)
+        for regex in self.regexs:
+            mdfa = fsa.minimize_dfa(self._get_dfa(regex))
+            self.assertEqual(sorted(s.id for s in mdfa.states), range(len(mdfa.states)))
+            self.assertIn(mdfa.start, mdfa.states)
+
+    def test_compiled_dfa(self):
+        texts = ["", "a", "ab", "abc", "abcd", "abce", "aefgjk", "aefjkjkbcdd",
+                 "xxabcdyy", "cdab", "efghjkabc"]
+        for regex in self.regexs:
+            expected = re.compile('(?:{})$'.format(regex))
+            for dfa in (self._get_dfa(regex),
+                        fsa.minimize_dfa(self._get_dfa(regex))):
+                compiled = dfa.compile()
+                for text in texts:
+                    self.assertEqual(compiled.fullmatch(text),
+                                     bool(expected.match(text)), (regex, text))
+
+    def test_compiled_dfa_match_and_search(self):
+        compiled = self._get_dfa("ab*|c").compile()
+        self.assertEqual(compiled.match("abbbx"), 4)
+        self.assertEqual(compiled.match("xab"), None)
+        self.assertEqual(compiled.match("xab", 1), 3)
+        self.assertEqual(compiled.search("xxcab"), (2, 3))
+        self.assertEqual(compiled.search("xxabbc"), (2, 5))
+        self.assertEqual(compiled.search("xxx"), None)
+        self.assertEqual(self._get_dfa("a*").compile().search("bbb"), (0, 0))
+
+    def test_linear_search(self):
+        # A pattern with no literal for a prefilter, whose runs all fail at the
+        # end of the text: search() still reads each character once
+        class CountingText(str):
+            def __getitem__(self, i):
+                self.reads += 1
+                return str.__getitem__(self, i)
+
+        regex = '[ab]*[^ab]'
+        nfa = fsa.regex_to_nfa(parse.from_string(regex))
+        for matcher in (self._get_dfa(regex).compile(), fsa.LazyDFA(nfa), fsa.NFAMatcher(nfa)):
+            for n in (100, 1000):
+                text = CountingText('a' * n)
+                text.reads = 0
+                self.assertIsNone(matcher.search(text))
+                self.assertEqual(text.reads, n)
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'dfa.bin')
+            texts = ["", "ab", "abbb", "x", "a.", u"\u00e9\u00e9", u"a\u4e2d"]
+            for regex in ["ab*|c", "a(bcd*|efgh?(jk)+)*", "[^a]*", "", u"a?[\u00e0-\u00ff\u4e2d]*"]:
+                dfa = fsa.minimize_dfa(self._get_dfa(regex))
+                dfa.save(path)
+                loaded = fsa.DFA.load(path)
+                self.assertIsInstance(loaded, fsa.CompiledDFA)
+                for text in texts:
+                    self.assertEqual(loaded.fullmatch(text), dfa.compile().fullmatch(text))
+                    self.assertEqual(loaded.search(text), dfa.compile().search(text))
+                # A loaded DFA can be saved again
+                loaded.save(path + '2')
+                self.assertEqual(open(path, 'rb').read(), open(path + '2', 'rb').read())
+            with open(path, 'wb') as f:
+                f.write('not a dfa' * 10)
+            self.assertRaises(fsa.DFAFormatError, fsa.DFA.load, path)
+            self._get_dfa("ab*|c[de]").compile().save(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+            header = fsa.CompiledDFA.HEADER
+            fields = list(header.unpack_from(data))
+            table_start = header.size + fields[6] + -(header.size + fields[6]) % 8
+            bad_start = header.pack(*(fields[:5] + [fields[3]] + fields[6:]))
+            bad_table = struct.pack('<i', fields[3])
+            for corrupt in ['', data[:40], data[:-1], bad_start + data[header.size:]]:
+                with open(path, 'wb') as f:
+                    f.write(corrupt)
+                self.assertRaises(fsa.DFAFormatError, fsa.DFA.load, path)
+            # The table itself is only read to check it when asked for
+            with open(path, 'wb') as f:
+                f.write(data[:table_start] + bad_table + data[table_start + 4:])
+            self.assertIsInstance(fsa.DFA.load(path), fsa.CompiledDFA)
+            self.assertRaises(fsa.DFAFormatError, fsa.DFA.load, path, verify=True)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_lazy_dfa(self):
+        texts = ["", "a", "abc", "abcd", "aefgjk", "aefjkjkbcdd", "abcdbcx"]
+        for regex in self.regexs:
+            compiled = self._get_dfa(regex).compile()
+            lazy = fsa.LazyDFA(fsa.regex_to_nfa(parse.from_string(regex)))
+            for text in texts:
+                self.assertEqual(lazy.fullmatch(text), compiled.fullmatch(text))
+                self.assertEqual(lazy.search(text), compiled.search(text))
+
+    def test_lazy_dfa_budget(self):
+        regex = "(a|b)*a(a|b)(a|b)(a|b)(a|b)(a|b)"
+        expected = re.compile('(?:{})$'.format(regex))
+        lazy = fsa.LazyDFA(fsa.regex_to_nfa(parse.from_string(regex)),
+                           max_states=8, max_flushes=2)
+        text = "abbabaababbbabaabbaabab" * 3
+        for i in xrange(len(text)):
+            self.assertEqual(lazy.fullmatch(text[i:]), bool(expected.match(text[i:])))
+            self.assertLessEqual(len(lazy.cache), 8)
+        self.assertGreater(lazy.flushes, 0)
+
+    def test_nfa_matcher(self):
+        texts = ["", "a", "abc", "abcd", "aefgjk", "aefjkjkbcdd", "xabcdbcx",
+                 "efghjkabc", "cdab", "jkjk"]
+        for regex in self.regexs + ["a*", "(a|b)*a(a|b)", "b+|ab"]:
+            compiled = self._get_dfa(regex).compile()
+            matcher = fsa.NFAMatcher(fsa.regex_to_nfa(parse.from_string(regex)))
+            for text in texts + ["abab", "bbbab", "aab"]:
+                self.assertEqual(matcher.fullmatch(text), compiled.fullmatch(text))
+                for pos in xrange(len(text) + 1):
+                    self.assertEqual(matcher.match(text, pos), compiled.match(text, pos))
+                    self.assertEqual(matcher.search(text, pos), compiled.search(text, pos),
+                                     (regex, text, pos))
+
+    def test_overlapping_classes(self):
+        # nfa_to_dfa splits the overlapping classes into disjoint columns, while
+        # NFAMatcher tests each label against the character
+        texts = [''.join(t) for n in xrange(4) for t in itertools.product('abdexz\n', repeat=n)]
+        for regex in ['[a-c]x|[b-d]z|[^a]z|.x', '([a-c]|[^b])*[b-e]', '[^ab]*a|[^bc]+b?']:
+            expected = re.compile('(?:{})\\Z'.format(regex))
+            dfa = self._get_dfa(regex)
+            matcher = fsa.NFAMatcher(fsa.regex_to_nfa(parse.from_string(regex)))
+            for compiled in (dfa.compile(), fsa.minimize_dfa(dfa).compile()):
+                for text in texts:
+                    self.assertEqual(compiled.fullmatch(text), matcher.fullmatch(text), (regex, text))
+                    self.assertEqual(compiled.fullmatch(text), bool(expected.match(text)), (regex, text))
+                    self.assertEqual(compiled.search(text), matcher.search(text), (regex, text))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,70 @@
+import itertools
+import unittest
+
+import fsa
+import ops
+import pipeline
+import stats
+
+
+class TestOps(unittest.TestCase):
+    texts = [''.join(t) for n in xrange(6) for t in itertools.product('abc\n', repeat=n)]
+
+    def _operands(self, pattern):
+        return [pipeline.compile(pattern, stage) for stage in ('nfa', 'dfa', 'mdfa')]
+
+    def test_counterexample(self):
+        for pattern1, pattern2, same in [('(a|b)*abb', '(a*b)*a*abb', True),
+                                         ('a(b|c)*', 'a[bc]*', True),
+                                         ('[^a]*', '(.|\n)*', False),
+                                         ('a*', 'a+', False),
+                                         ('(ab)*', '(ab)*a', False)]:
+            compiled1, compiled2 = pipeline.compile(pattern1), pipeline.compile(pattern2)
+            for a in self._operands(pattern1):
+                for b in self._operands(pattern2):
+                    word = ops.counterexample(a, b)
+                    self.assertEqual(word is None, same, (pattern1, pattern2))
+                    self.assertEqual(ops.is_equivalent(a, b), same)
+                    if word is not None:
+                        self.assertNotEqual(compiled1.fullmatch(word), compiled2.fullmatch(word))
+        self.assertEqual(ops.counterexample(pipeline.compile('a*', 'nfa'),
+                                            pipeline.compile('a+', 'nfa')), '')
+        # A character that neither pattern lists
+        word = ops.counterexample(pipeline.compile('.', 'nfa'), pipeline.compile('a|b', 'nfa'))
+        self.assertEqual(len(word), 1)
+        self.assertNotIn(word, 'ab\n')
+        self.assertRaises(TypeError, ops.counterexample, 'a', 'b')
+
+    def test_early_exit(self):
+        # The shortest difference is found before most of either DFA is built
+        a = pipeline.compile('x|(a|b)*a(a|b)(a|b)(a|b)(a|b)(a|b)(a|b)(a|b)(a|b)', 'nfa')
+        b = pipeline.compile('y|(a|b)*a(a|b)(a|b)(a|b)(a|b)(a|b)(a|b)(a|b)(a|b)', 'nfa')
+        with stats.collect() as collected:
+            self.assertEqual(ops.counterexample(a, b), 'x')
+        self.assertLess(collected.counters['product_pairs'], 10)
+
+    def test_inclusion(self):
+        a, b = pipeline.compile('a(b|c)', 'nfa'), pipeline.compile('a[a-c]*', 'mdfa')
+        self.assertTrue(ops.is_subset(a, b))
+        self.assertIsNone(ops.inclusion_counterexample(a, b))
+        self.assertFalse(ops.is_subset(b, a))
+        self.assertEqual(ops.inclusion_counterexample(b, a), 'a')
+
+    def test_products(self):
+        for pattern1, pattern2 in [('(a|b)*a', 'a*b*'), ('[^a]*', 'b|ac'), ('', '.')]:
+            compiled1, compiled2 = pipeline.compile(pattern1), pipeline.compile(pattern2)
+            a, b = pipeline.compile(pattern1, 'nfa'), pipeline.compile(pattern2, 'mdfa')
+            intersection = ops.intersection(a, b).compile()
+            difference = ops.difference(a, b).compile()
+            complement = ops.complement(b).compile()
+            for text in self.texts + [u'\xe9', 'x\x00']:
+                match1, match2 = compiled1.fullmatch(text), compiled2.fullmatch(text)
+                self.assertEqual(intersection.fullmatch(text), match1 and match2)
+                self.assertEqual(difference.fullmatch(text), match1 and not match2)
+                self.assertEqual(complement.fullmatch(text), not match2)
+            self.assertIsInstance(ops.complement(a), fsa.DFA)
+        self.assertTrue(ops.is_equivalent(ops.complement(ops.complement(a)), a))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import parallel
+import pipeline
+import shm
+
+
+class TestParallel(unittest.TestCase):
+    regexs = ["ab*", "(a|b)*abb", "[^c]*", "a(bc)*d|bb"]
+
+    def _expected(self, compiled, text):
+        positions = []
+        state = compiled.start
+        for i in xrange(len(text) + 1):
+            if i:
+                state = compiled.run(text[:i])
+            if state >= 0 and compiled.is_accept(state):
+                positions.append(i)
+        return parallel.ScanResult(compiled.run(text), len(positions), positions)
+
+    def _texts(self):
+        rand = random.Random(8)
+        for n in [0, 1, 7, 40, 100]:
+            yield ''.join(rand.choice('abcd') for _ in xrange(n))
+        yield 'ab' * 30
+
+    def test_run_chunks(self):
+        for regex in self.regexs:
+            for compiled in (pipeline.compile(regex), parallel.search_dfa(regex)):
+                for text in self._texts():
+                    expected = self._expected(compiled, text)
+                    for chunk_size in [1, 3, 16]:
+                        result = parallel.scan(compiled, text, chunk_size, processes=1,
+                                               with_positions=True)
+                        self.assertEqual(result, expected, (regex, text, chunk_size))
+                        result = parallel.scan(compiled, text, chunk_size, processes=1)
+                        self.assertEqual(result.count, expected.count)
+
+    def test_processes(self):
+        compiled = parallel.search_dfa("(a|b)*abb")
+        text = ''.join(random.Random(1).choice('ab') for _ in xrange(2000))
+        expected = self._expected(compiled, text)
+        for data in (text, bytearray(text), memoryview(text), unicode(text)):
+            self.assertEqual(parallel.scan(compiled, data, 300, processes=2,
+                                           with_positions=True), expected)
+        self.assertEqual(parallel.scan(compiled, '', 300, processes=2, with_positions=True),
+                         self._expected(compiled, ''))
+        # The shared copy of the text is removed
+        self.assertFalse([name for name in os.listdir(shm.SHM_DIR)
+                          if name.startswith('regextext-')])
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'input')
+            with open(path, 'wb') as f:
+                f.write(text)
+            self.assertEqual(parallel.scan_file(compiled, path, 300, processes=2,
+                                                with_positions=True), expected)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,4 @@
+import sys
 import unittest
 import parse
 import nodes as N
@@ -45,6 +46,42 @@ class TestParse(unittest.TestCase):
         self._compare('a(b)+', N.Concat(N.Char('a'), N.OneOrMore(N.Char('b'))))
         parse.from_string('a(bcd*|efgh?(jk)+)*')
 
+    def test_char_set(self):
+        self._compare('[cab]', N.CharSet('abc'))
+        self._compare('[a-d]', N.CharSet('abcd'))
+        self._compare('[^a-c]+', N.OneOrMore(N.CharSet('abc', negated=True)))
+        self._compare('[]-]', N.CharSet(']-'))
+        self._compare('[a\\]]', N.CharSet('a]'))
+        self._compare('x.', N.Concat(N.Char('x'), N.CharSet('\n', negated=True)))
+        self.assertRaises(parse.RegexSyntaxError, parse.from_string, '[ab')
+        self.assertRaises(parse.RegexSyntaxError, parse.from_string, '[z-a]')
+
+    def test_repeat(self):
+        self._compare('a{3}', N.Repeat(N.Char('a'), 3, 3))
+        self._compare('(ab){2,5}', N.Repeat(N.Concat(N.Char('a'), N.Char('b')), 2, 5))
+        self._compare('a{2,}b', N.Concat(N.Repeat(N.Char('a'), 2, None), N.Char('b')))
+        self._compare('a{,4}', N.Repeat(N.Char('a'), 0, 4))
+        # Anything else is literal, as in re
+        self._compare('a{', N.Concat(N.Char('a'), N.Char('{')))
+        self._compare('{,}', N.Concat(N.Concat(N.Char('{'), N.Char(',')), N.Char('}')))
+        self.assertRaises(parse.RegexSyntaxError, parse.from_string, 'a{5,3}')
+        self.assertRaises(parse.RegexSyntaxError, parse.from_string,
+                          'a{%d}' % (parse.MAX_REPEAT + 1))
+        # Nested counts are not multiplied out by the parser
+        parse.from_string('(a{1000}b){1000}')
+
+    def test_unbalanced_parentheses(self):
+        self.assertRaises(parse.RegexSyntaxError, parse.from_string, '(ab')
+        self.assertRaises(parse.RegexSyntaxError, parse.from_string, 'ab)')
+        self.assertRaises(parse.RegexSyntaxError, parse.from_string, '(a))(')
+
+    def test_deep_nesting(self):
+        depth = 5 * sys.getrecursionlimit()
+        node = parse.from_string('(' * depth + 'a' + ')' * depth)
+        self.assertIsInstance(node, N.Char)
+        node = parse.from_string('a' * depth)
+        self.assertIsInstance(node, N.Concat)
+
 
 if __name__ == '__main__':
     unittest.main()
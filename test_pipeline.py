@@ -0,0 +1,81 @@
+import fsa
+import pipeline
+import unittest
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        pipeline.clear_cache()
+        pipeline.set_cache_size(1024)
+
+    def test_stages(self):
+        self.assertIsInstance(pipeline.compile('ab*', 'nfa'), fsa.NFA)
+        self.assertIsInstance(pipeline.compile('ab*', 'dfa'), fsa.DFA)
+        self.assertIsInstance(pipeline.compile('ab*', 'mdfa'), fsa.DFA)
+        compiled = pipeline.compile('ab*')
+        self.assertIsInstance(compiled, fsa.CompiledDFA)
+        self.assertTrue(compiled.fullmatch('abbb'))
+        self.assertRaises(ValueError, pipeline.compile, 'ab*', 'xyz')
+        self.assertRaises(TypeError, pipeline.compile, 'ab*', xyz=1)
+
+    def test_construction(self):
+        dfa = pipeline.compile('a(b|c)*d', 'dfa', construction='glushkov')
+        self.assertIsInstance(dfa, fsa.DFA)
+        # Built from the tree, without the NFA stage
+        self.assertEqual(pipeline.cache_info().size, 2)
+        compiled = pipeline.compile('a(b|c)*d', construction='glushkov')
+        self.assertTrue(compiled.fullmatch('abcbd'))
+        self.assertEqual(compiled.num_states, pipeline.compile('a(b|c)*d').num_states)
+        self.assertRaises(ValueError, pipeline.compile, 'a', construction='xyz')
+
+    def test_copies(self):
+        nfa, dfa = pipeline.compile('a|b', 'nfa'), pipeline.compile('a|b', 'dfa')
+        self.assertIsNot(pipeline.compile('a|b', 'nfa'), nfa)
+        self.assertIsNot(pipeline.compile('a|b', 'dfa'), dfa)
+        self.assertIs(pipeline.compile('a|b'), pipeline.compile('a|b'))
+        # Changing a copy leaves the cached automata, and the stages built
+        # from them, as they were
+        self.assertIsNot(nfa.states[0], pipeline.compile('a|b', 'nfa').states[0])
+        self.assertIsNot(nfa.frozen.targets, pipeline.compile('a|b', 'nfa').frozen.targets)
+        nfa.states[0].e1.end = nfa.states[0]
+        nfa.frozen.targets[0] = 0
+        for state in dfa.states:
+            for token in dfa.tokens:
+                state.set_transition(token, dfa.start)
+        dfa.start.is_end = True
+        self.assertEqual(len(pipeline.compile('a|b', 'mdfa').states), 3)
+        self.assertTrue(pipeline.compile('a|b').fullmatch('b'))
+        self.assertFalse(pipeline.compile('a|b').fullmatch(''))
+        matcher = fsa.NFAMatcher(pipeline.compile('a|b', 'nfa'))
+        self.assertEqual(matcher.search('xxbx'), (2, 3))
+
+    def test_cache_reuse(self):
+        # One miss per call, however many stages it builds
+        pipeline.compile('a|b', 'dfa')
+        info = pipeline.cache_info()
+        self.assertEqual((info.hits, info.misses, info.size), (0, 1, 3))
+        pipeline.compile('a|b', 'dfa')
+        self.assertEqual(pipeline.cache_info().hits, 1)
+        # Minimizing reuses the cached DFA instead of parsing again
+        pipeline.compile('a|b', 'mdfa')
+        info = pipeline.cache_info()
+        self.assertEqual((info.hits, info.misses, info.size), (1, 2, 4))
+        pipeline.compile('ab*c')
+        pipeline.compile('ab*c')
+        info = pipeline.cache_info()
+        self.assertEqual((info.hits, info.misses, info.size), (2, 3, 9))
+
+    def test_eviction(self):
+        pipeline.set_cache_size(2)
+        ast = pipeline.compile('a', 'ast')
+        pipeline.compile('b', 'ast')
+        pipeline.compile('a', 'ast')
+        pipeline.compile('c', 'ast')
+        info = pipeline.cache_info()
+        self.assertEqual((info.evictions, info.size), (1, 2))
+        self.assertIs(pipeline.compile('a', 'ast'), ast)
+        self.assertEqual(pipeline.cache_info().misses, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import random
+import unittest
+
+import fsa
+import parse
+import pipeline
+import prefilter
+
+
+class TestPrefilter(unittest.TestCase):
+    regexs = ["x*(abc)+y", "abc", "a(b|c)d", "(ab|cd)e*", "[ab]*c", "a*",
+              "x[0-9]+yz", "(a|b)*abb", "[^a]bc", "a?b?c?"]
+
+    def _literals(self, regex):
+        return prefilter.node_literals(parse.from_string(regex))
+
+    def test_literals(self):
+        literals = self._literals("x*(abc)+y")
+        self.assertIsNone(literals.exact)
+        self.assertEqual(literals.prefixes, prefilter.NO_LITERALS)
+        self.assertEqual(literals.suffixes, {'abcy'})
+        self.assertEqual(literals.factors, {'abcy'})
+        self.assertEqual(self._literals("a(b|c)d").exact, {'abd', 'acd'})
+        self.assertEqual(self._literals("(ab|cd)e*").prefixes, {'ab', 'cd'})
+        self.assertEqual(self._literals("x[0-9]+yz").suffixes, {'yz'})
+        self.assertEqual(self._literals("a?b").exact, {'b', 'ab'})
+        self.assertIsNone(prefilter.from_node(parse.from_string("a*")))
+        self.assertIsNone(prefilter.from_node(parse.from_string("a?b?c?")))
+
+    def test_candidates(self):
+        filter_ = prefilter.Prefilter(['ab', 'b'], ['c'])
+        self.assertEqual(list(filter_.candidates("abxbbc ab")), [0, 1, 3, 4])
+        self.assertEqual(list(filter_.candidates("abxbbc ab", 2)), [3, 4])
+        self.assertEqual(list(filter_.candidates("ab")), [])
+
+    def test_search(self):
+        rand = random.Random(5)
+        texts = [''.join(rand.choice('abcdxyz09') for _ in xrange(n))
+                 for n in [0, 1, 3, 10, 50] for _ in xrange(10)]
+        for regex in self.regexs:
+            compiled = pipeline.compile(regex)
+            plain = pipeline.compile(regex, 'mdfa').compile()
+            nfa_matcher = fsa.NFAMatcher(pipeline.compile(regex, 'nfa'))
+            nfa_matcher.prefilter = compiled.prefilter
+            for text in texts:
+                expected = plain.search(text)
+                self.assertEqual(compiled.search(text), expected)
+                self.assertEqual(nfa_matcher.search(text), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import itertools
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import fsa
+from regexset import RegexSet
+
+
+class TestRegexSet(unittest.TestCase):
+    patterns = ["ab*", "a(b|c)", "[a-c]*", "b+a?", "", "(ab)*c"]
+
+    def test_matches(self):
+        regex_set = RegexSet(self.patterns)
+        res = [re.compile('(?:{})\\Z'.format(p)) for p in self.patterns]
+        for n in xrange(5):
+            for chars in itertools.product('abcd', repeat=n):
+                text = ''.join(chars)
+                expected = tuple(i for i, r in enumerate(res) if r.match(text))
+                self.assertEqual(regex_set.matches(text), expected)
+
+    def test_minimize_keeps_patterns_apart(self):
+        # Both patterns accept the same strings, so only the ids tell the
+        # accepting states apart
+        regex_set = RegexSet(["a|b", "b|a", "c"])
+        self.assertEqual(regex_set.matches("a"), (0, 1))
+        self.assertEqual(regex_set.matches("c"), (2,))
+        self.assertEqual(regex_set.matches("ab"), ())
+        accept_sets = set(s.accepts for s in regex_set.dfa.states)
+        self.assertEqual(accept_sets, {frozenset(), frozenset([0, 1]), frozenset([2])})
+        self.assertEqual(len(regex_set.dfa.states), 4)
+
+    def test_tokenize(self):
+        regex_set = RegexSet(["if", "[a-z]+", "[0-9]+", " +"])
+        self.assertEqual(regex_set.match("iffy"), (1, 4))
+        self.assertEqual(regex_set.match("if x"), (0, 2))
+        self.assertEqual(list(regex_set.tokenize("if x1 12")), [
+            (0, 0, 2), (3, 2, 3), (1, 3, 4), (2, 4, 5), (3, 5, 6), (2, 6, 8)])
+        self.assertRaises(ValueError, list, regex_set.tokenize("x?"))
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'set.bin')
+            regex_set = RegexSet(self.patterns)
+            regex_set.compiled.save(path)
+            loaded = fsa.DFA.load(path)
+            for text in ["", "a", "ab", "abc", "bb", "ababc"]:
+                state = loaded.run(text)
+                self.assertEqual(loaded.accepted_patterns(state) if state >= 0 else (),
+                                 regex_set.matches(text))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
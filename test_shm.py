@@ -0,0 +1,52 @@
+import ctypes
+import multiprocessing
+import os
+import unittest
+
+import pipeline
+import shm
+
+
+def _worker_match(args):
+    name, texts = args
+    compiled = shm.attach(name)
+    return [compiled.search(text) for text in texts]
+
+
+class TestShm(unittest.TestCase):
+    texts = ["", "ab", "xxabbbc", "cc", u"a\u00e9b"]
+
+    def test_export_and_attach(self):
+        compiled = pipeline.compile("ab*|c")
+        with shm.exported(compiled) as name:
+            attached = shm.attach(name)
+            # The table is read in place from the segment, not copied
+            self.assertIsInstance(attached.table, ctypes.Array)
+            for text in self.texts:
+                self.assertEqual(attached.search(text), compiled.search(text))
+            self.assertEqual(shm.attach(name, verify=True).search("xab"), (1, 3))
+            self.assertRaises(OSError, shm.export, compiled, name)
+        self.assertFalse(os.path.exists(os.path.join(shm.SHM_DIR, name)))
+        # Still mapped after the segment is removed
+        self.assertEqual(attached.search("xab"), (1, 3))
+        self.assertRaises(IOError, shm.attach, name)
+        self.assertRaises(ValueError, shm.attach, '../x')
+
+    def test_workers(self):
+        dfa = pipeline.compile("(a|b)*abb", 'mdfa')
+        compiled = dfa.compile()
+        name = shm.export(dfa, 'test-shm-{}'.format(os.getpid()))
+        try:
+            pool = multiprocessing.Pool(2)
+            try:
+                results = pool.map(_worker_match, [(name, self.texts)] * 2)
+            finally:
+                pool.close()
+                pool.join()
+        finally:
+            shm.unlink(name)
+        self.assertEqual(results, [[compiled.search(text) for text in self.texts]] * 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
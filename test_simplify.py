@@ -0,0 +1,66 @@
+import itertools
+import random
+import unittest
+
+import fsa
+import nodes
+import parse
+import pipeline
+import simplify
+
+
+class TestSimplify(unittest.TestCase):
+    def _simplify(self, regex):
+        return str(simplify.simplify(parse.from_string(regex)))
+
+    def test_rewrites(self):
+        self.assertEqual(self._simplify('a+++'), 'OneOrMore(Char(a))')
+        self.assertEqual(self._simplify('a*?+'), 'ZeroOrMore(Char(a))')
+        self.assertEqual(self._simplify('(a|a)'), 'Char(a)')
+        self.assertEqual(self._simplify('a|b|[cd]'), 'CharSet(abcd,False)')
+        self.assertEqual(self._simplify('ab|ac'), 'Concat(Char(a),CharSet(bc,False))')
+        self.assertEqual(self._simplify('ac|bc'), 'Concat(CharSet(ab,False),Char(c))')
+        self.assertEqual(self._simplify('ab|'), 'ZeroOrOne(Concat(Char(a),Char(b)))')
+        self.assertEqual(self._simplify('()*'), 'Empty()')
+        self.assertEqual(self._simplify('a{0,}'), 'ZeroOrMore(Char(a))')
+        self.assertEqual(self._simplify('a{1}b{0}'), 'Char(a)')
+        self.assertEqual(self._simplify('(a|a){2,3}'), 'Repeat(Char(a),2,3)')
+
+    def test_hash_consing(self):
+        node = simplify.simplify(parse.from_string('(ab)*x(ab)*'))
+        self.assertIsInstance(node, nodes.Concat)
+        self.assertIs(node.arg1.arg1, node.arg2)
+
+    def test_same_language(self):
+        rng = random.Random(2)
+
+        def generate(depth):
+            if depth == 0 or rng.random() < 0.3:
+                return rng.choice(['a', 'b', '[ab]', '[^a]', '()'])
+            k = rng.random()
+            if k < 0.3:
+                return generate(depth - 1) + generate(depth - 1)
+            elif k < 0.6:
+                return '(' + generate(depth - 1) + '|' + generate(depth - 1) + ')'
+            return '(' + generate(depth - 1) + ')' + rng.choice(
+                ['*', '+', '?', '{2}', '{0,2}', '{1,}'])
+
+        texts = [''.join(t) for n in xrange(5) for t in itertools.product('abc', repeat=n)]
+        for _ in xrange(100):
+            regex = generate(4)
+            expected = pipeline.compile(regex)
+            compiled = pipeline.compile(regex, simplify=True)
+            for text in texts:
+                self.assertEqual(compiled.fullmatch(text), expected.fullmatch(text), regex)
+
+    def test_smaller_nfa(self):
+        regex = 'abc|abd|abe|abc|xbe'
+        nfa = pipeline.compile(regex, 'nfa')
+        simple_nfa = pipeline.compile(regex, 'nfa', simplify=True)
+        self.assertLess(len(simple_nfa.states), len(nfa.states))
+        self.assertEqual(len(fsa.minimize_dfa(fsa.nfa_to_dfa(simple_nfa)).states),
+                         len(pipeline.compile(regex, 'mdfa').states))
+
+
+if __name__ == '__main__':
+    unittest.main()
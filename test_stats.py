@@ -0,0 +1,48 @@
+import unittest
+
+import pipeline
+import stats
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        pipeline.clear_cache()
+
+    def test_collect(self):
+        with stats.collect() as collected:
+            mdfa = pipeline.compile('a(b|c)*d', 'mdfa')
+        self.assertIsNone(stats.current)
+        self.assertEqual(list(collected.timings),
+                         ['parse', 'regex_to_nfa', 'nfa_finish', 'nfa_to_dfa', 'minimize_dfa'])
+        counters = collected.as_dict()['counters']
+        self.assertEqual(counters['regex_length'], 8)
+        self.assertEqual(counters['nfa_states'], len(pipeline.compile('a(b|c)*d', 'nfa').states))
+        self.assertEqual(counters['mdfa_states'], len(mdfa.states))
+        self.assertEqual(counters['mdfa_dead_states'], 1)
+        self.assertGreater(counters['refinement_rounds'], 0)
+        self.assertIn('max_closure', collected.format())
+
+    def test_disabled(self):
+        self.assertIsNone(stats.current)
+        collected = stats.Stats()
+        with stats.collect(collected):
+            pass
+        self.assertIsNone(stats.current)
+        # Nothing is recorded outside collect(), not even into a Stats that
+        # was collecting before
+        pipeline.compile('a(b|c)*d', 'mdfa')
+        self.assertIsNone(stats.current)
+        self.assertEqual(collected.as_dict(), {'timings': {}, 'counters': {}})
+
+    def test_nested(self):
+        collected = stats.Stats()
+        with stats.collect(collected):
+            with stats.collect() as inner:
+                pipeline.compile('ab', 'dfa')
+            self.assertIs(stats.current, collected)
+        self.assertEqual(collected.as_dict(), {'timings': {}, 'counters': {}})
+        self.assertEqual(inner.counters['dfa_states'], 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
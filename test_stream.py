@@ -0,0 +1,84 @@
+import os
+import random
+import re
+import shutil
+import tempfile
+import unittest
+
+import pipeline
+import stream
+
+
+class TestStream(unittest.TestCase):
+    # Patterns whose leftmost-first matches in `re` are leftmost-longest
+    regexs = ["ab*", "a*", "[ab]*c", "b+a?", "ba|c", "(ab)+", "[^a]b"]
+
+    def _expected(self, regex, text):
+        return [m.span() for m in re.finditer(regex, text)]
+
+    def _texts(self):
+        rand = random.Random(12)
+        for n in [0, 1, 2, 5, 30, 200]:
+            for _ in xrange(5):
+                yield ''.join(rand.choice('abcd') for _ in xrange(n))
+
+    def test_chunks(self):
+        rand = random.Random(3)
+        for regex in self.regexs:
+            matcher = stream.StreamMatcher(pipeline.compile(regex))
+            for text in self._texts():
+                spans = []
+                i = 0
+                while i < len(text):
+                    size = rand.choice([1, 2, 3, 10])
+                    spans.extend(matcher.feed(text[i:i + size]))
+                    i += size
+                spans.extend(matcher.finish())
+                self.assertEqual(spans, self._expected(regex, text), (regex, text))
+
+    def test_max_pending(self):
+        # By default the match is held until it is known to be the longest
+        matcher = stream.StreamMatcher(pipeline.compile('a.*b'))
+        spans = matcher.feed('xab')
+        for _ in xrange(200):
+            spans.extend(matcher.feed('a' * 1000))
+        spans.extend(matcher.feed('b'))
+        spans.extend(matcher.finish())
+        self.assertEqual(spans, [(1, 200004)])
+        # After ab the match can still be extended by any number of a's and a
+        # b, so the a's are held until more than max_pending follow it
+        matcher = stream.StreamMatcher(pipeline.compile('a.*b'), max_pending=5000)
+        spans = matcher.feed('xab')
+        for _ in xrange(200):
+            spans.extend(matcher.feed('a' * 1000))
+            self.assertLessEqual(len(matcher._tail), 5000)
+        spans.extend(matcher.finish())
+        self.assertEqual(spans, [(1, 3)])
+        # A match is reported once 8 characters follow it, without waiting
+        # for the c that ends it; the matches are the same as before
+        matcher = stream.StreamMatcher(pipeline.compile('a[^c]*b'), max_pending=8)
+        text = 'xabaab' + 'a' * 20 + 'cab' + 'a' * 5 + 'b'
+        spans = []
+        for i, c in enumerate(text):
+            spans.extend(matcher.feed(c))
+            if i == 6 + 8:
+                self.assertEqual(spans, [(1, 6)])
+        spans.extend(matcher.finish())
+        self.assertEqual(spans, self._expected('a[^c]*b', text))
+
+    def test_scan_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'log')
+            for text in self._texts():
+                with open(path, 'wb') as f:
+                    f.write(text)
+                for regex in self.regexs:
+                    spans = list(stream.scan_file(pipeline.compile(regex), path, 7))
+                    self.assertEqual(spans, self._expected(regex, text))
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import itertools
+import random
+import re
+import unittest
+
+import parse
+import pipeline
+import stats
+import tdfa
+import nodes as N
+
+
+def _spans(match):
+    if match is None:
+        return None
+    return tuple([match.span()] + [match.span(i) if match.group(i) is not None else None
+                                   for i in xrange(1, len(match.groups()) + 1)])
+
+
+class TestTaggedDFA(unittest.TestCase):
+    texts = [''.join(t) for n in xrange(7) for t in itertools.product('abc', repeat=n)]
+
+    def _check(self, pattern):
+        for fullmatch in (False, True):
+            compiled = tdfa.compile(pattern, fullmatch)
+            expected = re.compile('(?:{})\\Z'.format(pattern) if fullmatch else pattern)
+            for text in self.texts:
+                self.assertEqual(compiled.match(text), _spans(expected.match(text)),
+                                 (pattern, fullmatch, text))
+
+    def test_spans(self):
+        for pattern in ['(a|ab)(c|bcd)(d*)', '(a|aa)*c', '((a)|b)*', '(ab|a)(b*)',
+                        '(a)|b', '((a|b)(c)?){2,3}', 'a(b)*', '()a', '(a+)(a+)']:
+            self._check(pattern)
+        compiled = tdfa.compile('(a|b)+(c)?')
+        self.assertEqual(compiled.match('xabbc', 1), ((1, 5), (3, 4), (4, 5)))
+        self.assertEqual(compiled.match('xabbc', 0), None)
+        self.assertEqual(compiled.groups, 2)
+
+    def test_same_as_re(self):
+        rng = random.Random(0)
+
+        def generate(depth):
+            # (regex, nullable); the body of a loop never matches empty, see
+            # TaggedDFA
+            if depth == 0 or rng.random() < 0.3:
+                return rng.choice(['a', 'b', '[ab]', 'c', 'ab']), False
+            k = rng.random()
+            regex1, nullable1 = generate(depth - 1)
+            if k < 0.3:
+                regex2, nullable2 = generate(depth - 1)
+                return regex1 + regex2, nullable1 and nullable2
+            elif k < 0.55:
+                regex2, nullable2 = generate(depth - 1)
+                return '(' + regex1 + '|' + regex2 + ')', nullable1 or nullable2
+            elif k < 0.7:
+                return '(' + regex1 + ')', nullable1
+            elif nullable1:
+                return '(' + regex1 + ')?', True
+            op = rng.choice(['*', '+', '?', '{2}', '{0,2}', '{1,}'])
+            return '(' + regex1 + ')' + op, op not in ('+', '{2}', '{1,}')
+
+        for _ in xrange(100):
+            self._check(generate(4)[0])
+
+    def test_adversarial(self):
+        # Exponential for a backtracking matcher
+        compiled = tdfa.compile('(a|aa)*c')
+        self.assertIsNone(compiled.match('a' * 5000))
+        self.assertEqual(compiled.match('a' * 5000 + 'c'), ((0, 5001), (4999, 5000)))
+        with stats.collect() as collected:
+            tdfa.compile('(x+x+)+y')
+        self.assertLess(collected.counters['tdfa_states'], 10)
+
+    def test_captures_option(self):
+        self.assertEqual(repr(parse.from_string('(a)(b|(c))', captures=True)),
+                         repr(N.Concat(N.Group(N.Char('a'), 1),
+                                       N.Group(N.Or(N.Char('b'), N.Group(N.Char('c'), 3)), 2))))
+        # Groups do not change the language
+        compiled = pipeline.compile('(a|b)*c', captures=True)
+        self.assertTrue(compiled.fullmatch('abac'))
+        self.assertRaises(ValueError, pipeline.compile, 'a', captures=True, simplify=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import itertools
+import re
+import unittest
+
+import pipeline
+import utf8
+
+
+class TestUTF8(unittest.TestCase):
+    def setUp(self):
+        pipeline.clear_cache()
+
+    def test_encode(self):
+        for code_point in [0, 0x7F, 0x80, 0x7FF, 0x800, 0xFFFF, 0x10000, 0x10FFFF]:
+            self.assertEqual(utf8.encode(code_point),
+                             '\\U{:08x}'.format(code_point).decode('unicode_escape').encode('utf-8'))
+
+    def test_byte_sequences(self):
+        for lo, hi in [(0, 0x10FFFF), (0x80, 0x7FF), (0x3FF, 0x401), (0x7F0, 0x10010)]:
+            sequences = list(utf8.byte_sequences(lo, hi))
+            total = 0
+            for sequence in sequences:
+                size = 1
+                for byte_lo, byte_hi in sequence:
+                    size *= byte_hi - byte_lo + 1
+                total += size
+            self.assertEqual(total, hi - lo + 1)
+        self.assertEqual(list(utf8.byte_sequences(0x80, 0x7FF)), [[(0xC2, 0xDF), (0x80, 0xBF)]])
+
+    def test_code_point_ranges(self):
+        self.assertEqual(utf8.code_point_ranges(u'abd\u00e9'), [(0x61, 0x62), (0x64, 0x64), (0xE9, 0xE9)])
+        self.assertEqual(utf8.code_point_ranges('\n', negated=True),
+                         [(0, 9), (11, 0xD7FF), (0xE000, 0x10FFFF)])
+
+    def test_match(self):
+        alphabet = [u'a', u'\n', u'\u00e9', u'\u07ff', u'\u0800', u'\uffee', u'\U00010000']
+        texts = [u''.join(t) for n in xrange(4) for t in itertools.product(alphabet, repeat=n)]
+        for pattern in [u'.', u'[^a]+', u'a.\u00e9', u'[\u00e0-\u0800]*', u'\u00e9|\u0800a',
+                        u'(a|\u00e9)*\uffee', u'[a-\U00010000]{2,3}', u'[^\u00e9\n]?a']:
+            expected = re.compile(u'(?:{})\\Z'.format(pattern), re.UNICODE)
+            compiled = pipeline.compile(pattern, utf8=True)
+            self.assertLessEqual(len(compiled.tokens), 256)
+            self.assertEqual(compiled.other_column, -1)
+            for text in texts:
+                data = text.encode('utf-8')
+                accepted = bool(expected.match(text))
+                for buffer_ in (data, bytearray(data), memoryview(data)):
+                    self.assertEqual(compiled.fullmatch(buffer_), accepted, (pattern, text))
+
+    def test_bytes(self):
+        # A str pattern is decoded as UTF-8
+        compiled = pipeline.compile('caf\xc3\xa9', utf8=True)
+        self.assertIs(compiled, pipeline.compile('caf\xc3\xa9', utf8=True))
+        data = 'un caf\xc3\xa9 noir'
+        self.assertEqual(compiled.search(data), (3, 8))
+        self.assertEqual(compiled.search(bytearray(data)), (3, 8))
+        self.assertEqual(compiled.search(memoryview(data)), (3, 8))
+        self.assertEqual(compiled.match(memoryview(data)[3:]), 5)
+        # Invalid UTF-8 is not matched
+        self.assertFalse(pipeline.compile(u'.', utf8=True).fullmatch('\xff'))
+        self.assertFalse(pipeline.compile(u'.', utf8=True).fullmatch('\xc3'))
+
+    def test_construction(self):
+        data = u'\u00e9\u00e9\u20ac'.encode('utf-8')
+        for construction in pipeline.CONSTRUCTIONS:
+            compiled = pipeline.compile(u'\u00e9+.', utf8=True, construction=construction)
+            self.assertEqual(compiled.match(bytearray(data)), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,191 @@
+"""
+Patterns over UTF-8 encoded bytes.
+
+to_bytes() rewrites a tree whose characters are code points into one whose
+characters are bytes: a non-ASCII character becomes the sequence of its
+UTF-8 bytes, and a class becomes an alternative of byte sequences, one per
+range of code points sharing their leading bytes (as in RE2 and Rust's
+utf8-ranges). A negated class, `.` included, is turned into the ranges of
+code points it does match, so the byte automaton accepts valid UTF-8 only.
+
+Its DFA has at most 256 columns and no negated token, and a CompiledDFA of it
+matches str, bytearray and memoryview text directly, without decoding:
+
+    compiled = pipeline.compile(u'caf\xe9|[\xe0-\xff]+', utf8=True)
+    compiled.match(bytearray(data))
+
+Positions are byte offsets. Since every encoded character starts with a byte
+that is not a continuation byte, a match found by search() in valid UTF-8
+starts and ends at character boundaries.
+"""
+import nodes
+
+MAX_CODE_POINT = 0x10FFFF
+
+# UTF-16 surrogates, which are not characters and have no UTF-8 encoding
+SURROGATES = (0xD800, 0xDFFF)
+
+# The largest code point encoded in 1, 2 and 3 bytes
+LENGTH_LIMITS = (0x7F, 0x7FF, 0xFFFF)
+
+
+def encode(code_point):
+    """
+    The UTF-8 bytes of code_point, which may be beyond the BMP even on a
+    narrow build.
+
+    :type code_point: int
+    :rtype: str
+    """
+    if code_point <= 0x7F:
+        return chr(code_point)
+    elif code_point <= 0x7FF:
+        return chr(0xC0 | code_point >> 6) + chr(0x80 | code_point & 0x3F)
+    elif code_point <= 0xFFFF:
+        return (chr(0xE0 | code_point >> 12) + chr(0x80 | code_point >> 6 & 0x3F) +
+                chr(0x80 | code_point & 0x3F))
+    return (chr(0xF0 | code_point >> 18) + chr(0x80 | code_point >> 12 & 0x3F) +
+            chr(0x80 | code_point >> 6 & 0x3F) + chr(0x80 | code_point & 0x3F))
+
+
+def code_point_ranges(chars, negated=False):
+    """
+    Return the sorted, disjoint (lo, hi) ranges of the code points matched by
+    a class, without the surrogates.
+
+    :type chars: str | unicode
+    :rtype: list[(int, int)]
+    """
+    ranges = []
+    for code_point in sorted(set(ord(c) for c in chars)):
+        if SURROGATES[0] <= code_point <= SURROGATES[1]:
+            continue
+        if ranges and ranges[-1][1] == code_point - 1:
+            ranges[-1] = ranges[-1][0], code_point
+        else:
+            ranges.append((code_point, code_point))
+    if negated:
+        complement = []
+        lo = 0
+        for lo1, hi1 in ranges + [(MAX_CODE_POINT + 1, MAX_CODE_POINT + 1)]:
+            if lo < lo1:
+                complement.append((lo, lo1 - 1))
+            lo = hi1 + 1
+        ranges = []
+        for lo, hi in complement:
+            # Cut out the surrogates
+            if lo < SURROGATES[0]:
+                ranges.append((lo, min(hi, SURROGATES[0] - 1)))
+            if hi > SURROGATES[1]:
+                ranges.append((max(lo, SURROGATES[1] + 1), hi))
+    return ranges
+
+
+def byte_sequences(lo, hi):
+    """
+    Split the code points from lo to hi into ranges whose encodings all have
+    the same length and differ only in a run of trailing bytes that take
+    every continuation value. Yield each as a list of (lo, hi) byte ranges,
+    one per byte, whose product is the encodings of the range.
+
+    :type lo: int
+    :type hi: int
+    :rtype: Iterator[list[(int, int)]]
+    """
+    stack = [(lo, hi)]
+    while stack:
+        lo, hi = stack.pop()
+        split = None
+        for limit in LENGTH_LIMITS:
+            if lo <= limit < hi:
+                split = limit
+                break
+        if split is None:
+            for i in xrange(1, 4):
+                mask = (1 << 6 * i) - 1
+                if lo & ~mask != hi & ~mask:
+                    if lo & mask:
+                        split = lo | mask
+                        break
+                    if hi & mask != mask:
+                        split = (hi & ~mask) - 1
+                        break
+        if split is not None:
+            stack.append((split + 1, hi))
+            stack.append((lo, split))
+            continue
+        yield [(ord(b1), ord(b2)) for b1, b2 in zip(encode(lo), encode(hi))]
+
+
+def _byte_node(lo, hi):
+    if lo == hi:
+        return nodes.Char(chr(lo))
+    return nodes.CharSet(''.join(chr(b) for b in xrange(lo, hi + 1)))
+
+
+def _class_node(chars, negated=False):
+    """
+    The byte tree of a class: the ASCII characters as one CharSet, or'ed with
+    a Concat of byte classes for each longer sequence.
+    """
+    ascii_chars = []
+    alternatives = []
+    for lo, hi in code_point_ranges(chars, negated):
+        for sequence in byte_sequences(lo, hi):
+            if len(sequence) == 1:
+                ascii_chars.extend(chr(b) for b in xrange(sequence[0][0], sequence[0][1] + 1))
+                continue
+            node = _byte_node(*sequence[0])
+            for byte_range in sequence[1:]:
+                node = nodes.Concat(node, _byte_node(*byte_range))
+            alternatives.append(node)
+    if len(ascii_chars) == 1:
+        alternatives.insert(0, nodes.Char(ascii_chars[0]))
+    elif ascii_chars:
+        alternatives.insert(0, nodes.CharSet(ascii_chars))
+    if not alternatives:
+        # Only surrogates, which no UTF-8 text holds
+        return nodes.CharSet('')
+    node = alternatives[0]
+    for alternative in alternatives[1:]:
+        node = nodes.Or(node, alternative)
+    return node
+
+
+def _rewrite(node, args):
+    if isinstance(node, nodes.Char):
+        return _class_node(node.token)
+    elif isinstance(node, nodes.CharSet):
+        return _class_node(node.chars, node.negated)
+    elif isinstance(node, nodes.Repeat):
+        return nodes.Repeat(args[0], node.min, node.max)
+    elif isinstance(node, nodes.Group):
+        return nodes.Group(args[0], node.index)
+    elif isinstance(node, (nodes.UnaryRegexNode, nodes.BinaryRegexNode)):
+        return type(node)(*args)
+    return node
+
+
+def to_bytes(regex_node):
+    """
+    Rewrite a tree over code points into the tree matching their UTF-8
+    encodings. The characters of a str tree are taken as code points too, so
+    a str pattern should be decoded first (see pipeline.compile).
+
+    :type regex_node: nodes.RegexNode
+    :rtype: nodes.RegexNode
+    """
+    # Post-order walk, as in simplify.Simplifier.simplify
+    results = []
+    stack = [(regex_node, False)]
+    while stack:
+        node, children_done = stack.pop()
+        children = node.children()
+        if children and not children_done:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(children))
+            continue
+        args = results[len(results) - len(children):]
+        del results[len(results) - len(children):]
+        results.append(_rewrite(node, args))
+    return results[0]